@@ -1,9 +1,10 @@
 # app.py
+import time
+_script_started = time.perf_counter() # 再実行の所要時間の計測用 (以下のimportを含む)
 import streamlit as st
 from pathlib import Path
-import uuid
-import pandas as pd
-from utils import db, auth
+import json
+from utils import db, auth, jobs, metrics, prefetch, uploads
 import os 
 import datetime # 追加
 import pytz     # 追加
@@ -19,6 +20,17 @@ DEBUG = os.environ.get('DEBUG_OPTION', "False")
 # UPLOAD_DIR = Path("./uploads")
 ADMIN_NICKNAME = os.environ.get('ADMIN_KEY')
 ADMIN_PASSWORD = os.environ.get('PASS_KEY')
+TIMELINE_PAGE_SIZE = 20 # タイムラインの1ページあたりの投稿数
+USER_PAGE_SIZE = 50 # ユーザー管理の1ページあたりのユーザー数
+SHOP_RANKING_SIZE = 30 # お店ランキングに表示する店舗数
+SHOP_RANKING_LABELS = { # お店ランキングの並べ替え (表示名 -> db.get_shop_ranking の sort)
+    "投稿数順": 'posts',
+    "いいね数順": 'likes',
+    "平均価格の安い順": 'cheap',
+    "平均価格の高い順": 'expensive',
+}
+SESSION_COOKIE = 'lunch_sns_session' # 自動ログイン用の署名付きセッショントークン
+LEGACY_COOKIE = 'lunch_sns_user_id' # 以前のニックネームを保存していたCookie (改ざんできるため使わない)
 
 # 2. CookieManagerを初期化
 # このコードはst.set_page_config()より後、他のStreamlit要素より前に配置するのが理想
@@ -27,8 +39,20 @@ cookies = CookieManager()
 
 # --- 初期設定 ---
 # UPLOAD_DIR.mkdir(exist_ok=True) # 不要
-admin_pass_hash = auth.hash_password(ADMIN_PASSWORD)
-db.init_db(ADMIN_NICKNAME, admin_pass_hash) # この中でFirestoreが初期化される
+# この再実行でのデータアクセスを、表示中のページに割り当てて計測する
+metrics.start_rerun(st.session_state.get('page', "タイムライン"), started=_script_started)
+
+@st.cache_resource(show_spinner=False)
+def init_storage():
+    """ストレージエンジンの初期化と管理者ユーザーの作成を、プロセスごとに1回だけ行います。"""
+    # Streamlitは操作のたびにスクリプトを再実行するが、この関数の中身は最初の1回しか実行されない
+    metrics.record_startup('imports', (time.perf_counter() - _script_started) * 1000)
+    start = time.perf_counter()
+    admin_pass_hash = auth.hash_password(ADMIN_PASSWORD)
+    db.init_db(ADMIN_NICKNAME, admin_pass_hash) # この中でストレージエンジン(Firestore or SQLite)が初期化される
+    metrics.record_startup('init_db', (time.perf_counter() - start) * 1000)
+
+init_storage()
 
 # --- セッション管理 ---
 if 'logged_in' not in st.session_state:
@@ -37,26 +61,34 @@ if 'logged_in' not in st.session_state:
     st.session_state.page = "タイムライン"
 if 'editing_post_id' not in st.session_state:
     st.session_state.editing_post_id = None
+if 'timeline_pages' not in st.session_state:
+    st.session_state.timeline_pages = 1 # タイムラインで読み込むページ数
+if 'search_pages' not in st.session_state:
+    st.session_state.search_pages = 1 # 検索結果で読み込むページ数
+    st.session_state.search_exact_shop = False # 店舗名の候補を選んで、店舗名が一致する投稿だけを表示しているか
+if 'user_page_cursors' not in st.session_state:
+    st.session_state.user_page_cursors = [None] # ユーザー管理で表示したページの開始カーソル (末尾が表示中のページ)
 
 
 # 3. アプリ起動時にCookieをチェックして自動ログインする処理を追加
 # このコードブロックをセッション管理の直後あたりに配置します。
 
 if not st.session_state.logged_in:
-    login_cookie = cookies.get('lunch_sns_user_id')
-    if login_cookie:
-        # Cookieに保存されたuser_idを使ってユーザー情報をDBから取得
-        # (このための関数をdb.pyに追加する必要があります)
-        # ここでは簡易的に、get_user()を流用できる前提で進めますが、
-        # 本来はget_user_by_id関数が良いでしょう。
-        # まずは簡易的にニックネームで代用します
-        user_info_from_cookie = db.get_user(login_cookie) # Cookieにはニックネームを保存する方針に
+    session_token = cookies.get(SESSION_COOKIE)
+    if session_token:
+        # Cookieのセッショントークンの署名を検証してログインする (通常はデータベースを読まない)
+        user_info_from_cookie, refreshed_token = db.resolve_session(session_token)
         if user_info_from_cookie:
             st.session_state.logged_in = True
-            st.session_state.user_info = dict(user_info_from_cookie)
+            st.session_state.user_info = user_info_from_cookie
             st.session_state.page = "タイムライン"
+            if refreshed_token:
+                cookies[SESSION_COOKIE] = refreshed_token
             # 自動ログイン時はメッセージなしで再描画
             st.rerun()
+        else:
+            # 期限切れ・無効化済みのトークンは削除する
+            del cookies[SESSION_COOKIE]
 
 
 # --- ヘルパー関数 ---
@@ -74,6 +106,41 @@ def is_lunch_time():
     else :
         return start_time <= now_jst < end_time
 
+def load_more_timeline():
+    """タイムラインの読み込みページ数を1つ増やすコールバック関数"""
+    st.session_state.timeline_pages += 1
+
+def reset_search():
+    """検索語が変わったときに、検索結果を先頭ページから表示し直すコールバック関数"""
+    st.session_state.search_pages = 1
+    st.session_state.search_exact_shop = False
+
+def select_shop(shop_name):
+    """店舗名の候補を選んだときに、その店舗の投稿を表示するコールバック関数"""
+    st.session_state.search_query = shop_name
+    st.session_state.search_pages = 1
+    st.session_state.search_exact_shop = True
+
+def load_more_search():
+    """検索結果の読み込みページ数を1つ増やすコールバック関数"""
+    st.session_state.search_pages += 1
+
+def reset_user_pages():
+    """ユーザー管理の検索条件が変わったときに先頭ページに戻すコールバック関数"""
+    st.session_state.user_page_cursors = [None]
+    st.session_state.pop('user_management_editor', None) # チェックを外す
+
+def next_user_page(cursor):
+    """ユーザー管理の次のページを表示するコールバック関数"""
+    st.session_state.user_page_cursors.append(cursor)
+    st.session_state.pop('user_management_editor', None)
+
+def prev_user_page():
+    """ユーザー管理の前のページを表示するコールバック関数"""
+    if len(st.session_state.user_page_cursors) > 1:
+        st.session_state.user_page_cursors.pop()
+    st.session_state.pop('user_management_editor', None)
+
 def set_editing_post(post_id):
     """編集対象の投稿IDをセッションにセットするコールバック関数"""
     st.session_state.editing_post_id = post_id
@@ -99,10 +166,10 @@ def draw_login_form():
                 st.session_state.user_info = dict(user)
                 st.session_state.page = "タイムライン"
                      
-                # ▼▼▼▼▼ Cookieを設定する処理を正しい構文に修正 ▼▼▼▼▼
-                # 辞書のようにキーを指定して値を設定します
-                cookies['lunch_sns_user_id'] = user['nickname']
-                # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
+                # 自動ログイン用に署名付きのセッショントークンをCookieに保存する
+                cookies[SESSION_COOKIE] = db.create_session(user)
+                if LEGACY_COOKIE in cookies:
+                    del cookies[LEGACY_COOKIE]
                 
                 st.success("ログインしました。")
                 st.rerun()
@@ -172,23 +239,18 @@ def draw_post_form():
                     st.error("ファイルサイズが大きすぎます。5MB以下の画像をアップロードしてください。")
                 else:
                     # ▼▼▼▼▼ 画像アップロード処理をFirebase Cloud Storageに変更 ▼▼▼▼▼
+                    # 投稿は先に「処理中」として作成し、画像のアップロードとリサイズはバックグラウンドで行う
+                    # (投稿者の待ち時間はドキュメントの書き込みだけになる)
                     ext = Path(uploaded_file.name).suffix
-                    # ファイル名をユニークにする
-                    filename = f"images/{uuid.uuid4()}{ext}"
-                    
-                    # Cloud Storageにアップロード
-                    blob = db.bucket.blob(filename)
-                    blob.upload_from_file(uploaded_file, content_type=uploaded_file.type)
-                    
-                    # 保存先パスとしてStorage上のパスをDBに保存
-                    # (公開URLが必要な場合は blob.public_url を使うが、設定が必要)
-                    image_path = filename 
-
                     user_id = st.session_state.user_info['id']
                     nickname = st.session_state.user_info['nickname'] # nicknameも渡す
-                    db.create_post(user_id, nickname, comment, image_path, shop_name, price)
-                    st.success("ランチを投稿しました！")
-                    st.rerun()
+                    post_id = uploads.submit_post(user_id, nickname, comment, shop_name, price,
+                                                  ext, uploaded_file.getvalue(), uploaded_file.type)
+                    if post_id is None:
+                        st.error("ただいま投稿が混み合っています。しばらくしてからもう一度お試しください。")
+                    else:
+                        st.success("ランチを投稿しました！写真は数秒で表示されます。")
+                        st.rerun()
                     # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
 
 def draw_edit_dialog(post_data):
@@ -209,21 +271,38 @@ def draw_edit_dialog(post_data):
     
     edit_dialog()
 
-def draw_post_card(post, is_mine=False, show_edit_buttons=False):
-    """個々の投稿カードを描画する"""
+def get_liked_post_ids(posts):
+    """ログインユーザーがいいね済みの投稿IDを一括で取得する"""
+    if not st.session_state.logged_in:
+        return set()
+    user_id = st.session_state.user_info['id']
+    return db.get_liked_post_ids(user_id, [post['id'] for post in posts])
+
+def draw_post_card(post, is_mine=False, show_edit_buttons=False, liked=False, image_url=None):
+    """個々の投稿カードを描画する (image_url を省略した場合はここで取得する)"""
     with st.container(border=True):
         col1, col2 = st.columns([1, 3])
         
         with col1:
             # ▼▼▼▼▼ Cloud Storageからの画像表示 ▼▼▼▼▼
-            try:
-                # 署名付きURLを生成して一時的に画像にアクセスできるようにする
-                # 有効期限は1時間（3600秒）
-                image_url = db.bucket.blob(post['image_path']).generate_signed_url(datetime.timedelta(seconds=3600))
-                st.image(image_url, use_container_width='always')
-            except Exception as e:
-                st.error("画像が見つかりません")
-                print(f"Error generating signed URL: {e}") # デバッグ用
+            image_status = uploads.image_status(post)
+            if image_status == 'processing':
+                st.info("📤 写真を処理中です…")
+            elif image_status == 'failed':
+                st.error("写真のアップロードに失敗しました")
+            else:
+                try:
+                    # 署名付きURLで一時的に画像にアクセスできるようにする
+                    # (URLはプロセス全体でキャッシュされ、有効期限が近づくまで同じものを使う)
+                    # 画像プロキシが有効な場合は、ローカルにキャッシュしたバイト列を渡す
+                    # サムネイルがあればそちらを表示する(古い投稿は元画像)
+                    if image_url is None:
+                        variants = post.get('image_variants') or {}
+                        image_url = db.get_image_source(variants.get('thumb') or post['image_path'])
+                    st.image(image_url, use_container_width='always')
+                except Exception as e:
+                    st.error("画像が見つかりません")
+                    print(f"Error generating signed URL: {e}") # デバッグ用
             # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
 
         with col2:
@@ -246,7 +325,6 @@ def draw_post_card(post, is_mine=False, show_edit_buttons=False):
             with btn_cols[0]:
                 if st.session_state.logged_in:
                     user_id = st.session_state.user_info['id']
-                    liked = db.check_like(user_id, post['id'])
                     button_label = "❤️ いいね済み" if liked else "🤍 いいね！"
                     if st.button(button_label, key=f"like_{post['id']}"):
                         if liked: db.remove_like(user_id, post['id'])
@@ -274,8 +352,18 @@ def draw_timeline():
     """タイムラインページを描画"""
     st.title("🍽️ みんなのランチ")
     
+    # アワード・投稿・いいね状態・画像URLを、描画の前にまとめて並行して取得する
+    current_user_id = st.session_state.user_info['id'] if st.session_state.logged_in else None
+    # 検索語がある場合は、投稿の一覧の代わりに検索結果を取得する (検索欄は下で描画する)
+    query = st.session_state.get('search_query', '').strip()
+    if query:
+        timeline = prefetch.load_timeline(current_user_id, st.session_state.search_pages, TIMELINE_PAGE_SIZE,
+                                          query=query, exact_shop=st.session_state.search_exact_shop)
+    else:
+        timeline = prefetch.load_timeline(current_user_id, st.session_state.timeline_pages, TIMELINE_PAGE_SIZE)
+
     # ▼▼▼▼▼ ここからが修正・復活させるコード ▼▼▼▼▼
-    award_post = db.get_lunch_award()
+    award_post = timeline.award_post
     # アワードの表示条件: 投稿が存在し、かつ、いいねが1件以上あること
     if award_post and award_post['like_count'] > 0:
         # ▼▼▼▼▼ ここの文言を修正 ▼▼▼▼▼
@@ -285,13 +373,11 @@ def draw_timeline():
             col1, col2 = st.columns([1, 2])
             with col1:
                 # ▼▼▼▼▼ 画像表示ロジックをCloud Storage対応のものに修正 ▼▼▼▼▼
-                try:
-                    # 署名付きURLを生成して画像にアクセス
-                    image_url = db.bucket.blob(award_post['image_path']).generate_signed_url(datetime.timedelta(seconds=3600))
-                    st.image(image_url, use_container_width=True)
-                except Exception as e:
+                # 署名付きURLは取得済み (失敗した場合は None)
+                if timeline.award_image_url:
+                    st.image(timeline.award_image_url, use_container_width=True)
+                else:
                     st.error("アワード画像の読み込みに失敗しました。")
-                    print(f"Error loading award image URL: {e}") # デバッグ用にログ出力
                 # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
             with col2:
                 st.markdown(f"**{award_post['nickname']}** さんの投稿")
@@ -306,21 +392,44 @@ def draw_timeline():
         with st.expander("投稿フォームを開く", expanded=False):
             if is_lunch_time(): draw_post_form()
             else: st.info("🕒 投稿は日本時間の午前11時〜午後2時の間のみ可能です。")
+        draw_upload_status(current_user_id)
     else:
         st.info("投稿や「いいね」をするには、サイドバーからログインしてください。")
 
     st.subheader("みんなの投稿")
-    posts = db.get_all_posts()
+    st.text_input("🔍 店舗名・コメントで検索", key="search_query", on_change=reset_search, placeholder="例: ラーメン")
+    if query and not st.session_state.search_exact_shop:
+        # 検索語で始まる店舗名を候補として表示し、選ぶとその店舗の投稿だけに絞り込む
+        shops = db.suggest_shops(query)
+        if shops:
+            cols = st.columns(min(len(shops), 5))
+            for i, shop in enumerate(shops):
+                cols[i % len(cols)].button(f"📍 {shop['name']} ({shop['post_count']})", key=f"shop_suggest_{shop['key']}",
+                                           on_click=select_shop, args=(shop['name'],), use_container_width=True)
+    elif query:
+        st.caption(f"📍 店舗名が「{query}」の投稿")
+
+    # 投稿は読み込み済みのページ分だけカーソルで辿って取得している
+    # (読み取り件数は投稿の総数ではなく表示件数に比例する。検索も索引を使い、ヒットした件数に比例する)
+    posts = timeline.posts
     if not posts:
-        st.info("まだ投稿がありません。最初のランチを投稿してみましょう！")
+        if query:
+            st.info("該当する投稿はありません。")
+        else:
+            st.info("まだ投稿がありません。最初のランチを投稿してみましょう！")
         return
 
-    current_user_id = st.session_state.user_info['id'] if st.session_state.logged_in else None
     for post in posts:
         # ▼▼▼▼▼ ここを修正 ▼▼▼▼▼
         # show_edit_buttonsを明示的にFalseにするか、引数を渡さない
-        draw_post_card(post, is_mine=(post['user_id'] == current_user_id), show_edit_buttons=False)
+        draw_post_card(post, is_mine=(post['user_id'] == current_user_id), show_edit_buttons=False,
+                       liked=(post['id'] in timeline.liked_post_ids), image_url=timeline.image_urls.get(post['id']))
         # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
+
+    # 続きがある場合のみ「もっと見る」ボタンを表示
+    if timeline.next_cursor is not None:
+        st.button("もっと見る", key="timeline_load_more", on_click=load_more_search if query else load_more_timeline,
+                  use_container_width=True)
     
     # 編集ダイアログの表示処理
     if st.session_state.editing_post_id:
@@ -342,10 +451,11 @@ def draw_my_posts_page():
         st.info("まだ投稿がありません。タイムラインから最初のランチを投稿してみましょう！")
         return
     
+    liked_post_ids = get_liked_post_ids(my_posts)
     for post in my_posts:
         # ▼▼▼▼▼ ここを修正 ▼▼▼▼▼
         # is_mineは常にTrue、show_edit_buttonsもTrueにする
-        draw_post_card(post, is_mine=True, show_edit_buttons=True)
+        draw_post_card(post, is_mine=True, show_edit_buttons=True, liked=(post['id'] in liked_post_ids))
         # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
 
     # 編集ダイアログの表示処理
@@ -354,8 +464,37 @@ def draw_my_posts_page():
         if target_post:
             draw_edit_dialog(target_post)
 
+def draw_shop_ranking_page():
+    """店舗ごとの集計からお店ランキングを描画"""
+    import pandas as pd # 読み込みに時間がかかるため、ランキングを開いたときに初めて読み込む
+    st.title("🏆 お店ランキング")
+    sort_label = st.radio("並べ替え", list(SHOP_RANKING_LABELS), horizontal=True, key="shop_ranking_sort")
+    sort = SHOP_RANKING_LABELS[sort_label]
+    min_posts = 1
+    if sort in ('cheap', 'expensive'):
+        # 1件だけの投稿で順位が決まらないよう、投稿数の少ない店舗を除けるようにする
+        min_posts = st.slider("投稿数がこれ以上の店舗", 1, 10, 2, key="shop_ranking_min_posts")
+
+    shops = db.get_shop_ranking(sort, limit=SHOP_RANKING_SIZE, min_posts=min_posts)
+    if not shops:
+        st.info("条件に合うお店がありません。")
+        return
+
+    jst = ZoneInfo('Asia/Tokyo')
+    df_shops = pd.DataFrame([{
+        '順位': rank,
+        '店舗名': shop['name'],
+        '投稿数': shop['post_count'],
+        'いいね数': shop['like_total'],
+        '平均価格': round(shop['price_avg']) if shop.get('price_avg') is not None else None,
+        '最安': shop.get('price_min'),
+        '最高': shop.get('price_max'),
+        '最終訪問': shop['last_visited_at'].astimezone(jst).strftime('%Y-%m-%d') if shop.get('last_visited_at') else '',
+    } for rank, shop in enumerate(shops, start=1)])
+    st.dataframe(df_shops, hide_index=True, use_container_width=True)
+
 def draw_dashboard():
-    # (この関数は変更なし)
+    import pandas as pd # 読み込みに時間がかかるため、ダッシュボードを開いたときに初めて読み込む
     st.title("📊 管理者ダッシュボード")
     stats, post_timeline, popular_posts = db.get_dashboard_stats()
     
@@ -371,10 +510,12 @@ def draw_dashboard():
     st.subheader("投稿数の推移")
     if post_timeline:
         # ▼▼▼▼▼ データ構造の変更に対応 ▼▼▼▼▼
-        df_timeline = pd.DataFrame(post_timeline, columns=['date', 'count'])
+        df_timeline = pd.DataFrame(post_timeline, columns=['date', '投稿数', 'いいね数', '新規ユーザー数', '投稿者数'])
         df_timeline['date'] = pd.to_datetime(df_timeline['date'])
         df_timeline = df_timeline.set_index('date')
-        st.line_chart(df_timeline)
+        st.line_chart(df_timeline[['投稿数']])
+        with st.expander("日別の詳細"):
+            st.line_chart(df_timeline[['いいね数', '新規ユーザー数', '投稿者数']])
         # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
     else:
         st.info("投稿データがありません。")
@@ -386,79 +527,224 @@ def draw_dashboard():
         st.dataframe(df_popular, use_container_width=True)
     else:
         st.info("いいねされた投稿がありません。")
-    
-    
+
+    st.divider()
+    draw_trend_section()
+
+    st.divider()
+    draw_metrics_section()
+
     st.divider()
     # ▼▼▼▼▼ ここからユーザー管理機能を追加 ▼▼▼▼▼
     st.subheader("👥 ユーザー管理")
+    draw_job_progress()
 
-    all_users = db.get_all_users()
+    # ユーザーはカーソルで1ページずつ取得する (一覧に使う項目と、保存済みの投稿数・いいね数だけを読む)
+    search = st.text_input("ニックネームで検索 (前方一致)", key="user_search", on_change=reset_user_pages).strip()
+    cursors = st.session_state.user_page_cursors
+    users, next_cursor = db.get_users_page(USER_PAGE_SIZE, start_after=cursors[-1], nickname_prefix=search)
 
-    if not all_users:
-        st.info("管理者以外の登録ユーザーはいません。")
+    if not users and len(cursors) == 1:
+        st.info("該当するユーザーはいません。" if search else "管理者以外の登録ユーザーはいません。")
         return
 
-    # 1. まず、辞書のリストからそのままDataFrameを作成
-    df_users = pd.DataFrame(all_users)
+    rows = [
+        {
+            'ID': user['id'],
+            'ニックネーム': user['nickname'],
+            '登録日時': user.get('created_at'),
+            '投稿数': user['post_count'],
+            'いいね数': user['like_count'],
+            'アクション': False, # 削除ボタンを設置するための列
+        }
+        for user in users
+    ]
 
-    # 2. 表示に必要な列だけを選択し、順番を整える
-    # (password_hashなどの不要な列を除外)
-    df_users = df_users[['id', 'nickname', 'created_at']]
-    
-    # 3. 列名を日本語の表示名に変更する
-    df_users.columns = ['ID', 'ニックネーム', '登録日時']
-    
-    # 4. 削除ボタンを設置するための列を追加
-    df_users['アクション'] = [False] * len(df_users)
-    
     # st.data_editorを使ってインタラクティブなテーブルを作成
-    edited_df = st.data_editor(
-        df_users,
+    st.data_editor(
+        rows,
         column_config={
-            # ... (ここから下の data_editor の中身は変更なし)
             "アクション": st.column_config.CheckboxColumn(
                 "削除実行",
                 help="チェックを入れてユーザーを削除します",
                 default=False,
             ),
-            "ID": st.column_config.NumberColumn(disabled=True),
+            "ID": st.column_config.TextColumn(disabled=True),
             "ニックネーム": st.column_config.TextColumn(disabled=True),
             "登録日時": st.column_config.DatetimeColumn(disabled=True, format="YYYY-MM-DD HH:mm"),
+            "投稿数": st.column_config.NumberColumn(disabled=True),
+            "いいね数": st.column_config.NumberColumn(disabled=True, help="このユーザーが付けたいいねの数"),
         },
-        disabled=["ID", "ニックネーム", "登録日時"], 
+        disabled=["ID", "ニックネーム", "登録日時", "投稿数", "いいね数"],
         hide_index=True,
         use_container_width=True,
         key="user_management_editor"
     )
 
-    # どのユーザーが削除対象としてチェックされたかを探す
-    user_to_delete = None
-    original_df_dict = df_users.set_index('ID').to_dict('index')
-    edited_df_dict = edited_df.set_index('ID').to_dict('index')
-    
-    for user_id, user_data in edited_df_dict.items():
-        if user_data['アクション'] and not original_df_dict[user_id]['アクション']:
-            user_to_delete = {
-                "id": user_id,
-                "nickname": user_data['ニックネーム']
-            }
-            break
+    col1, col2, col3 = st.columns([1, 2, 1])
+    col1.button("← 前へ", key="user_page_prev", on_click=prev_user_page,
+                disabled=len(cursors) == 1, use_container_width=True)
+    col2.caption(f"{len(cursors)} ページ目")
+    col3.button("次へ →", key="user_page_next", on_click=next_user_page, args=(next_cursor,),
+                disabled=next_cursor is None, use_container_width=True)
+
+    # 削除対象としてチェックされたユーザーをすべて集める (複数人をまとめて削除できる)
+    # 表全体を比較せず、data_editor が記録している変更された行だけを見る
+    edited_rows = st.session_state.get('user_management_editor', {}).get('edited_rows', {})
+    users_to_delete = [
+        users[int(index)] for index, changes in sorted(edited_rows.items(), key=lambda item: int(item[0]))
+        if changes.get('アクション')
+    ]
 
     # 削除対象のユーザーがいれば、確認メッセージと最終実行ボタンを表示
-    if user_to_delete:
-        st.error(f"**警告:** ユーザー「**{user_to_delete['nickname']}**」を削除しようとしています。")
-        st.warning("この操作は元に戻せません。このユーザーの投稿、いいね、アカウント情報がすべて削除されます。")
+    if users_to_delete:
+        nicknames = "、".join(f"「**{user['nickname']}**」" for user in users_to_delete)
+        st.error(f"**警告:** ユーザー{nicknames}（{len(users_to_delete)}人）を削除しようとしています。")
+        st.warning("この操作は元に戻せません。これらのユーザーの投稿、いいね、アカウント情報がすべて削除されます。")
         
         # 最終確認ボタン
-        if st.button(f"「{user_to_delete['nickname']}」を完全に削除する", type="primary"):
-            # 前回実装したアカウント削除関数を呼び出す
-            if db.delete_user(user_to_delete['id']):
-                st.success(f"ユーザー「{user_to_delete['nickname']}」を削除しました。")
-                st.rerun() # ページをリロードしてリストを更新
-            else:
-                st.error("ユーザーの削除中にエラーが発生しました。")
+        if st.button(f"選択した{len(users_to_delete)}人を完全に削除する", type="primary"):
+            # 削除はバックグラウンドで行い、進捗は上の「バックグラウンド処理」に表示する
+            jobs.start(f"ユーザー{len(users_to_delete)}人の削除", len(users_to_delete),
+                       db.delete_users, [user['id'] for user in users_to_delete])
+            st.session_state.jobs_running = True
+            del st.session_state['user_management_editor'] # チェックを外す
+            st.rerun()
     # ▲▲▲▲▲ ここまでユーザー管理機能 ▲▲▲▲▲
 
+def draw_upload_status(user_id):
+    """自分の投稿の写真のアップロード状況を表示する (処理中は2秒ごとにこの部分だけ再描画する)"""
+    @st.fragment(run_every=2 if uploads.pending_count(user_id) else None)
+    def upload_panel():
+        pending = uploads.pending_count(user_id)
+        if pending:
+            st.caption(f"📤 写真をアップロード中です ({pending}件)")
+        # アップロードが終わったらページ全体を再描画して写真を表示する
+        if st.session_state.get('uploads_pending') and not pending:
+            st.session_state.uploads_pending = False
+            st.rerun()
+        st.session_state.uploads_pending = bool(pending)
+    upload_panel()
+
+def draw_job_progress():
+    """バックグラウンド処理の進捗を表示する (実行中は1秒ごとにこの部分だけ再描画する)"""
+    @st.fragment(run_every=1 if jobs.has_running() else None)
+    def job_panel():
+        recent_jobs = jobs.list_jobs()[:5]
+        for job in recent_jobs:
+            label = {'running': "実行中", 'done': "完了", 'failed': "失敗"}[job.status]
+            st.progress(job.progress, text=f"{job.title}: {job.done}/{job.total} ({label})")
+            for error in job.errors:
+                st.caption(f"⚠️ {error}")
+        # ジョブが終わったらページ全体を再描画してユーザー一覧を更新する
+        running = jobs.has_running()
+        if st.session_state.get('jobs_running') and not running:
+            st.session_state.jobs_running = False
+            st.rerun()
+        st.session_state.jobs_running = running
+    job_panel()
+
+def draw_trend_section():
+    """エクスポート済みの Parquet ファイルから、投稿のトレンドを集計して表示します。"""
+    import altair as alt
+    from utils import analytics # pandas / pyarrow を読み込むため、ダッシュボードを開いたときに初めて読み込む
+    st.subheader("📈 トレンド分析")
+    # 描画ではエクスポート済みのファイルを読むだけにし、エクスポートは export_analytics.py かバックグラウンドのジョブで行う
+    exported = analytics.exported_at()
+    col1, col2 = st.columns([3, 1])
+    if exported:
+        col1.caption(f"データの更新日時: {exported.astimezone(ZoneInfo('Asia/Tokyo')).strftime('%Y-%m-%d %H:%M')}")
+    else:
+        col1.caption("分析用データはまだありません。export_analytics.py を定期実行するか、「今すぐ更新」を押してください。")
+    if col2.button("今すぐ更新", key="trend_refresh", disabled=jobs.has_running()):
+        # 進捗は「バックグラウンド処理」に表示し、終わるとページ全体を再描画する
+        jobs.start("分析用データのエクスポート", 1, analytics.export_job)
+        st.session_state.jobs_running = True
+        st.rerun()
+
+    frames = analytics.load_frames()
+    if frames['posts'].empty:
+        st.info("投稿データがありません。")
+        return
+
+    freq_label = st.radio("集計の単位", list(analytics.TREND_FREQS), index=1, horizontal=True, key="trend_freq")
+    df_trend = analytics.trend(frames, analytics.TREND_FREQS[freq_label])
+    st.line_chart(df_trend[['投稿数', 'いいね数']])
+    st.line_chart(df_trend[['新規ユーザー数', '投稿者数']])
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**価格帯の分布**")
+        st.bar_chart(analytics.price_distribution(frames))
+    with col2:
+        st.markdown("**曜日×時間帯の投稿数**")
+        heatmap = alt.Chart(analytics.weekday_hour_counts(frames)).mark_rect().encode(
+            x=alt.X('時:O'),
+            y=alt.Y('曜日:O', sort=analytics.WEEKDAYS),
+            color=alt.Color('投稿数:Q'),
+            tooltip=['曜日', '時', '投稿数'],
+        )
+        st.altair_chart(heatmap, use_container_width=True)
+
+def draw_metrics_section():
+    """データアクセスの計測結果(ページ・関数ごとの読み書き件数と処理時間)を表示します。"""
+    import pandas as pd
+    st.subheader("📈 データアクセス計測")
+    startup = metrics.get_startup_timings()
+    if startup:
+        st.caption("起動時の初期化 (プロセスごとに1回): " + " / ".join(f"{step} {ms:.0f} ms" for step, ms in startup.items()))
+    function_stats = metrics.get_function_stats()
+    if not function_stats:
+        st.info("まだ計測データがありません。")
+        return
+
+    recent_reruns = metrics.get_recent_reruns()
+    df_reruns = pd.DataFrame(recent_reruns)
+    df_reruns['script_ms'] = pd.to_numeric(df_reruns['script_ms']) # 中断された再実行は NaN として除外する
+    df_pages = df_reruns.groupby('page').agg(
+        再実行回数=('calls', 'size'),
+        平均読み取り=('reads', 'mean'),
+        平均書き込み=('writes', 'mean'),
+        平均DB時間_ms=('db_ms', 'mean'),
+        平均再実行時間_ms=('script_ms', 'mean'),
+    )
+    st.caption(f"ページごとの1再実行あたりの平均 (直近 {len(recent_reruns)} 回の再実行)")
+    st.dataframe(df_pages.round(1), use_container_width=True)
+
+    st.caption("読み取り件数の多い関数 (ページ別)")
+    df_functions = pd.DataFrame(function_stats)[
+        ['page', 'function', 'calls', 'reads', 'writes', 'reads_per_call', 'p50_ms', 'p95_ms', 'p99_ms', 'errors']
+    ]
+    df_functions.columns = ['ページ', '関数', '呼び出し', '読み取り', '書き込み', '読み取り/回', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'エラー']
+    st.dataframe(df_functions.head(20).round(1), hide_index=True, use_container_width=True)
+
+    query_cache = db.get_query_cache_stats()
+    url_cache = db.get_signed_url_cache_stats()
+    image_cache = db.get_image_cache_stats()
+    col1, col2 = st.columns(2)
+    col1.metric("クエリキャッシュ ヒット率", f"{query_cache['hit_ratio']:.0%}")
+    col2.metric("署名付きURLキャッシュ ヒット率", f"{url_cache['hit_ratio']:.0%}")
+    if image_cache is not None:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("画像キャッシュ ヒット率", f"{image_cache['hit_ratio']:.0%}")
+        col2.metric("削減した転送量", f"{image_cache['bytes_saved'] / 1024 / 1024:,.1f} MB")
+        col3.metric("キャッシュ使用量", f"{image_cache['size_bytes'] / 1024 / 1024:,.0f} / {image_cache['max_bytes'] / 1024 / 1024:,.0f} MB")
+
+    col1, col2 = st.columns(2)
+    snapshot = metrics.snapshot()
+    snapshot['query_cache'] = query_cache
+    snapshot['signed_url_cache'] = url_cache
+    snapshot['image_cache'] = image_cache
+    col1.download_button(
+        "計測結果をダウンロード (JSON)",
+        data=json.dumps(snapshot, ensure_ascii=False, indent=2),
+        file_name=f"lunch_sns_metrics_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+        mime="application/json",
+    )
+    if col2.button("計測結果をリセット"):
+        metrics.reset()
+        st.rerun()
+
 # --- サイドバー ---
 with st.sidebar:
     st.header("みんなのランチ")
@@ -466,13 +752,16 @@ with st.sidebar:
     if st.session_state.logged_in:
         user_info = st.session_state.user_info
         st.write(f"ようこそ、 **{user_info['nickname']}** さん")
-        if st.button("ログアウト"):
-                  
-            # ▼▼▼▼▼ Cookieを削除する処理を正しい構文に修正 ▼▼▼▼▼
+        logout_clicked = st.button("ログアウト")
+        logout_all_clicked = st.button("すべての端末からログアウト", help="他の端末の自動ログインも無効にします")
+        if logout_clicked or logout_all_clicked:
+            if logout_all_clicked:
+                db.revoke_sessions(user_info['id'])
+
             # 辞書のようにdel文でキーを削除します
-            if 'lunch_sns_user_id' in cookies:
-                del cookies['lunch_sns_user_id']
-            # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
+            for cookie_name in (SESSION_COOKIE, LEGACY_COOKIE):
+                if cookie_name in cookies:
+                    del cookies[cookie_name]
             
             st.session_state.logged_in = False
             st.session_state.user_info = None
@@ -483,7 +772,7 @@ with st.sidebar:
         st.divider()
 
         # --- ページ選択メニュー ---
-        page_options = ["タイムライン", "自分の投稿"]
+        page_options = ["タイムライン", "自分の投稿", "お店ランキング"]
         if user_info['nickname'] == ADMIN_NICKNAME:
             page_options.append("管理者ダッシュボード")
         
@@ -513,6 +802,8 @@ if st.session_state.page == "タイムライン":
     draw_timeline()
 elif st.session_state.page == "自分の投稿":
     draw_my_posts_page()
+elif st.session_state.page == "お店ランキング":
+    draw_shop_ranking_page()
 elif st.session_state.page == "管理者ダッシュボード":
     if st.session_state.logged_in and st.session_state.user_info['nickname'] == ADMIN_NICKNAME:
         draw_dashboard()
@@ -520,4 +811,6 @@ elif st.session_state.page == "管理者ダッシュボード":
         st.error("このページへのアクセス権限がありません。")
         # st.page_link("app.py", label="タイムラインに戻る", icon="🏠")
         # st.page_linkの代わりに、st.markdownでHTMLリンクを作成
-        st.markdown('<a href="/" target="_self">🏠 タイムラインに戻る</a>', unsafe_allow_html=True)
\ No newline at end of file
+        st.markdown('<a href="/" target="_self">🏠 タイムラインに戻る</a>', unsafe_allow_html=True)
+
+metrics.end_rerun()
@@ -0,0 +1,13 @@
+# backfill_stats.py
+# 既存データから日次集計 (stats_daily)、ユーザーごとの投稿数・いいね数と店舗ごとの集計 (shops) を作り直すスクリプト (Firestoreエンジン用)
+# 使い方: python backfill_stats.py
+from utils import firestore_backend
+
+if __name__ == "__main__":
+    firestore_backend.initialize_firestore()
+    days = firestore_backend.backfill_daily_stats()
+    print(f"stats_daily を {days} 日分作成しました。")
+    users = firestore_backend.backfill_user_counters()
+    print(f"ユーザー {users} 人の投稿数・いいね数を更新しました。")
+    shops = firestore_backend.backfill_shops()
+    print(f"店舗 {shops} 件の集計を作成しました。")
@@ -0,0 +1,96 @@
+# benchmarks/bench_memory.py
+# 投稿の一覧を取得するときのFirestoreからの転送量と、セッションあたりのメモリ使用量を計測するベンチマーク。
+# Firestoreは bench_render と同じく benchmarks/fake_firestore.py の代用品を使う。
+#
+# 使い方 (リポジトリのルートで実行):
+#   python -m benchmarks.bench_memory
+#   python -m benchmarks.bench_memory --posts 10000 --sessions 50 --json memory_output.json
+#
+# 出力:
+#   転送量   一覧の取得1回あたりの読み取り数と転送量 (キャッシュなし)
+#   メモリ   sessions 個のセッションがタイムライン・自分の投稿・検索結果を読み込んだときに、
+#            プロセス内で保持しているメモリ (クエリのキャッシュを含む) をセッション数で割ったもの
+
+import argparse
+import gc
+import json
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.bench_render import clear_caches, seed
+from benchmarks.fake_firestore import install_fake
+from utils import db, firestore_backend, prefetch
+
+TIMELINE_PAGES = 3 # 各セッションが読み込むタイムラインのページ数
+PAGE_SIZE = 20
+
+
+def measure_transfer(fake_db, user_id):
+    """一覧の取得ごとの読み取り数と転送量を計測します。"""
+    cases = [
+        ('get_posts_page', lambda: db.get_posts_page(PAGE_SIZE)),
+        (f'load_timeline ({TIMELINE_PAGES} pages)', lambda: prefetch.load_timeline(user_id, TIMELINE_PAGES, PAGE_SIZE)),
+        ('get_posts_by_user', lambda: db.get_posts_by_user(user_id)),
+        ('search_posts', lambda: db.search_posts('ランチ 1', PAGE_SIZE)),
+        ('get_lunch_award', lambda: db.get_lunch_award()),
+        ('get_all_posts', lambda: db.get_all_posts()),
+    ]
+    results = []
+    for name, func in cases:
+        clear_caches()
+        fake_db.stats.reset()
+        func()
+        counts = fake_db.stats.snapshot()
+        row = {'op': name, 'reads': counts['reads'], 'bytes': counts['bytes']}
+        results.append(row)
+        print(f"{name:<28} {row['reads']:>8} reads {row['bytes']:>12,} bytes "
+              f"{row['bytes'] / max(row['reads'], 1):>8.0f} bytes/read", flush=True)
+    return results
+
+
+def measure_sessions(user_ids, sessions):
+    """sessions 個のセッションの読み込みで増えたメモリを計測します。"""
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    held = [] # 描画中のセッションが保持しているデータ
+    for i in range(sessions):
+        user_id = user_ids[i % len(user_ids)]
+        held.append((
+            prefetch.load_timeline(user_id, TIMELINE_PAGES, PAGE_SIZE),
+            db.get_posts_by_user(user_id),
+            db.search_posts(f'ランチ {i % 10}', PAGE_SIZE),
+        ))
+    gc.collect()
+    total = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    row = {'sessions': sessions, 'total_bytes': total, 'bytes_per_session': total / sessions}
+    print(f"sessions={sessions} total={total:,} bytes per_session={row['bytes_per_session']:,.0f} bytes", flush=True)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LunchSNS list-query transfer and memory benchmark")
+    parser.add_argument('--posts', type=int, default=10000, help="投稿数")
+    parser.add_argument('--sessions', type=int, default=50, help="メモリを計測するセッション数")
+    parser.add_argument('--json', help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    fake_db, fake_bucket = install_fake(0, 0, 0)
+    print(f"--- posts={args.posts:,} (seeding...)", flush=True)
+    user_ids, _ = seed(fake_db, fake_bucket, args.posts)
+    firestore_backend.backfill_search_index()
+
+    results = {
+        'posts': args.posts,
+        'transfer': measure_transfer(fake_db, user_ids[0]),
+        'memory': measure_sessions(user_ids, args.sessions),
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"結果を {args.json} に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# benchmarks/bench_render.py
+# 画面の描画やいいねなどの操作にかかる時間とFirestoreの操作回数を計測するベンチマーク。
+# utils.firestore_backend の db / bucket を benchmarks/fake_firestore.py の代用品に差し替えて実行する
+# (Firebaseの認証情報は不要)。性能改善の前後でこの結果を比較する。
+#
+# 使い方 (リポジトリのルートで実行):
+#   python -m benchmarks.bench_render
+#   python -m benchmarks.bench_render --sizes 100 1000 --latency-ms 20 --json bench_output.json
+#
+# 出力の各列は1操作あたりの平均値:
+#   ms      経過時間 (挿入した遅延を含む)
+#   reads   Firestoreの読み取りドキュメント数
+#   writes  Firestoreの書き込みドキュメント数
+#   rpcs    Firestore / Cloud Storage との往復回数
+#   signs   署名付きURLの生成回数
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ['LUNCH_SNS_BACKEND'] = 'firestore'
+os.environ['LUNCH_SNS_TIMELINE_LISTENER'] = 'False'
+os.environ.setdefault('ADMIN_KEY', 'admin')
+os.environ.setdefault('PASS_KEY', 'admin-password')
+
+from benchmarks.fake_firestore import install_fake
+from utils import auth, db, firestore_backend, prefetch
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+ADMIN_NICKNAME = os.environ['ADMIN_KEY']
+
+
+def seed(fake_db, fake_bucket, post_count, seed_value=0):
+    """投稿 post_count 件と、それに見合うユーザー・いいねを投入します。"""
+    rng = random.Random(seed_value)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    user_count = max(10, min(post_count // 10, 2000))
+
+    fake_db.load('users', 'admin', {
+        'nickname': ADMIN_NICKNAME,
+        'password_hash': auth.hash_password(os.environ['PASS_KEY']),
+        'created_at': now - datetime.timedelta(days=365),
+    })
+    user_ids = []
+    for i in range(user_count):
+        user_id = f"user{i:06d}"
+        user_ids.append(user_id)
+        fake_db.load('users', user_id, {
+            'nickname': f"user{i}",
+            'password_hash': auth.hash_password('password'),
+            'created_at': now - datetime.timedelta(days=rng.randint(0, 365)),
+        })
+
+    # 投稿は直近1年にばらけさせ、今日の投稿も必ず含める
+    posts = []
+    for i in range(post_count):
+        post_id = f"post{i:07d}"
+        user_index = rng.randrange(user_count)
+        created_at = now - datetime.timedelta(minutes=i * (525600 / post_count))
+        image_path = f"images/{post_id}.jpg"
+        fake_db.load('posts', post_id, {
+            'user_id': user_ids[user_index],
+            'nickname': f"user{user_index}",
+            'comment': f"今日のランチ {i}",
+            'image_path': image_path,
+            'image_variants': {'thumb': f"images/{post_id}_thumb.webp", 'display': f"images/{post_id}_display.webp"},
+            'shop_name': f"お店{rng.randrange(200)}",
+            'price': rng.randrange(5, 20) * 100,
+            'like_count': 0,
+            'status': 'ready',
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        fake_bucket.blobs[image_path] = b''
+        posts.append(post_id)
+
+    # いいねは新しい投稿ほど多くなるように付ける
+    docs = fake_db.docs('posts')
+    for _ in range(post_count):
+        post_id = posts[min(int(rng.expovariate(1 / max(post_count / 20, 1))), post_count - 1)]
+        user_id = rng.choice(user_ids)
+        like_id = f"{user_id}_{post_id}"
+        if like_id in fake_db.docs('likes'):
+            continue
+        fake_db.load('likes', like_id, {
+            'user_id': user_id, 'post_id': post_id,
+            'created_at': docs[post_id]['created_at'],
+        })
+        docs[post_id]['like_count'] += 1
+
+    # ニックネームの索引・日次集計・店舗ごとの集計・ランキングを作る (計測には含めない)
+    firestore_backend.backfill_nickname_index()
+    firestore_backend.backfill_daily_stats()
+    firestore_backend.backfill_shops()
+    firestore_backend._rebuild_leaderboard(firestore_backend.jst_date_str())
+    return user_ids, posts
+
+
+def clear_caches():
+    db._query_cache.clear()
+    db._signed_url_cache.clear()
+
+
+def measure(fake_db, func, iterations, cold=True):
+    """func を iterations 回実行し、1回あたりの平均を返します。"""
+    totals = {field: 0 for field in ('ms', 'reads', 'writes', 'rpcs', 'signs')}
+    for i in range(iterations):
+        if cold:
+            clear_caches()
+        fake_db.stats.reset()
+        start = time.perf_counter()
+        func(i)
+        totals['ms'] += (time.perf_counter() - start) * 1000
+        counts = fake_db.stats.snapshot()
+        for field in ('reads', 'writes', 'rpcs', 'signs'):
+            totals[field] += counts[field]
+    return {field: value / iterations for field, value in totals.items()}
+
+
+def make_app_runner(page, user):
+    """Streamlit の AppTest で app.py を1回実行する関数を返します。"""
+    from streamlit.testing.v1 import AppTest
+
+    def run(_):
+        at = AppTest.from_file(str(ROOT / 'app.py'), default_timeout=600)
+        at.session_state['logged_in'] = True
+        at.session_state['user_info'] = dict(user)
+        at.session_state['page'] = page
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].message}")
+    return run
+
+
+def run_benchmarks(sizes, iterations, latency, per_doc_latency, sign_cost, include_app):
+    results = []
+    for size in sizes:
+        fake_db, fake_bucket = install_fake(latency, per_doc_latency, sign_cost)
+        print(f"--- posts={size:,} (seeding...)", flush=True)
+        user_ids, posts = seed(fake_db, fake_bucket, size)
+        admin = db.get_user(ADMIN_NICKNAME)
+        user = db.get_user_by_id(user_ids[0])
+
+        cases = [
+            ('get_all_posts', lambda i: db.get_all_posts(), True),
+            ('get_posts_page', lambda i: db.get_posts_page(20), True),
+            ('check_like', lambda i: db.check_like(user_ids[i % len(user_ids)], posts[i % len(posts)]), True),
+            ('get_liked_post_ids(20)', lambda i: db.get_liked_post_ids(user_ids[i % len(user_ids)], posts[:20]), True),
+            ('add_like+remove_like', lambda i: (db.add_like(user['id'], posts[i]), db.remove_like(user['id'], posts[i])), True),
+            ('get_lunch_award', lambda i: db.get_lunch_award(), True),
+            ('prefetch.load_timeline', lambda i: prefetch.load_timeline(user['id'], 1, 20), True),
+            ('get_dashboard_stats', lambda i: db.get_dashboard_stats(), True),
+        ]
+        if include_app:
+            cases += [
+                ('draw_timeline', make_app_runner('タイムライン', user), True),
+                ('draw_timeline (warm)', make_app_runner('タイムライン', user), False),
+                ('draw_my_posts_page', make_app_runner('自分の投稿', user), True),
+                ('draw_dashboard', make_app_runner('管理者ダッシュボード', admin), True),
+            ]
+        # 破壊的な操作は最後に、毎回別のユーザーで行う
+        cases.append(('delete_user', lambda i: db.delete_user(user_ids[-(i + 1)]), True))
+
+        for name, func, cold in cases:
+            n = 1 if name == 'get_all_posts' and size >= 100000 else iterations
+            row = measure(fake_db, func, n, cold=cold)
+            row.update(op=name, posts=size)
+            results.append(row)
+            print(f"{name:<24} {row['ms']:>10.1f} ms {row['reads']:>10.1f} reads {row['writes']:>7.1f} writes "
+                  f"{row['rpcs']:>7.1f} rpcs {row['signs']:>6.1f} signs", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LunchSNS render-path benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="投稿数")
+    parser.add_argument('--iterations', type=int, default=3, help="各操作の繰り返し回数")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="1往復あたりの遅延 (ms)")
+    parser.add_argument('--per-doc-us', type=float, default=20.0, help="読み取り1件あたりの追加遅延 (μs)")
+    parser.add_argument('--sign-ms', type=float, default=1.0, help="署名付きURL1件の生成にかかる時間 (ms)")
+    parser.add_argument('--no-app', action='store_true', help="draw_* (AppTestによる画面全体の実行) を計測しない")
+    parser.add_argument('--json', help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    include_app = not args.no_app
+    if include_app:
+        try:
+            import streamlit.testing.v1 # noqa: F401
+        except ImportError:
+            print("streamlit が無いため draw_* の計測は行いません。")
+            include_app = False
+
+    results = run_benchmarks(
+        args.sizes, args.iterations,
+        latency=args.latency_ms / 1000,
+        per_doc_latency=args.per_doc_us / 1_000_000,
+        sign_cost=args.sign_ms / 1000,
+        include_app=include_app,
+    )
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"結果を {args.json} に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/bench_startup.py
+# app.py の起動(プロセスで最初の実行)と、2回目以降の再実行にかかる時間・Firestoreの読み取り数を計測する。
+# 起動時の計測を毎回まっさらな状態で行うため、各計測は別プロセスで実行する。
+# Firestoreは bench_render と同じく benchmarks/fake_firestore.py の代用品を使う。
+#
+# 使い方 (リポジトリのルートで実行):
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup --processes 5 --reruns 20 --json startup_output.json
+#
+# 出力の各列:
+#   import_ms      utils.db (ストレージエンジンとFirebase SDK) の読み込み時間
+#   first_ms       プロセスで最初の app.py の実行時間 (初期化を含む)
+#   first_reads    最初の実行でのFirestoreの読み取り数
+#   rerun_ms       2回目以降の再実行1回あたりの平均時間
+#   rerun_reads    2回目以降の再実行1回あたりの平均読み取り数
+#   pandas         実行後に pandas が読み込まれていたか
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# ログイン前の画面は Cookie のコンポーネントが AppTest では読み込まれないため計測しない
+PAGES = ['タイムライン', '自分の投稿', '管理者ダッシュボード']
+
+
+def run_child(page, reruns, posts, latency):
+    """1つのプロセス内で app.py を初回 + reruns 回実行し、結果を辞書で返します。"""
+    start = time.perf_counter()
+    from benchmarks.bench_render import ADMIN_NICKNAME, seed
+    from benchmarks.fake_firestore import install_fake
+    from utils import db
+    import_ms = (time.perf_counter() - start) * 1000
+    from streamlit.testing.v1 import AppTest
+
+    fake_db, fake_bucket = install_fake(latency, 0, 0)
+    user_ids, _ = seed(fake_db, fake_bucket, posts)
+    at = AppTest.from_file(str(ROOT / 'app.py'), default_timeout=600)
+    user = db.get_user(ADMIN_NICKNAME) if page == '管理者ダッシュボード' else db.get_user_by_id(user_ids[0])
+    at.session_state['logged_in'] = True
+    at.session_state['user_info'] = dict(user)
+    at.session_state['page'] = page
+
+    timings = []
+    for _ in range(reruns + 1):
+        fake_db.stats.reset()
+        start = time.perf_counter()
+        at.run()
+        timings.append(((time.perf_counter() - start) * 1000, fake_db.stats.snapshot()['reads']))
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+    warm = timings[1:]
+    return {
+        'page': page,
+        'import_ms': import_ms,
+        'first_ms': timings[0][0],
+        'first_reads': timings[0][1],
+        'rerun_ms': statistics.mean(ms for ms, _ in warm) if warm else 0.0,
+        'rerun_reads': statistics.mean(reads for _, reads in warm) if warm else 0.0,
+        'pandas': 'pandas' in sys.modules,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LunchSNS startup/rerun benchmark")
+    parser.add_argument('--processes', type=int, default=3, help="ページごとに起動するプロセス数")
+    parser.add_argument('--reruns', type=int, default=10, help="初回の後に行う再実行の回数")
+    parser.add_argument('--posts', type=int, default=100, help="投入する投稿数")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="1往復あたりの遅延 (ms)")
+    parser.add_argument('--json', help="結果をJSONで保存するファイル")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(args.child, args.reruns, args.posts, args.latency_ms / 1000)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    results = []
+    for page in PAGES:
+        rows = []
+        for _ in range(args.processes):
+            completed = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--child', page,
+                 '--reruns', str(args.reruns), '--posts', str(args.posts), '--latency-ms', str(args.latency_ms)],
+                cwd=ROOT, capture_output=True, text=True, check=True
+            )
+            rows.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        row = {field: statistics.mean(r[field] for r in rows)
+               for field in ('import_ms', 'first_ms', 'first_reads', 'rerun_ms', 'rerun_reads')}
+        row.update(page=page, pandas=any(r['pandas'] for r in rows))
+        results.append(row)
+        print(f"{page:<12} import {row['import_ms']:>7.1f} ms  first {row['first_ms']:>7.1f} ms "
+              f"{row['first_reads']:>6.1f} reads  rerun {row['rerun_ms']:>7.1f} ms {row['rerun_reads']:>6.1f} reads  "
+              f"pandas={row['pandas']}", flush=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"結果を {args.json} に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
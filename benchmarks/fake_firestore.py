@@ -0,0 +1,550 @@
+# benchmarks/fake_firestore.py
+# ベンチマーク用の、プロセス内で動くFirestore / Cloud Storageの代用品。
+# utils/firestore_backend.py が使うAPIだけを実装し、操作回数を数え、指定した遅延を挿入する。
+#
+# 数えるもの (Firestoreの課金単位に合わせる):
+#   reads   読み取ったドキュメント数 (count() は1000件ごとに1回)
+#   writes  書き込んだドキュメント数
+#   rpcs    サーバーとの往復回数 (遅延はこの単位で挿入する)
+#   signs   署名付きURLの生成回数
+#   bytes   読み取ったドキュメントのおおよその転送量 (Firestoreのドキュメントサイズの計算方法による)
+
+import copy
+import datetime
+import math
+import threading
+import time
+from google.api_core import exceptions as gcp_exceptions
+from google.cloud.firestore_v1 import transforms
+
+DESCENDING = 'DESCENDING'
+
+
+class OpStats:
+    """操作回数のカウンタ。"""
+
+    FIELDS = ('reads', 'writes', 'rpcs', 'signs', 'bytes', 'uploads', 'downloads', 'blob_deletes')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+
+    def add(self, **counts):
+        with self._lock:
+            for field, value in counts.items():
+                setattr(self, field, getattr(self, field) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class FakeFirestore:
+    """firestore.Client の代用品。"""
+
+    def __init__(self, latency=0.0, per_doc_latency=0.0):
+        self.latency = latency
+        self.per_doc_latency = per_doc_latency
+        self.stats = OpStats()
+        self._collections = {} # コレクション名 -> {ドキュメントID: データ}
+        self._versions = {} # コレクション名 -> 書き込みのたびに増える番号
+        self._sorted_cache = {} # (コレクション名, 並び順) -> (版, 並べ替え済みID)
+        self._lock = threading.RLock()
+        self._next_id = 0
+
+    # --- クライアントAPI ---
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self):
+        return FakeBatch(self)
+
+    def bulk_writer(self):
+        return FakeBulkWriter(self)
+
+    def write_option(self, exists=None):
+        return {'exists': exists}
+
+    def get_all(self, refs, field_paths=None):
+        refs = list(refs)
+        self._rpc(len(refs))
+        self.stats.add(reads=len(refs))
+        return [ref._snapshot(field_paths) for ref in refs]
+
+    # --- データ投入用 ---
+    def load(self, collection, doc_id, data):
+        """遅延やカウントなしでドキュメントを直接追加します。"""
+        with self._lock:
+            self._collections.setdefault(collection, {})[doc_id] = data
+            self._bump(collection)
+
+    def docs(self, collection):
+        return self._collections.get(collection, {})
+
+    # --- 内部処理 ---
+    def _rpc(self, docs=0):
+        self.stats.add(rpcs=1)
+        delay = self.latency + self.per_doc_latency * docs
+        if delay:
+            time.sleep(delay)
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return f"fake{self._next_id:012d}"
+
+    def _bump(self, collection):
+        self._versions[collection] = self._versions.get(collection, 0) + 1
+
+    def _sorted_ids(self, collection, orders):
+        """並び順ごとに並べ替えたIDのリストを、書き込みがあるまで使い回します。"""
+        key = (collection, tuple(orders))
+        version = self._versions.get(collection, 0)
+        cached = self._sorted_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        docs = self.docs(collection)
+        ids = list(docs)
+        # 安定ソートを後ろの並び順から順に適用する
+        for field, direction in reversed(orders):
+            ids.sort(key=lambda doc_id: _sort_value(doc_id, docs[doc_id], field), reverse=(direction == DESCENDING))
+        self._sorted_cache[key] = (version, ids)
+        return ids
+
+    def _apply_write(self, op, ref, data, option):
+        docs = self._collections.setdefault(ref.collection, {})
+        current = docs.get(ref.id)
+        if op == 'delete':
+            docs.pop(ref.id, None)
+        elif op == 'set' and not option.get('merge'):
+            docs[ref.id] = _apply_transforms({}, data)
+        else: # create / update / set(merge=True)
+            docs[ref.id] = _apply_transforms(dict(current or {}), data, merge=(op == 'set'))
+        self._bump(ref.collection)
+
+    def _check_precondition(self, op, ref, option):
+        exists = ref.id in self.docs(ref.collection)
+        if op == 'create' and exists:
+            raise gcp_exceptions.AlreadyExists(f"Document already exists: {ref.path}")
+        if op == 'update' and not exists:
+            raise gcp_exceptions.NotFound(f"No document to update: {ref.path}")
+        if op == 'delete' and option.get('exists') and not exists:
+            raise gcp_exceptions.NotFound(f"No document to delete: {ref.path}")
+
+
+class FakeSnapshot:
+    """DocumentSnapshot の代用品。"""
+
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+class FakeDocument:
+    """DocumentReference の代用品。"""
+
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def _snapshot(self, fields=None):
+        snapshot = FakeSnapshot(self, self._client.docs(self.collection).get(self.id), fields)
+        if snapshot.exists:
+            self._client.stats.add(bytes=_document_size(self.path, snapshot._data))
+        return snapshot
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._rpc(1)
+        self._client.stats.add(reads=1)
+        return self._snapshot(field_paths)
+
+    def _write(self, op, data=None, option=None):
+        batch = FakeBatch(self._client)
+        batch._ops.append((op, self, data, option or {}))
+        batch.commit()
+
+    def set(self, data, merge=False):
+        self._write('set', data, {'merge': merge})
+
+    def create(self, data):
+        self._write('create', data)
+
+    def update(self, data):
+        self._write('update', data)
+
+    def delete(self, option=None):
+        self._write('delete', option=option)
+
+
+class FakeQuery:
+    """Query の代用品。"""
+
+    def __init__(self, client, collection, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        params = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                      cursor=self._cursor, fields=self._fields)
+        params.update(changes)
+        return FakeQuery(self._client, self._collection, **params)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        return self._copy(cursor=values)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def count(self):
+        return FakeAggregation(self)
+
+    def _matching(self):
+        client = self._client
+        with client._lock:
+            docs = client.docs(self._collection)
+            orders = list(self._orders)
+            # 不等号のフィルタがある場合、Firestoreはそのフィールドで暗黙に並べ替える
+            if not orders:
+                orders = [(f, 'ASCENDING') for f, op, _ in self._filters if op in ('!=', '<', '<=', '>', '>=')][:1]
+            ids = client._sorted_ids(self._collection, orders) if orders else list(docs)
+            cursor_key = None
+            if self._cursor is not None:
+                cursor_key = [_sort_value(self._cursor.get('__name__'), self._cursor, field) for field, _ in orders]
+            results = []
+            for doc_id in ids:
+                data = docs[doc_id]
+                if not all(_matches(doc_id, data, *flt) for flt in self._filters):
+                    continue
+                if cursor_key is not None and not _is_after(doc_id, data, orders, cursor_key):
+                    continue
+                results.append((doc_id, data))
+                if self._limit is not None and len(results) >= self._limit:
+                    break
+            return results
+
+    def stream(self):
+        results = self._matching()
+        self._client._rpc(len(results))
+        # 結果が0件のクエリも1回の読み取りとして課金される
+        self._client.stats.add(reads=max(len(results), 1))
+        for doc_id, _ in results:
+            yield FakeDocument(self._client, self._collection, doc_id)._snapshot(self._fields)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    """CollectionReference の代用品。"""
+
+    def __init__(self, client, name):
+        super().__init__(client, name)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._client, self._collection, doc_id or self._client._new_id())
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeAggregation:
+    """count() の代用品。結果の形は [[AggregationResult]] に合わせる。"""
+
+    class _Result:
+        def __init__(self, value):
+            self.value = value
+
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        count = len(self._query._matching())
+        self._query._client._rpc()
+        # 集計クエリは1000件ごとに1回の読み取りとして課金される
+        self._query._client.stats.add(reads=max(1, math.ceil(count / 1000)))
+        return [[self._Result(count)]]
+
+
+class FakeBatch:
+    """WriteBatch / Transaction の代用品。"""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(('set', ref, data, {'merge': merge}))
+
+    def create(self, ref, data):
+        self._ops.append(('create', ref, data, {}))
+
+    def update(self, ref, data):
+        self._ops.append(('update', ref, data, {}))
+
+    def delete(self, ref, option=None):
+        self._ops.append(('delete', ref, None, option or {}))
+
+    def commit(self):
+        client = self._client
+        client._rpc()
+        with client._lock:
+            for op, ref, _, option in self._ops:
+                client._check_precondition(op, ref, option)
+            for op, ref, data, option in self._ops:
+                client._apply_write(op, ref, data, option)
+        client.stats.add(writes=len(self._ops))
+        self._ops = []
+
+
+class FakeBulkWriter:
+    """BulkWriter の代用品。書き込みは個別に適用し、失敗しても他の書き込みは続ける。"""
+
+    BATCH_SIZE = 20 # 本物の BulkWriter の1回の送信件数
+
+    class _Failure:
+        def __init__(self, ref, code, message):
+            self.operation = type('Operation', (), {'reference': ref})()
+            self.code = code
+            self.message = message
+            self.attempts = 1
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+        self._on_error = None
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def create(self, ref, data):
+        self._ops.append(('create', ref, data, {}))
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(('set', ref, data, {'merge': merge}))
+
+    def update(self, ref, data):
+        self._ops.append(('update', ref, data, {}))
+
+    def delete(self, ref, option=None):
+        self._ops.append(('delete', ref, None, option or {}))
+
+    def flush(self):
+        client = self._client
+        ops, self._ops = self._ops, []
+        for i in range(0, len(ops), self.BATCH_SIZE):
+            client._rpc()
+            for op, ref, data, option in ops[i:i + self.BATCH_SIZE]:
+                try:
+                    with client._lock:
+                        client._check_precondition(op, ref, option)
+                        client._apply_write(op, ref, data, option)
+                    client.stats.add(writes=1)
+                except gcp_exceptions.GoogleAPICallError as e:
+                    if self._on_error:
+                        self._on_error(self._Failure(ref, e.grpc_status_code.value[0] if e.grpc_status_code else 2, str(e)), self)
+
+    def close(self):
+        self.flush()
+
+
+def run_in_fake_transaction(func):
+    """@firestore.transactional で包まれる前の関数を、FakeBatch をトランザクションとして実行します。"""
+    def wrapper(transaction, *args, **kwargs):
+        result = func(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    return wrapper
+
+
+# @firestore.transactional で包まれた firestore_backend の関数 (本物のトランザクションを前提にしている)
+_TRANSACTIONAL_FUNCTIONS = (
+    '_update_leaderboard_in_transaction', '_release_image_ref_in_transaction', '_refresh_shop_in_transaction',
+)
+_unwrapped = {} # 関数名 -> 包まれる前の関数
+
+def install_fake(latency, per_doc_latency, sign_cost):
+    """firestore_backend の db / bucket を代用品に差し替えます。(FakeFirestore, FakeBucket) を返します。"""
+    from utils import firestore_backend
+    fake_db = FakeFirestore(latency=latency, per_doc_latency=per_doc_latency)
+    fake_bucket = FakeBucket(fake_db.stats, latency=latency, sign_cost=sign_cost)
+    firestore_backend.db = fake_db
+    firestore_backend.bucket = fake_bucket
+    firestore_backend._db_initialized = True
+    # 包まれる前の関数を、FakeBatch をトランザクションとして実行する
+    for name in _TRANSACTIONAL_FUNCTIONS:
+        if name not in _unwrapped:
+            _unwrapped[name] = getattr(firestore_backend, name).to_wrap
+        setattr(firestore_backend, name, run_in_fake_transaction(_unwrapped[name]))
+    return fake_db, fake_bucket
+
+
+class FakeBlob:
+    def __init__(self, bucket, path):
+        self._bucket = bucket
+        self.name = path
+
+    def upload_from_string(self, data, content_type=None, retry=None):
+        self._bucket._rpc()
+        self._bucket.stats.add(uploads=1)
+        self._bucket.blobs[self.name] = data
+
+    def download_as_bytes(self):
+        self._bucket._rpc()
+        self._bucket.stats.add(downloads=1)
+        if self.name not in self._bucket.blobs:
+            raise gcp_exceptions.NotFound(self.name)
+        return self._bucket.blobs[self.name]
+
+    def exists(self):
+        self._bucket._rpc()
+        return self.name in self._bucket.blobs
+
+    def delete(self):
+        self._bucket._rpc()
+        self._bucket.stats.add(blob_deletes=1)
+        self._bucket.blobs.pop(self.name, None)
+
+    def generate_signed_url(self, expiration):
+        # 署名はローカルの計算のみ (往復は発生しない)
+        self._bucket.stats.add(signs=1)
+        if self._bucket.sign_cost:
+            time.sleep(self._bucket.sign_cost)
+        return f"https://storage.example.com/{self.name}?expires={int(expiration.total_seconds())}&sig={time.monotonic_ns()}"
+
+
+class FakeBucket:
+    """storage.Bucket の代用品。stats は FakeFirestore と共有できます。"""
+
+    def __init__(self, stats, latency=0.0, sign_cost=0.0):
+        self.stats = stats
+        self.latency = latency
+        self.sign_cost = sign_cost
+        self.blobs = {}
+
+    def blob(self, path, chunk_size=None):
+        return FakeBlob(self, path)
+
+    def _rpc(self):
+        self.stats.add(rpcs=1)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+# --- 値の比較・変換 ---
+_MIN = (0,)
+
+def _sort_value(doc_id, data, field):
+    value = doc_id if field == '__name__' else data.get(field)
+    # None は常に最小、型の違う値同士は型名で比較する
+    if value is None:
+        return _MIN
+    if isinstance(value, bool):
+        return (1, 'bool', value)
+    if isinstance(value, (int, float)):
+        return (1, 'number', value)
+    if isinstance(value, datetime.datetime):
+        return (1, 'timestamp', value)
+    return (1, type(value).__name__, value)
+
+def _is_after(doc_id, data, orders, cursor_key):
+    for (field, direction), cursor_value in zip(orders, cursor_key):
+        value = _sort_value(doc_id, data, field)
+        if value == cursor_value:
+            continue
+        return value < cursor_value if direction == DESCENDING else value > cursor_value
+    return False
+
+def _matches(doc_id, data, field, op, value):
+    if field not in data and field != '__name__':
+        return False
+    actual = doc_id if field == '__name__' else data[field]
+    if op == '==':
+        return actual == value
+    if op == '!=':
+        return actual != value
+    if op == 'in':
+        return actual in value
+    if op == 'array_contains':
+        return value in (actual or [])
+    if actual is None:
+        return False
+    return {'<': actual < value, '<=': actual <= value, '>': actual > value, '>=': actual >= value}[op]
+
+def _apply_transforms(current, data, merge=False):
+    for field, value in data.items():
+        if merge and isinstance(value, dict):
+            # set(merge=True) はマップの中のフィールドも個別にマージする
+            current[field] = _apply_transforms(dict(current.get(field) or {}), value, merge=True)
+        elif value is transforms.SERVER_TIMESTAMP:
+            current[field] = datetime.datetime.now(datetime.timezone.utc)
+        elif value is transforms.DELETE_FIELD:
+            current.pop(field, None)
+        elif isinstance(value, transforms.Increment):
+            current[field] = (current.get(field) or 0) + value.value
+        elif isinstance(value, transforms.ArrayUnion):
+            items = list(current.get(field) or [])
+            items.extend(v for v in value.values if v not in items)
+            current[field] = items
+        elif isinstance(value, transforms.ArrayRemove):
+            current[field] = [v for v in (current.get(field) or []) if v not in value.values]
+        else:
+            current[field] = copy.deepcopy(value)
+    return current
+
+def _value_size(value):
+    """値のサイズ (Firestoreのストレージサイズの計算方法による)。"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key.encode('utf-8')) + 1 + _value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(item) for item in value)
+    return 8 # 数値・日時
+
+def _document_size(path, data):
+    """ドキュメントのサイズ (ドキュメント名とフィールドの合計に32バイトを加えたもの) を返します。"""
+    name_size = sum(len(segment.encode('utf-8')) + 1 for segment in path.split('/')) + 16
+    return name_size + _value_size(data) + 32
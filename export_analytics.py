@@ -0,0 +1,15 @@
+# export_analytics.py
+# 管理者ダッシュボードのトレンド分析用に、posts / likes / users を Parquet ファイルへエクスポートするスクリプト
+# ダッシュボードはエクスポート済みのファイルを読むだけなので、cron などで定期的に (例: 5分ごと) 実行する。
+# 前回の全件エクスポートから1日以上経っている場合は、削除を反映するため自動的に全件をエクスポートし直す。
+# 使い方: python export_analytics.py [--full]
+import argparse
+from utils import analytics, db
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LunchSNS analytics export")
+    parser.add_argument('--full', action='store_true', help="差分ではなく全件をエクスポートし直す (削除を反映する)")
+    args = parser.parse_args()
+    db.initialize_storage()
+    counts = analytics.export(full=args.full or analytics.full_export_due())
+    print(f"{analytics.EXPORT_DIR} に" + "、".join(f"{name} {count} 件" for name, count in counts.items()) + "をエクスポートしました。")
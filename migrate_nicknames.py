@@ -0,0 +1,14 @@
+# migrate_nicknames.py
+# 既存ユーザーのニックネームの索引 (nicknames コレクション) を作成するスクリプト (Firestoreエンジン用)
+# ログインは索引を使って行うため、索引を導入したバージョンをデプロイする前に実行する。
+# 使い方: python migrate_nicknames.py
+from utils import firestore_backend
+
+if __name__ == "__main__":
+    firestore_backend.initialize_firestore()
+    created, duplicates = firestore_backend.backfill_nickname_index()
+    print(f"nicknames を {created} 件作成しました。")
+    if duplicates:
+        print(f"ニックネームが重複しているユーザーが {len(duplicates)} 件あります (古いユーザーを優先しました):")
+        for user_id in duplicates:
+            print(f"  {user_id}")
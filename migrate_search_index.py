@@ -0,0 +1,12 @@
+# migrate_search_index.py
+# 既存の投稿の検索の索引 (search_index) を作成するスクリプト (Firestoreエンジン用)
+# 索引を導入する前の投稿は検索結果に出ないため、索引を導入したバージョンをデプロイした後に実行する。
+# (SQLiteエンジンは起動時の初期化で自動的に作成する)
+# 使い方: python migrate_search_index.py
+from utils import firestore_backend
+
+if __name__ == "__main__":
+    firestore_backend.initialize_firestore()
+    posts = firestore_backend.backfill_search_index()
+    print(f"投稿 {posts} 件の検索の索引を作成しました。")
+    print("店舗名の候補に使う店舗ごとの集計は backfill_stats.py で作成してください。")
@@ -0,0 +1,11 @@
+# rollup_stats.py
+# 今日の日次集計は書き込みが集中しないよう複数のドキュメント (stats_daily_shards) に分散して書き込むため、
+# 2日以上前の分を日ごとのドキュメント (stats_daily) にまとめるスクリプト (Firestoreエンジン用)
+# ダッシュボードの読み取り件数を日数分に抑えるため、cron などで1日1回実行する。
+# 使い方: python rollup_stats.py
+from utils import firestore_backend
+
+if __name__ == "__main__":
+    firestore_backend.initialize_firestore()
+    days = firestore_backend.rollup_daily_stats()
+    print(f"{days} 日分の日次集計をまとめました。")
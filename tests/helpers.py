@@ -0,0 +1,34 @@
+# tests/helpers.py
+# テストで使うストレージエンジンの準備。
+#   use_fake_firestore  Firestoreエンジンを benchmarks/fake_firestore.py の代用品で動かす
+#   use_temp_sqlite     SQLiteエンジンを一時ディレクトリのデータベースと画像の保存先で動かす
+# どちらもテストの終了時に元に戻す処理を test.addCleanup で登録する。
+
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.fake_firestore import install_fake
+from utils import firestore_backend, sqlite_backend
+
+
+def use_fake_firestore(test, latency=0):
+    """Firestoreエンジンを代用品に差し替えます。latency は往復ごとに挿入する遅延(秒)です。"""
+    fake_db, fake_bucket = install_fake(latency, 0, 0)
+    # まとめているいいね数の増減が、次のテストの代用品に書き込まれないようにする
+    test.addCleanup(firestore_backend.flush_like_counters)
+    return fake_db, fake_bucket
+
+def use_temp_sqlite(test):
+    """SQLiteエンジンのデータベースと画像の保存先を一時ディレクトリに切り替え、初期化します。"""
+    tmp_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp_dir.cleanup)
+    for name, value in (('SQLITE_PATH', str(Path(tmp_dir.name) / 'test.db')),
+                        ('STORAGE_DIR', Path(tmp_dir.name) / 'storage')):
+        patcher = mock.patch.object(sqlite_backend, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    # 接続はスレッドごとに保持されるため、このスレッドの接続を作り直す
+    sqlite_backend._local.conn = None
+    test.addCleanup(setattr, sqlite_backend._local, 'conn', None)
+    sqlite_backend.initialize()
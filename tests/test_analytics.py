@@ -0,0 +1,62 @@
+# tests/test_analytics.py
+# トレンド分析のエクスポートと読み込みのテスト (SQLiteエンジンで実行する)
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import datetime
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from utils import analytics
+
+
+class EmptyExportTest(unittest.TestCase):
+    """0件のコレクションをエクスポートしても読み込めることを確認する。"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = mock.patch.object(analytics, 'EXPORT_DIR', Path(tmp_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        analytics._frames = None
+
+    def export(self, rows):
+        def export_rows(collection, fields, changed_field, since=None):
+            return rows.get(collection, [])
+        with mock.patch.object(analytics.db, 'export_rows', export_rows):
+            return analytics.export(full=True)
+
+    def test_all_collections_empty(self):
+        self.assertEqual(self.export({}), {'posts': 0, 'likes': 0, 'users': 0})
+        frames = analytics.load_frames()
+        for collection, (schema, _) in analytics.COLLECTIONS.items():
+            self.assertTrue(frames[collection].empty)
+            self.assertEqual(list(frames[collection].columns), schema.names)
+
+    def test_likes_removed_after_posts_exported(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.export({
+            'posts': [{'id': 'p1', 'user_id': 'u1', 'shop_name': 'A', 'price': 800, 'like_count': 0,
+                       'created_at': now, 'updated_at': now}],
+            'users': [{'id': 'u1', 'created_at': now}],
+        })
+        frames = analytics.load_frames()
+        self.assertEqual(len(frames['posts']), 1)
+        self.assertTrue(frames['likes'].empty)
+        # いいねが0件でも集計できる
+        trend = analytics.trend(frames, 'D')
+        self.assertEqual(trend['投稿数'].sum(), 1)
+        self.assertEqual(trend['いいね数'].sum(), 0)
+
+    def test_no_export_yet(self):
+        frames = analytics.load_frames()
+        self.assertTrue(frames['posts'].empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# tests/test_images.py
+# 内容のハッシュで共有する画像の削除のテスト。投稿の削除で画像の参照が無くなってから画像を削除するまでの間に、
+# 同じ画像の投稿が作られた場合は画像が削除されないことを確認する。SQLiteエンジンで実行する。
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from tests.helpers import use_temp_sqlite
+from utils import db, sqlite_backend
+
+IMAGE_KEY = 'abc123'
+IMAGE_PATH = f"images/{IMAGE_KEY}.jpg"
+VARIANT_PATH = f"images/{IMAGE_KEY}_thumb.webp"
+
+
+class SharedImageDeleteTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_sqlite(self)
+        patcher = mock.patch.object(db, '_backend', sqlite_backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sqlite_backend.create_user('user0', 'hash')
+        self.user_id = sqlite_backend.get_user('user0')['id']
+
+    def create_post(self):
+        post_id = sqlite_backend.create_post(self.user_id, 'user0', 'comment', IMAGE_PATH, '', 0,
+                                             image_key=IMAGE_KEY, status='processing')
+        for path in (IMAGE_PATH, VARIANT_PATH):
+            sqlite_backend.upload_blob(path, b'image', 'image/jpeg')
+        sqlite_backend.complete_image_ref(IMAGE_KEY, {'thumb': VARIANT_PATH})
+        return post_id
+
+    def image_exists(self, path):
+        return sqlite_backend._blob_file(path).exists()
+
+    def test_last_post_deletes_image(self):
+        post_id = self.create_post()
+        self.assertTrue(db.delete_post(post_id))
+        self.assertFalse(self.image_exists(IMAGE_PATH))
+        self.assertFalse(self.image_exists(VARIANT_PATH))
+
+    def test_image_reposted_during_delete_is_kept(self):
+        post_id = self.create_post()
+        release = sqlite_backend.release_image_refs
+        reposted = []
+        def release_then_repost(counts):
+            # 参照が無くなった直後に、同じ画像の投稿が作られる
+            released = release(counts)
+            reposted.append(self.create_post())
+            return released
+        with mock.patch.object(sqlite_backend, 'release_image_refs', release_then_repost):
+            self.assertTrue(db.delete_post(post_id))
+        self.assertTrue(self.image_exists(IMAGE_PATH))
+        self.assertTrue(self.image_exists(VARIANT_PATH))
+
+        self.assertTrue(db.delete_post(reposted[0]))
+        self.assertFalse(self.image_exists(IMAGE_PATH))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+# tests/test_likes.py
+# いいねの同時実行のテスト。複数のスレッドから同じ投稿にいいね・いいね解除を繰り返しても、
+# 投稿の like_count が likes の件数と一致する (増減が失われたり二重に数えられたりしない) ことを確認する。
+# Firestoreエンジンは benchmarks/fake_firestore.py の代用品、SQLiteエンジンは一時ファイルのデータベースで実行する。
+# 代用品はバッチやトランザクションを1つずつ適用するため、ここで確かめられるのは増減が失われないことだけで、
+# 本物のFirestoreでの同じドキュメントへの書き込みの競合 (書き込みの上限) は再現しない。
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import os
+import random
+import threading
+import unittest
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from tests.helpers import use_fake_firestore, use_temp_sqlite
+from utils import firestore_backend, sqlite_backend
+
+THREADS = 8
+OPERATIONS = 60 # 1スレッドあたりの操作回数
+
+
+class LikeConcurrencyMixin:
+    """エンジンごとのテストで共通のテスト。setUp で self.backend と投稿・ユーザーを用意する。"""
+
+    def create_users(self, count):
+        user_ids = []
+        for i in range(count):
+            self.backend.create_user(f"user{i}", 'hash')
+            user_ids.append(self.backend.get_user(f"user{i}")['id'])
+        return user_ids
+
+    def run_threads(self, target, count=THREADS):
+        barrier = threading.Barrier(count)
+        errors = []
+        def run(index):
+            try:
+                barrier.wait()
+                target(index)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_like_and_unlike(self):
+        user_ids = self.create_users(THREADS * 2)
+        post_id = self.backend.create_post(user_ids[0], 'user0', 'comment', '', 'お店', 800)
+
+        def like_and_unlike(index):
+            rng = random.Random(index)
+            # 2つのスレッドが同じユーザーを使い、同じいいねの追加・解除が競合するようにする
+            users = user_ids[index % THREADS::THREADS]
+            for _ in range(OPERATIONS):
+                user_id = rng.choice(users)
+                if rng.random() < 0.6:
+                    self.backend.add_like(user_id, post_id)
+                else:
+                    self.backend.remove_like(user_id, post_id)
+        self.run_threads(like_and_unlike)
+
+        like_count, liked_user_ids = self.like_state(post_id)
+        self.assertEqual(like_count, len(liked_user_ids))
+        for user_id in user_ids:
+            self.assertEqual(self.user_like_count(user_id), int(user_id in liked_user_ids))
+
+    def test_double_like_counts_once(self):
+        user_id, = self.create_users(1)
+        post_id = self.backend.create_post(user_id, 'user0', 'comment', '', '', 0)
+        results = [None] * THREADS
+        def like(index):
+            results[index] = self.backend.add_like(user_id, post_id)
+        self.run_threads(like)
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(self.like_state(post_id), (1, {user_id}))
+        self.assertEqual(self.user_like_count(user_id), 1)
+
+        # 二重のいいね解除も1回だけ数える
+        def unlike(index):
+            results[index] = self.backend.remove_like(user_id, post_id)
+        self.run_threads(unlike)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(self.like_state(post_id), (0, set()))
+
+
+class FirestoreLikeConcurrencyTest(LikeConcurrencyMixin, unittest.TestCase):
+    backend = firestore_backend
+
+    def setUp(self):
+        # 往復ごとに遅延を入れ、スレッドの処理が交互に進むようにする
+        self.fake_db, _ = use_fake_firestore(self, latency=0.001)
+
+    def test_folded_counters(self):
+        user_ids = self.create_users(3)
+        post_id = self.backend.create_post(user_ids[0], 'user0', 'comment', '', 'お店', 800)
+        for user_id in user_ids:
+            self.backend.add_like(user_id, post_id)
+        self.backend.remove_like(user_ids[0], post_id)
+        # ユーザー・店舗・日次集計のいいね数はまとめて書き込まれる
+        firestore_backend.flush_like_counters()
+        self.assertEqual([self.user_like_count(user_id) for user_id in user_ids], [0, 1, 1])
+        self.assertEqual(self.fake_db.docs('shops')[firestore_backend._shop_ref('お店').id]['like_total'], 2)
+        self.assertEqual(sum(day['likes'] for day in firestore_backend._read_daily_stats().values()), 2)
+
+    def like_state(self, post_id):
+        post = self.fake_db.docs('posts')[post_id]
+        user_ids = {like['user_id'] for like in self.fake_db.docs('likes').values() if like['post_id'] == post_id}
+        return post['like_count'], user_ids
+
+    def user_like_count(self, user_id):
+        # ユーザーのいいね数はまとめて書き込まれる
+        firestore_backend.flush_like_counters()
+        return self.fake_db.docs('users')[user_id]['like_count']
+
+
+class SqliteLikeConcurrencyTest(LikeConcurrencyMixin, unittest.TestCase):
+    backend = sqlite_backend
+
+    def setUp(self):
+        use_temp_sqlite(self)
+
+    def like_state(self, post_id):
+        conn = sqlite_backend._connect()
+        like_count = conn.execute('SELECT like_count FROM posts WHERE id = ?', (post_id,)).fetchone()[0]
+        user_ids = {row[0] for row in conn.execute('SELECT user_id FROM likes WHERE post_id = ?', (post_id,))}
+        return like_count, user_ids
+
+    def user_like_count(self, user_id):
+        conn = sqlite_backend._connect()
+        return conn.execute('SELECT like_count FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# tests/test_search.py
+# 投稿の検索のテスト。検索語の2文字ずつの語をすべて含んでいても、検索語が店舗名かコメントに
+# 続けて現れない投稿は検索結果に含まれないこと、その場合も1ページ分を読み進めて返すことを確認する。
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import os
+import unittest
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from tests.helpers import use_fake_firestore, use_temp_sqlite
+from utils import firestore_backend, search, sqlite_backend
+
+
+class SearchMixin:
+    """エンジンごとのテストで共通のテスト。setUp で self.backend を用意する。"""
+
+    def setUp(self):
+        self.backend.create_user('user0', 'hash')
+        self.user_id = self.backend.get_user('user0')['id']
+
+    def create_post(self, comment, shop_name=''):
+        return self.backend.create_post(self.user_id, 'user0', comment, '', shop_name, 0)
+
+    def search(self, query, page_size=20, start_after=None):
+        return self.backend.search_posts(search.query_terms(query), page_size, start_after=start_after,
+                                         phrases=search.query_phrases(query))
+
+    def test_bigrams_apart_do_not_match(self):
+        matched = self.create_post('さくら並木のランチ')
+        self.create_post('さくさくの衣とくらげ') # 「さく」「くら」を含むが「さくら」は含まない
+        posts, next_cursor = self.search('さくら')
+        self.assertEqual([post['id'] for post in posts], [matched])
+        self.assertIsNone(next_cursor)
+
+    def test_shop_name_and_comment_do_not_join(self):
+        matched = self.create_post('カレーが美味しい', 'カレー屋')
+        self.create_post('レーズンパン', 'カレ食堂') # 「カレ」は店舗名、「レー」はコメントにしかない
+        posts, _ = self.search('カレー')
+        self.assertEqual([post['id'] for post in posts], [matched])
+
+    def test_fills_page_past_false_matches(self):
+        matched = [self.create_post(f'さくら {i}') for i in range(3)]
+        for i in range(10):
+            self.create_post(f'さくさく くらげ {i}')
+        first, cursor = self.search('さくら', page_size=2)
+        self.assertEqual(len(first), 2)
+        self.assertIsNotNone(cursor)
+        second, cursor = self.search('さくら', page_size=2, start_after=cursor)
+        self.assertEqual(len(second), 1)
+        self.assertIsNone(cursor)
+        self.assertEqual({post['id'] for post in first + second}, set(matched))
+
+
+class FirestoreSearchTest(SearchMixin, unittest.TestCase):
+    backend = firestore_backend
+
+    def setUp(self):
+        use_fake_firestore(self)
+        super().setUp()
+
+
+class SqliteSearchTest(SearchMixin, unittest.TestCase):
+    backend = sqlite_backend
+
+    def setUp(self):
+        use_temp_sqlite(self)
+        super().setUp()
+
+
+if __name__ == "__main__":
+    unittest.main()
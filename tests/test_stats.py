@@ -0,0 +1,49 @@
+# tests/test_stats.py
+# 日次集計 (stats_daily) のテスト。投稿やユーザーを削除したときに、その日に投稿したユーザー (active_poster_ids) から
+# そのユーザーが除かれることを確認する。Firestoreエンジンを benchmarks/fake_firestore.py の代用品で実行する。
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import os
+import unittest
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from tests.helpers import use_fake_firestore
+from utils import firestore_backend
+from utils.dates import jst_date_str
+
+
+class ActivePosterTest(unittest.TestCase):
+
+    def setUp(self):
+        use_fake_firestore(self)
+
+    def create_user(self, nickname):
+        firestore_backend.create_user(nickname, 'hash')
+        return firestore_backend.get_user(nickname)['id']
+
+    def create_post(self, user_id):
+        return firestore_backend.create_post(user_id, 'nickname', 'comment', '', '', 0)
+
+    def active_posters(self):
+        day = firestore_backend._read_daily_stats().get(jst_date_str())
+        return day['active_poster_ids'] if day else set()
+
+    def test_delete_last_post_of_the_day(self):
+        user_id = self.create_user('user0')
+        post_ids = [self.create_post(user_id) for _ in range(2)]
+        firestore_backend.delete_post(post_ids[0])
+        self.assertEqual(self.active_posters(), {user_id})
+        firestore_backend.delete_post(post_ids[1])
+        self.assertEqual(self.active_posters(), set())
+
+    def test_delete_user(self):
+        user_ids = [self.create_user(f"user{i}") for i in range(2)]
+        for user_id in user_ids:
+            self.create_post(user_id)
+        firestore_backend.delete_user_cascade(user_ids[0])
+        self.assertEqual(self.active_posters(), {user_ids[1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
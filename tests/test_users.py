@@ -0,0 +1,74 @@
+# tests/test_users.py
+# ユーザー管理画面の一覧 (get_users_page) のテスト。init_db() で設定した管理者が除かれること、
+# 投稿数・いいね数が投稿・いいねの追加と削除 (ユーザーの削除を含む) に追従することを確認する。
+# 使い方 (リポジトリのルートで実行): python -m unittest discover tests
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('LUNCH_SNS_BACKEND', 'sqlite')
+
+from tests.helpers import use_fake_firestore, use_temp_sqlite
+from utils import db, firestore_backend, sqlite_backend
+
+ADMIN_NICKNAME = 'owner' # 'admin' 以外の名前で、設定した管理者が除かれることを確かめる
+
+
+class UsersPageMixin:
+    """エンジンごとのテストで共通のテスト。setUp で self.backend を用意する。"""
+
+    def setUp(self):
+        for name, value in (('_backend', self.backend), ('_admin_nickname', None)):
+            patcher = mock.patch.object(db, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        db.init_db(ADMIN_NICKNAME, 'hash')
+
+    def users(self):
+        firestore_backend.flush_like_counters()
+        users, _ = db.get_users_page(50)
+        return {user['nickname']: (user['post_count'], user['like_count']) for user in users}
+
+    def test_admin_is_excluded(self):
+        db.create_user('admin', 'hash')
+        self.assertEqual(self.users(), {'admin': (0, 0)})
+
+    def test_counts_follow_writes(self):
+        ids = {}
+        for nickname in ('alice', 'bob', 'carol'):
+            db.create_user(nickname, 'hash')
+            ids[nickname] = db.get_user(nickname)['id']
+        alice_posts = [db.create_post(ids['alice'], 'alice', 'comment', '', '', 0) for _ in range(2)]
+        bob_post = db.create_post(ids['bob'], 'bob', 'comment', '', '', 0)
+        for post_id in alice_posts:
+            db.add_like(ids['bob'], post_id)
+            db.add_like(ids['carol'], post_id)
+        db.add_like(ids['carol'], bob_post)
+        db.remove_like(ids['carol'], alice_posts[1])
+        self.assertEqual(self.users(), {'alice': (2, 0), 'bob': (1, 2), 'carol': (0, 2)})
+
+        db.delete_post(bob_post)
+        self.assertEqual(self.users(), {'alice': (2, 0), 'bob': (0, 2), 'carol': (0, 1)})
+        db.delete_user(ids['alice'])
+        self.assertEqual(self.users(), {'bob': (0, 0), 'carol': (0, 0)})
+
+
+class FirestoreUsersPageTest(UsersPageMixin, unittest.TestCase):
+    backend = firestore_backend
+
+    def setUp(self):
+        use_fake_firestore(self)
+        super().setUp()
+
+
+class SqliteUsersPageTest(UsersPageMixin, unittest.TestCase):
+    backend = sqlite_backend
+
+    def setUp(self):
+        use_temp_sqlite(self)
+        super().setUp()
+
+
+if __name__ == "__main__":
+    unittest.main()
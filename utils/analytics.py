@@ -0,0 +1,248 @@
+# utils/analytics.py
+# 管理者ダッシュボードのトレンド分析。posts / likes / users を Parquet ファイルへ差分エクスポートし、
+# 週・月ごとの推移、価格帯の分布、曜日×時間帯の投稿数を pandas / Arrow のベクトル演算で集計する。
+# 集計のたびにFirestoreを全件読むと読み取り件数が投稿数に比例するため、読むのは前回から変わった分だけにする。
+#
+# ファイルの配置:
+#   {EXPORT_DIR}/{コレクション}/month=YYYY-MM/part-{実行番号}-{連番}.parquet   (作成日時の月(日本時間)で分割)
+#   {EXPORT_DIR}/_state.json   前回の差分の基準時刻(ウォーターマーク)と全件エクスポートの日時
+# 差分エクスポートは、変更日時がウォーターマーク以降の行を新しいファイルとして追加する。
+# 同じIDの行が複数ある場合は、読み込むときに実行番号の新しい行を使う。
+# 削除されたドキュメントは差分では検出できないため、FULL_EXPORT_INTERVAL ごとの全件エクスポートで反映する。
+# エクスポートは export_analytics.py (cron などで定期実行) か、ダッシュボードから開始するバックグラウンドのジョブで行い、
+# ダッシュボードの描画はエクスポート済みのファイルを読むだけにする。
+#
+# 環境変数:
+#   LUNCH_SNS_EXPORT_DIR   出力先のディレクトリ (既定: analytics_export)
+#
+# pandas / pyarrow は読み込みに時間がかかるため、このモジュールはダッシュボードを開いたときに初めて読み込む。
+
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from utils import db
+
+EXPORT_DIR = Path(os.environ.get('LUNCH_SNS_EXPORT_DIR', 'analytics_export'))
+FULL_EXPORT_INTERVAL = datetime.timedelta(days=1) # 削除を反映するため全件をエクスポートし直す間隔
+WATERMARK_OVERLAP = datetime.timedelta(minutes=1) # 時刻のずれや書き込みの遅れを吸収するため、基準時刻を遡って取得する
+MAX_PARTITION_FILES = 20 # 差分のファイルがこれより増えた月は1つのファイルにまとめる
+
+_TIMESTAMP = pa.timestamp('us', tz='UTC')
+
+# コレクション -> (エクスポートする列とその型, 変更を検出する日時の列)
+COLLECTIONS = {
+    'posts': (pa.schema([
+        ('id', pa.string()), ('user_id', pa.string()), ('shop_name', pa.string()), ('price', pa.int64()),
+        ('like_count', pa.int64()), ('created_at', _TIMESTAMP), ('updated_at', _TIMESTAMP),
+    ]), 'updated_at'),
+    'likes': (pa.schema([
+        ('id', pa.string()), ('user_id', pa.string()), ('post_id', pa.string()), ('created_at', _TIMESTAMP),
+    ]), 'created_at'),
+    'users': (pa.schema([
+        ('id', pa.string()), ('created_at', _TIMESTAMP),
+    ]), 'created_at'),
+}
+
+WEEKDAYS = ['月', '火', '水', '木', '金', '土', '日']
+PRICE_BINS = [0, 500, 800, 1000, 1200, 1500, 2000, float('inf')]
+PRICE_LABELS = ['〜499円', '500〜799円', '800〜999円', '1,000〜1,199円', '1,200〜1,499円', '1,500〜1,999円', '2,000円〜']
+TREND_FREQS = {'日': 'D', '週': 'W-MON', '月': 'MS'} # 週は月曜始まり
+
+_export_lock = threading.Lock() # エクスポートを1つずつ実行する
+_lock = threading.Lock() # _frames を保護する
+_frames = None # (エクスポートの日時, {コレクション: DataFrame})
+
+
+# --- エクスポート ---
+def _load_state():
+    try:
+        state = json.loads((EXPORT_DIR / '_state.json').read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+    return {key: datetime.datetime.fromisoformat(value) for key, value in state.items()}
+
+def _save_state(state):
+    tmp_path = EXPORT_DIR / '_state.json.tmp'
+    tmp_path.write_text(json.dumps({key: value.isoformat() for key, value in state.items()}), encoding='utf-8')
+    os.replace(tmp_path, EXPORT_DIR / '_state.json')
+
+def _to_table(rows, schema, run):
+    """行の辞書のリストを、実行番号と月の列を加えた Arrow のテーブルに変換します。"""
+    columns = {}
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if pa.types.is_integer(field.type):
+            values = [int(value) if isinstance(value, (int, float)) else None for value in values]
+        columns[field.name] = pa.array(values, type=field.type)
+    table = pa.table(columns, schema=schema)
+    table = table.append_column('_run', pa.array([run] * len(rows), type=pa.int64()))
+    month = pc.strftime(table['created_at'].cast(pa.timestamp('us', tz='Asia/Tokyo')), format='%Y-%m')
+    return table.append_column('month', month)
+
+def _write(table, directory, run):
+    ds.write_dataset(
+        table, directory, format='parquet', partitioning=['month'], partitioning_flavor='hive',
+        basename_template=f"part-{run:013d}-{{i}}.parquet", existing_data_behavior='overwrite_or_ignore',
+    )
+
+def _compact(directory):
+    """差分のファイルが増えた月を、IDごとに最新の行だけを残した1つのファイルにまとめます。"""
+    for partition in directory.glob('month=*'):
+        files = sorted(partition.glob('*.parquet'))
+        if len(files) <= MAX_PARTITION_FILES:
+            continue
+        table = _dedupe(ds.dataset(files, format='parquet').to_table())
+        # まとめたファイルは元のファイルのうち最も新しい実行番号の名前で置き換える
+        tmp_path = partition / 'compact.tmp'
+        pq.write_table(table, tmp_path)
+        for file in files:
+            file.unlink()
+        tmp_path.rename(files[-1])
+
+def _dedupe(table):
+    """同じIDの行のうち、実行番号の最も新しい行だけを残します。"""
+    if table.num_rows == 0:
+        return table
+    table = table.sort_by([('id', 'ascending'), ('_run', 'descending')])
+    ids = table['id'].combine_chunks()
+    # 並べ替えた後、直前の行とIDが異なる行が各IDの最新の行
+    first = pc.not_equal(ids[1:], ids[:-1])
+    keep = pa.concat_arrays([pa.array([True]), pc.fill_null(first, True)])
+    return table.filter(keep)
+
+def export(full=False):
+    """posts / likes / users をエクスポートします。
+
+    full=True の場合、または全件エクスポートを一度も行っていない場合は全件を書き直します。
+    それ以外は前回のウォーターマーク以降に変更された行だけを追加します。コレクションごとの行数を返します。
+    """
+    with _export_lock:
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        state = _load_state()
+        full = full or 'full_exported_at' not in state
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        since = None if full else state['watermark'] - WATERMARK_OVERLAP
+        run = int(time.time() * 1000)
+
+        counts = {}
+        for collection, (schema, changed_field) in COLLECTIONS.items():
+            fields = [field.name for field in schema if field.name != 'id']
+            rows = db.export_rows(collection, fields, changed_field, since=since)
+            counts[collection] = len(rows)
+            table = _to_table(rows, schema, run)
+            directory = EXPORT_DIR / collection
+            if full:
+                # 書き終えてから置き換え、読み込み中に空のディレクトリが見えないようにする
+                tmp_dir = EXPORT_DIR / f".{collection}-{run}"
+                tmp_dir.mkdir()
+                _write(table, tmp_dir, run)
+                old_dir = EXPORT_DIR / f".{collection}-{run}-old"
+                if directory.exists():
+                    directory.rename(old_dir)
+                tmp_dir.rename(directory)
+                shutil.rmtree(old_dir, ignore_errors=True)
+            elif table.num_rows:
+                _write(table, directory, run)
+                _compact(directory)
+
+        state['watermark'] = started_at
+        state['exported_at'] = datetime.datetime.now(datetime.timezone.utc)
+        if full:
+            state['full_exported_at'] = started_at
+        _save_state(state)
+        return counts
+
+def full_export_due():
+    """前回の全件エクスポートから FULL_EXPORT_INTERVAL 以上経っている(または一度も行っていない)かを返します。"""
+    full_exported_at = _load_state().get('full_exported_at')
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return full_exported_at is None or now - full_exported_at >= FULL_EXPORT_INTERVAL
+
+def export_job(job):
+    """utils.jobs のジョブとしてエクスポートします (全件エクスポートの時期であれば全件を書き直します)。"""
+    export(full=full_export_due())
+    job.advance()
+
+def exported_at():
+    """最後にエクスポートした日時を返します。まだエクスポートしていない場合は None です。"""
+    return _load_state().get('exported_at')
+
+
+# --- 読み込みと集計 ---
+def _read(collection):
+    schema, _ = COLLECTIONS[collection]
+    directory = EXPORT_DIR / collection
+    # 0件のコレクションを全件エクスポートするとファイルの無いディレクトリになる
+    if directory.exists() and any(directory.glob('month=*/*.parquet')):
+        table = ds.dataset(directory, format='parquet', partitioning='hive').to_table(
+            columns=[field.name for field in schema] + ['_run']
+        )
+        table = _dedupe(table).drop_columns(['_run'])
+    else:
+        table = schema.empty_table()
+    frame = table.to_pandas()
+    for field in schema:
+        if field.type == _TIMESTAMP:
+            frame[field.name] = frame[field.name].dt.tz_convert('Asia/Tokyo')
+    return frame
+
+def load_frames():
+    """エクスポート済みの posts / likes / users を DataFrame で返します (日時は日本時間)。
+
+    同じエクスポートに対しては読み込み結果を使い回します。
+    このプロセスでエクスポートの実行中は、書き込み途中のファイルを読まないよう前回の読み込み結果を返します。
+    """
+    global _frames
+    current = exported_at()
+    with _lock:
+        if _frames is not None and (_frames[0] == current or _export_lock.locked()):
+            return _frames[1]
+    with _export_lock, _lock:
+        current = exported_at()
+        frames = {collection: _read(collection) for collection in COLLECTIONS}
+        # 削除済みの投稿へのいいね(次の全件エクスポートまで残る)は除く
+        frames['likes'] = frames['likes'][frames['likes']['post_id'].isin(frames['posts']['id'])]
+        _frames = (current, frames)
+        return frames
+
+def trend(frames, freq='W-MON'):
+    """期間ごとの投稿数・いいね数・新規ユーザー数・投稿者数を返します。freq は pandas の期間の指定です。"""
+    def resample(frame, column=None):
+        frame = frame.dropna(subset=['created_at'])
+        if frame.empty:
+            # 0件の DataFrame は resample できないため、空の系列にする (結合した後で0を埋める)
+            return pd.Series(dtype='int64')
+        resampler = frame.resample(freq, on='created_at', label='left', closed='left')
+        return resampler[column].nunique() if column else resampler.size()
+    result = pd.DataFrame({
+        '投稿数': resample(frames['posts']),
+        'いいね数': resample(frames['likes']),
+        '新規ユーザー数': resample(frames['users']),
+        '投稿者数': resample(frames['posts'], 'user_id'),
+    })
+    return result.fillna(0).astype('int64')
+
+def price_distribution(frames):
+    """価格帯ごとの投稿数を返します (金額が未入力の投稿は除く)。"""
+    prices = frames['posts']['price']
+    prices = prices[prices > 0]
+    counts = pd.cut(prices, bins=PRICE_BINS, labels=PRICE_LABELS, right=False).value_counts(sort=False)
+    return counts.rename('投稿数').rename_axis('価格帯')
+
+def weekday_hour_counts(frames):
+    """曜日×時間帯(日本時間)ごとの投稿数を、縦長の DataFrame (曜日, 時, 投稿数) で返します。"""
+    created_at = frames['posts']['created_at'].dropna()
+    counts = pd.crosstab(created_at.dt.dayofweek, created_at.dt.hour)
+    counts = counts.reindex(range(7), fill_value=0)
+    counts.index = WEEKDAYS
+    return counts.rename_axis(index='曜日', columns='時').stack().rename('投稿数').reset_index()
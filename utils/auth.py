@@ -1,5 +1,11 @@
 # utils/auth.py
+import base64
 import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
 
 def hash_password(password):
     """パスワードをSHA256でハッシュ化します。"""
@@ -7,4 +13,53 @@ def hash_password(password):
 
 def verify_password(plain_password, hashed_password):
     """入力されたパスワードがハッシュ化されたパスワードと一致するか検証します。"""
-    return hash_password(plain_password) == hashed_password
\ No newline at end of file
+    return hash_password(plain_password) == hashed_password
+
+# --- セッショントークン ---
+# 自動ログイン用のCookieには、ユーザーID・ニックネーム・セッションのバージョン・発行日時・有効期限を
+# HMAC-SHA256で署名したトークンを保存する。署名の検証はデータベースを読まずに行える。
+# 署名の鍵は環境変数 SESSION_SECRET で指定する。未設定の場合はプロセスごとに生成するため、
+# 再起動すると発行済みのトークンは無効になる (再ログインが必要)。
+SESSION_TTL = 30 * 24 * 3600 # トークンの有効期限 (秒)
+
+_session_secret = os.environ.get('SESSION_SECRET')
+if _session_secret:
+    _session_key = _session_secret.encode()
+else:
+    print("SESSION_SECRET is not set. Session tokens will be invalidated on restart.")
+    _session_key = secrets.token_bytes(32)
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(payload):
+    return _b64encode(hmac.new(_session_key, payload.encode(), hashlib.sha256).digest())
+
+def create_session_token(user_id, nickname, version=0, ttl=SESSION_TTL):
+    """ユーザーのセッショントークンを発行します。"""
+    now = int(time.time())
+    payload = _b64encode(json.dumps({
+        'uid': user_id, 'nick': nickname, 'ver': version, 'iat': now, 'exp': now + ttl,
+    }, separators=(',', ':')).encode())
+    return f"{payload}.{_sign(payload)}"
+
+def verify_session_token(token):
+    """セッショントークンを検証し、中身の辞書を返します。
+
+    署名が正しくない、形式が不正、または期限切れの場合は None を返します。
+    """
+    if not token or token.count('.') != 1:
+        return None
+    payload, signature = token.split('.')
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        data = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or data.get('exp', 0) < time.time():
+        return None
+    return data
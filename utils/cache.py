@@ -0,0 +1,253 @@
+# utils/cache.py
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TTLCache:
+    """スレッドセーフな、有効期限付きのLRUキャッシュ。
+
+    プロセス内の全セッションで共有することを想定しています。
+    件数が maxsize を超えると、最も長く参照されていないエントリから破棄します。
+    エントリにはタグを付けられ、invalidate_tag() でタグ単位に無効化できます。
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict() # key -> (有効期限, 値, タグ)
+        self._tags = {} # タグ -> そのタグを持つキーの集合
+        self._generation = 0 # 無効化のたびに増える世代番号
+        self._loading = {} # 取得中のキー -> ロック (同じキーの同時取得を1回にまとめる)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """キャッシュから値を取得します。期限切れの場合は default を返します。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, tags=()):
+        """値をキャッシュに格納します。ttl を省略した場合は既定の有効期限を使います。"""
+        with self._lock:
+            self._store(key, value, ttl, tags)
+
+    def get_or_set(self, key, factory, ttl=None, tags=()):
+        """キャッシュにあれば返し、無ければ factory() の結果を格納して返します。
+
+        同じキーを複数のスレッドが同時に取得しようとした場合、factory() は1回だけ呼ばれます。
+        tags には値を受け取ってタグの集合を返す関数も指定できます。
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                # 待っている間に他のスレッドが格納していればそれを使う
+                with self._lock:
+                    entry = self._data.get(key)
+                    if entry is not None and entry[0] > time.monotonic():
+                        return entry[1]
+                    generation = self._generation
+
+                value = factory()
+                entry_tags = tags(value) if callable(tags) else tags
+                with self._lock:
+                    # 取得中に無効化が入った場合、古いかもしれない値は格納しない
+                    if generation == self._generation:
+                        self._store(key, value, ttl, entry_tags)
+                return value
+            finally:
+                with self._lock:
+                    if self._loading.get(key) is key_lock:
+                        del self._loading[key]
+
+    def delete(self, key):
+        """指定したキーのエントリを削除します。"""
+        with self._lock:
+            self._generation += 1
+            self._remove(key)
+
+    def invalidate_tag(self, *tags):
+        """指定したタグを持つエントリをすべて削除します。"""
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """全てのエントリを削除します。"""
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """ヒット数・ミス数・現在の件数を辞書で返します。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+    # --- 以下はロックを保持した状態で呼び出す ---
+    def _store(self, key, value, ttl, tags):
+        self._remove(key)
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        tags = frozenset(tags)
+        self._data[key] = (expires_at, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._data) > self.maxsize:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class DiskLRUCache:
+    """スレッドセーフな、合計サイズの上限付きでバイト列をローカルディスクに保存するLRUキャッシュ。
+
+    プロセス内の全セッションで共有することを想定しています。
+    合計サイズが max_bytes を超えると、最も長く参照されていないエントリから削除します。
+    起動時はディレクトリに残っているファイルを更新日時の古い順に読み込み、前回のキャッシュを引き継ぎます。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0 # キャッシュから返したバイト数 (ストレージから取得せずに済んだ量)
+        self._entries = OrderedDict() # ファイル名 -> サイズ
+        self._size = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix == '.tmp':
+                # 書き込み途中で終了したファイル
+                path.unlink(missing_ok=True)
+            elif path.is_file():
+                stat = path.stat()
+                files.append((stat.st_mtime, path.name, stat.st_size))
+        with self._lock:
+            for _, name, size in sorted(files):
+                self._entries[name] = size
+                self._size += size
+            self._evict()
+
+    @staticmethod
+    def _filename(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        """キャッシュからバイト列を取得します。無い場合は None を返します。"""
+        name = self._filename(key)
+        with self._lock:
+            found = name in self._entries
+            if found:
+                self._entries.move_to_end(name)
+        if found:
+            try:
+                data = (self.directory / name).read_bytes()
+            except FileNotFoundError:
+                # 読み込む前に他のスレッドが削除した
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.bytes_saved += len(data)
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, data):
+        """バイト列をキャッシュに格納します。max_bytes より大きい場合は格納しません。"""
+        if len(data) > self.max_bytes:
+            return
+        name = self._filename(key)
+        # 読み込み中のスレッドが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = self.directory / f"{name}.{threading.get_ident()}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.directory / name)
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def get_or_set(self, key, factory):
+        """キャッシュにあれば返し、無ければ factory() の結果を格納して返します。"""
+        data = self.get(key)
+        if data is None:
+            data = factory()
+            self.set(key, data)
+        return data
+
+    def delete(self, key):
+        """指定したキーのエントリを削除します。"""
+        name = self._filename(key)
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+        (self.directory / name).unlink(missing_ok=True)
+
+    def stats(self):
+        """ヒット数・ミス数・キャッシュから返したバイト数・現在の合計サイズなどを辞書で返します。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+    # --- 以下はロックを保持した状態で呼び出す ---
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            (self.directory / name).unlink(missing_ok=True)
@@ -0,0 +1,28 @@
+# utils/dates.py
+
+import datetime
+import pytz
+
+# 日付の区切り(日次集計・ランキング)はすべて日本時間で扱う
+JST = pytz.timezone('Asia/Tokyo')
+
+def jst_date_str(dt=None):
+    """日時(省略時は現在時刻)を日本時間の 'YYYY-MM-DD' に変換します。"""
+    if dt is None:
+        dt = datetime.datetime.now(JST)
+    elif dt.tzinfo is None:
+        dt = pytz.utc.localize(dt)
+    return dt.astimezone(JST).strftime('%Y-%m-%d')
+
+def jst_day_range(day):
+    """日付(date または 'YYYY-MM-DD')の日本時間での開始・終了日時を返します。"""
+    if isinstance(day, str):
+        day = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+    start_of_day = JST.localize(datetime.datetime.combine(day, datetime.time.min))
+    end_of_day = JST.localize(datetime.datetime.combine(day, datetime.time.max))
+    return start_of_day, end_of_day
+
+def recent_date_strs(days, end_date=None):
+    """end_date(省略時は今日)から遡って days 日分の 'YYYY-MM-DD' を新しい順に返します。"""
+    end_date = end_date or datetime.datetime.now(JST).date()
+    return [(end_date - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
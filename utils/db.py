@@ -1,305 +1,494 @@
 # utils/db.py
+# アプリから使うデータアクセスの窓口。
+# 実際の読み書きはストレージエンジン (utils/firestore_backend.py または utils/sqlite_backend.py) が行い、
+# ここではプロセス全体で共有するキャッシュと、書き込み時の無効化を担当する。
+# 公開関数は utils.metrics で計測し、呼び出し回数や読み書き件数を管理者ダッシュボードに表示する。
+# ただしキャッシュの統計を返す *_cache_stats は、ダッシュボードが計測値と一緒に表示するための
+# メモリ上の値の読み取りなので計測しない (計測するとダッシュボードの表示のたびに呼び出しが記録される)。
+#
+# エンジンは環境変数 LUNCH_SNS_BACKEND で選択する ('firestore' (既定) または 'sqlite')。
 
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
 import datetime
-import pytz
 import os
-import json
-
-# --- Firestore 初期化 ---
-# この関数は app.py から一度だけ呼び出される
-_db_initialized = False
-db = None
-bucket = None
-
-def initialize_firestore():
-    """Firestoreデータベースを初期化します。"""
-    global _db_initialized, db, bucket
-    if _db_initialized:
-        return
-
-    import base64 # base64をインポート
-    
-    try:    
-        # Streamlit CloudのSecretsを使用する場合
-        if 'FIREBASE_CREDENTIALS' in os.environ:
-            # creds_json = json.loads(os.environ['FIREBASE_CREDENTIALS'])
-            # cred = credentials.Certificate(creds_json)
-            b64_creds = os.environ['FIREBASE_CREDENTIALS']
-            decoded_creds = base64.b64decode(b64_creds)
-            creds_json = json.loads(decoded_creds)
-            cred = credentials.Certificate(creds_json)
-        # ローカルのJSONファイルを使用する場合
-        else:
-            cred = credentials.Certificate("firebase-credentials.json")
-
-        # ▼▼▼▼▼ ここから修正 ▼▼▼▼▼
-        # プロジェクトIDを取得
-        project_id = cred.project_id
-    
-        # !!!! 実際のバケット名に合わせてドメインを修正 !!!!
-        # ".appspot.com" ではなく、コンソールで確認した ".firebasestorage.app" を使用
-        bucket_name = f'{project_id}.firebasestorage.app'
-
-        # アプリの初期化
-        firebase_admin.initialize_app(cred, {
-            'storageBucket': bucket_name
-        })
-    
-        db = firestore.client()
-        # バケット名を明示的に指定して取得する
-        bucket = storage.bucket(name=bucket_name) 
-        _db_initialized = True
-        print(f"Firebase initialized. Using bucket: {bucket_name}") # 確認用のログを更新
-        # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
-        
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from utils import auth, metrics, search
+from utils.cache import DiskLRUCache, TTLCache
+from utils.dates import jst_date_str
+
+BACKEND = os.environ.get('LUNCH_SNS_BACKEND', 'firestore').lower()
+if BACKEND == 'firestore':
+    from utils import firestore_backend as _backend
+elif BACKEND == 'sqlite':
+    from utils import sqlite_backend as _backend
+else:
+    raise ValueError(f"Unknown LUNCH_SNS_BACKEND: {BACKEND}")
+
+LEADERBOARD_SIZE = _backend.LEADERBOARD_SIZE
+
+# --- 署名付きURLキャッシュ ---
+# 署名付きURLの生成はRSA署名を伴うため、プロセス全体で同じURLを使い回す。
+# URLが変わらないことでブラウザ側の画像キャッシュも有効になる。
+SIGNED_URL_EXPIRATION = datetime.timedelta(seconds=3600) # URLの有効期限
+SIGNED_URL_REFRESH_MARGIN = datetime.timedelta(seconds=600) # 期限切れのこの時間前に再生成する
+_signed_url_cache = TTLCache(
+    maxsize=2048,
+    ttl=(SIGNED_URL_EXPIRATION - SIGNED_URL_REFRESH_MARGIN).total_seconds()
+)
+
+@metrics.instrument
+def get_image_url(image_path):
+    """画像の署名付きURLを取得します。有効期限内であればキャッシュ済みのURLを返します。"""
+    return _signed_url_cache.get_or_set(
+        image_path,
+        lambda: _backend.get_blob_url(image_path, SIGNED_URL_EXPIRATION)
+    )
+
+# --- 画像プロキシ ---
+# LUNCH_SNS_IMAGE_PROXY=True の場合、画像は署名付きURLではなくバイト列で st.image に渡し、
+# Streamlitのサーバーからブラウザへ送る。バイト列はローカルディスクのLRUキャッシュから返し、
+# 無い場合だけストレージからダウンロードする (閲覧のたびのCloud Storageへのアクセスと転送量を減らす)。
+IMAGE_PROXY = os.environ.get('LUNCH_SNS_IMAGE_PROXY', "False") == "True"
+IMAGE_CACHE_DIR = os.environ.get('LUNCH_SNS_IMAGE_CACHE_DIR', 'image_cache')
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('LUNCH_SNS_IMAGE_CACHE_MB', '512')) * 1024 * 1024
+_image_cache = DiskLRUCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES) if IMAGE_PROXY else None
+
+@metrics.instrument
+def get_image_bytes(image_path):
+    """画像のバイト列を取得します。ローカルのキャッシュにあればストレージにはアクセスしません。"""
+    return _image_cache.get_or_set(image_path, lambda: _backend.download_blob(image_path))
+
+@metrics.instrument
+def get_image_source(image_path):
+    """st.image に渡す画像を返します。画像プロキシが有効ならバイト列、無効なら署名付きURLです。"""
+    if IMAGE_PROXY:
+        return get_image_bytes(image_path)
+    return get_image_url(image_path)
+
+def get_image_cache_stats():
+    """画像キャッシュのヒット数・ミス数・キャッシュから返したバイト数などを返します。無効な場合は None です。"""
+    return _image_cache.stats() if _image_cache is not None else None
+
+@metrics.instrument
+def upload_image(path, data, content_type, cache_control=None):
+    """画像のバイト列をストレージにアップロードします。"""
+    _backend.upload_blob(path, data, content_type, cache_control=cache_control)
+
+BLOB_DELETE_CONCURRENCY = 8 # 画像を並行して削除する数
+
+def _delete_image(image_path):
+    try:
+        _backend.delete_blob(image_path)
     except Exception as e:
-        print(f"!!!!!!!!!! FIREBASE INITIALIZATION FAILED !!!!!!!!!!")
-        print(f"Error: {e}")
-        # エラー時にもアプリが停止しないように、ダミーの値を設定するなどしても良いが、
-        # ここではエラーを明確にするためにraiseする
-        raise e
-
-# --- Helper Functions ---
-def _doc_to_dict(doc):
-    """Firestoreのドキュメントを辞書に変換し、IDを追加します。"""
-    # docがNoneの場合、またはドキュメントが存在しない場合に対応
-    if not doc or not doc.exists:
-        return None
-    data = doc.to_dict()
-    data['id'] = doc.id
-    return data
+        # 画像が残っても投稿の削除は完了しているため、ログだけ残して続ける
+        print(f"Error deleting image {image_path}: {e}")
+    _signed_url_cache.delete(image_path)
+    if _image_cache is not None:
+        _image_cache.delete(image_path)
+
+def _delete_released_image(image_key, image_paths):
+    """参照が無くなった画像を削除します。
+
+    参照を減らしてから削除するまでの間に同じ画像の投稿が作られると、参照が作り直されて画像がアップロードし直される。
+    その画像を消さないよう、ファイルごとに削除の直前で参照を読み直し、参照があれば残りを削除せずに終えます。
+    """
+    for image_path in image_paths:
+        ref = _backend.get_image_ref(image_key)
+        if ref is not None and ref.get('count', 0) > 0:
+            return
+        _delete_image(image_path)
+
+def _delete_images(*posts):
+    """削除した投稿の画像(元画像とリサイズ済みバリアント)をストレージから並行して削除します。
+
+    内容のハッシュで保存した画像は参照カウントを減らし、参照する投稿が無くなった場合のみ削除します。
+    """
+    image_paths = []
+    released = Counter()
+    for post in posts:
+        if post.get('image_key'):
+            released[post['image_key']] += 1
+        else:
+            # 内容のハッシュで保存する前の投稿は、投稿ごとに別の画像を持つ
+            image_paths.append(post.get('image_path'))
+            image_paths.extend((post.get('image_variants') or {}).values())
+    delete_images(*image_paths)
+    if released:
+        _run_parallel(lambda item: _delete_released_image(*item), _backend.release_image_refs(released).items())
+
+@metrics.instrument
+def delete_images(*image_paths):
+    """画像をストレージから並行して削除します。削除に失敗した画像はログに残して続けます。"""
+    _run_parallel(_delete_image, [path for path in image_paths if path])
+
+def _run_parallel(func, items):
+    items = list(items)
+    if len(items) <= 1:
+        for item in items:
+            func(item)
+        return
+    with ThreadPoolExecutor(max_workers=BLOB_DELETE_CONCURRENCY) as executor:
+        list(executor.map(func, items))
+
+def get_signed_url_cache_stats():
+    """署名付きURLキャッシュのヒット数・ミス数などを返します。"""
+    return _signed_url_cache.stats()
+
+# --- クエリキャッシュ ---
+# Streamlitは操作のたびにスクリプト全体を再実行するため、同じ読み取りクエリが
+# セッション数 x 再実行回数だけ発行される。読み取り結果をプロセス全体で短時間共有し、
+# 書き込み関数は影響するエントリだけをタグで無効化する。
+# タグ: 'posts' (投稿の追加・削除で変わる一覧), 'award', 'post:{id}', 'user_posts:{user_id}',
+#       'search' (投稿の追加・編集・削除で変わる検索結果), 'shops' (投稿・いいねで変わる店舗ごとの集計)
+# キャッシュされた値は全セッションで共有されるため、呼び出し側で変更しないこと。
+QUERY_CACHE_TTL = 30 # 秒
+_query_cache = TTLCache(maxsize=256, ttl=QUERY_CACHE_TTL)
+
+def _post_tags(posts):
+    """投稿のリストから、各投稿の無効化用タグを作ります。"""
+    return {f"post:{post['id']}" for post in posts if post}
+
+def get_query_cache_stats():
+    """クエリキャッシュのヒット数・ミス数などを返します。"""
+    return _query_cache.stats()
+
+# --- ユーザーキャッシュ ---
+# get_user_by_id の結果 (存在しない場合の None を含む) をユーザーIDをキーに短時間共有する。
+# ログインはパスワードを確認するため、キャッシュを使わない get_user で行う。
+USER_CACHE_TTL = 300 # 秒
+_user_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL)
 
 # --- User Functions ---
+@metrics.instrument
 def create_user(nickname, password_hash):
-    """新規ユーザーを作成します。"""
-    # ニックネームの重複チェック
-    users_ref = db.collection('users')
-    existing_user = users_ref.where('nickname', '==', nickname).limit(1).stream()
-    if len(list(existing_user)) > 0:
-        return False # ニックネームが既に存在
-
-    users_ref.add({
-        'nickname': nickname,
-        'password_hash': password_hash,
-        'created_at': firestore.SERVER_TIMESTAMP
-    })
-    return True
+    """新規ユーザーを作成します。ニックネームが既に使われている場合は False を返します。"""
+    return _backend.create_user(nickname, password_hash)
 
+@metrics.instrument
 def get_user(nickname):
     """ニックネームでユーザーを取得します。"""
-    users_ref = db.collection('users')
-    docs = users_ref.where('nickname', '==', nickname).limit(1).stream()
-    user_doc = next(docs, None)
-    return _doc_to_dict(user_doc)
+    return _backend.get_user(nickname)
 
+# --- 画像の参照カウント ---
+@metrics.instrument
+def get_image_ref(image_key):
+    """画像の参照カウント (count, image_path, image_variants) を取得します。無い場合は None です。
+
+    image_variants はアップロードが終わるまで None です。
+    """
+    return _backend.get_image_ref(image_key)
+
+@metrics.instrument
+def complete_image_ref(image_key, image_variants):
+    """画像のアップロードが終わったことを記録します。参照が無くなっていた場合は False を返します。"""
+    return _backend.complete_image_ref(image_key, image_variants)
+
+@metrics.instrument
 def get_user_by_id(user_id):
     """IDでユーザーを取得します。"""
-    doc_ref = db.collection('users').document(user_id)
-    return _doc_to_dict(doc_ref.get())
+    return _user_cache.get_or_set(user_id, lambda: _backend.get_user_by_id(user_id))
+
+@metrics.instrument
+def export_rows(collection, fields, changed_field, since=None):
+    """分析用のエクスポートに、changed_field が since 以降の行を id と fields だけで返します (utils.analytics 用)。
+
+    since を省略した場合は全件を返します。
+    """
+    return _backend.export_rows(collection, fields, changed_field, since=since)
+
+@metrics.instrument
+def get_users_page(page_size=50, start_after=None, nickname_prefix=''):
+    """管理者以外のユーザーを1ページ分取得します (ユーザー管理画面用)。
+
+    各ユーザーは id / nickname / created_at / post_count (投稿数) / like_count (付けたいいね数) のみを持ちます。
+    nickname_prefix を指定した場合はニックネームの前方一致で絞り込み、ニックネーム順に返します。
+    指定しない場合は登録日時の新しい順です。start_after には前ページの末尾カーソルを渡します。
+    戻り値は (ユーザーのリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    return _backend.get_users_page(page_size, start_after=start_after, nickname_prefix=nickname_prefix,
+                                   exclude_nickname=_admin_nickname)
+
+# --- セッション ---
+# 自動ログインは Cookie の署名付きトークン (utils/auth.py) で行う。
+# 発行から SESSION_REVALIDATE_INTERVAL 秒以内のトークンは署名の検証だけで受け入れ、データベースは読まない。
+# それより古いトークンはユーザーを読み直して session_version を確認し、新しいトークンを発行し直す。
+# revoke_sessions() で session_version を上げると、発行済みのトークンは
+# このプロセスでは直ちに、他のプロセスでも SESSION_REVALIDATE_INTERVAL 秒以内に無効になる。
+SESSION_REVALIDATE_INTERVAL = 3600 # 秒
+
+@metrics.instrument
+def create_session(user):
+    """ログインしたユーザーのセッショントークンを発行します。"""
+    return auth.create_session_token(user['id'], user['nickname'], user.get('session_version', 0))
+
+@metrics.instrument
+def resolve_session(token):
+    """セッショントークンからログイン中のユーザーを求めます。
+
+    戻り値は (ユーザー情報 {'id', 'nickname'}, 発行し直したトークン) で、
+    トークンを発行し直さなかった場合は2つ目が None、トークンが無効な場合は (None, None) です。
+    """
+    payload = auth.verify_session_token(token)
+    if payload is None:
+        return None, None
+    user_id = payload['uid']
+    missing = object()
+    user = _user_cache.get(user_id, missing)
+    fresh = time.time() - payload['iat'] < SESSION_REVALIDATE_INTERVAL
+    if user is missing:
+        if fresh:
+            return {'id': user_id, 'nickname': payload['nick']}, None
+        user = get_user_by_id(user_id)
+    # キャッシュにあるか読み直した場合は、削除やセッションの無効化を確認する
+    if user is None or user.get('session_version', 0) != payload['ver']:
+        return None, None
+    user_info = {'id': user['id'], 'nickname': user['nickname']}
+    return user_info, (None if fresh else create_session(user))
+
+@metrics.instrument
+def revoke_sessions(user_id):
+    """ユーザーに発行済みのセッショントークンをすべて無効にします。"""
+    _backend.increment_session_version(user_id)
+    # 新しいバージョンをキャッシュに載せ、このプロセスでは次の確認から無効にする
+    _user_cache.delete(user_id)
+    get_user_by_id(user_id)
 
 # --- Post Functions ---
-def create_post(user_id, nickname, comment, image_path, shop_name, price):
-    """新規投稿を作成します。"""
-    db.collection('posts').add({
-        'user_id': user_id,
-        'nickname': nickname, # 非正規化: ユーザーのニックネームを投稿に含める
-        'comment': comment,
-        'image_path': image_path, # Firebase Storageのパス or URL
-        'shop_name': shop_name,
-        'price': price,
-        'like_count': 0, # 非正規化: いいね数を投稿に含める
-        'created_at': firestore.SERVER_TIMESTAMP
-    })
-
+@metrics.instrument
+def create_post(user_id, nickname, comment, image_path, shop_name, price, image_variants=None, status='ready',
+                image_key=None):
+    """新規投稿を作成し、投稿IDを返します。
+
+    画像をバックグラウンドでアップロードする場合は status='processing' で作成し、
+    終わったら update_post_image() で 'ready' (失敗した場合は 'failed') にします。
+    image_key (画像の内容のハッシュ) を指定すると、投稿の作成と同時に画像の参照カウントを増やします。
+    """
+    post_id = _backend.create_post(user_id, nickname, comment, image_path, shop_name, price,
+                                   image_variants=image_variants, status=status, image_key=image_key)
+    _query_cache.invalidate_tag('posts', 'award', 'search', 'shops', f"user_posts:{user_id}")
+    return post_id
+
+@metrics.instrument
 def get_all_posts():
     """全ての投稿を取得します。"""
-    docs = db.collection('posts').order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-    return [_doc_to_dict(doc) for doc in docs]
+    # リスナーがメモリに保持している投稿はキャッシュより新しいため、キャッシュを通さずに返す
+    posts = _backend.get_live_posts()
+    if posts is not None:
+        return posts
+    return _query_cache.get_or_set(
+        ('all_posts',), _backend.get_all_posts,
+        tags=lambda posts: {'posts'} | _post_tags(posts)
+    )
+
+@metrics.instrument
+def get_posts_page(page_size=20, start_after=None):
+    """投稿を新しい順に1ページ分取得します。
+
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    page = _backend.get_live_posts_page(page_size, start_after=start_after)
+    if page is not None:
+        return page
+    return _query_cache.get_or_set(
+        ('posts_page', page_size, start_after),
+        lambda: _backend.get_posts_page(page_size, start_after=start_after),
+        tags=lambda page: {'posts'} | _post_tags(page[0])
+    )
+
+# --- 検索 ---
+SHOP_SUGGEST_LIMIT = 10 # 店舗名の候補を表示する数
+
+@metrics.instrument
+def search_posts(query, page_size=20, start_after=None, exact_shop=False):
+    """店舗名・コメントに検索語を含む投稿を新しい順に1ページ分取得します。
+
+    検索語の各語 (空白や記号で区切った単位) が、店舗名かコメントに続けて現れる投稿を返します。
+    exact_shop=True の場合は、店舗名が query と(正規化して)一致する投稿だけを返します。
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    if exact_shop:
+        term = search.shop_term(query)
+        terms = [term] if term else []
+        phrases = ()
+    else:
+        terms = search.query_terms(query)
+        phrases = search.query_phrases(query)
+    if not terms:
+        return [], None
+    return _query_cache.get_or_set(
+        ('search', tuple(terms), phrases, page_size, start_after),
+        lambda: _backend.search_posts(terms, page_size, start_after=start_after, phrases=phrases),
+        tags=lambda page: {'search'} | _post_tags(page[0])
+    )
+
+@metrics.instrument
+def suggest_shops(prefix, limit=SHOP_SUGGEST_LIMIT):
+    """店舗名が prefix で始まる店舗を投稿数の多い順に返します。各要素は key, name, post_count を持つ辞書です。"""
+    key = search.shop_key(prefix)
+    if not key:
+        return []
+    return _query_cache.get_or_set(
+        ('shop_suggest', key, limit), lambda: _backend.suggest_shops(key, limit=limit), tags={'shops'}
+    )
+
+# --- 店舗ごとの集計 ---
+SHOP_RANKING_SORTS = ('posts', 'likes', 'cheap', 'expensive')
+
+@metrics.instrument
+def get_shop_ranking(sort='posts', limit=20, min_posts=1):
+    """店舗ごとの集計をランキングの順に返します (投稿は読まず、集計のみを読みます)。
+
+    sort は 'posts' (投稿数の多い順), 'likes' (いいね数の多い順), 'cheap' / 'expensive' (平均価格の安い順 / 高い順) です。
+    投稿数が min_posts 未満の店舗と、平均価格で並べる場合は金額の入力が無い店舗を除きます。
+    各要素は key, name, post_count, like_total, price_count, price_min, price_max, price_avg, last_visited_at を持つ辞書です。
+    """
+    if sort not in SHOP_RANKING_SORTS:
+        raise ValueError(f"Unknown shop ranking sort: {sort}")
+    return _query_cache.get_or_set(
+        ('shop_ranking', sort, limit, min_posts),
+        lambda: _backend.get_shop_ranking(sort, limit=limit, min_posts=min_posts),
+        tags={'shops'}
+    )
 
 # --- Like Functions ---
-@firestore.transactional
-def _update_like_count(transaction, post_ref, increment):
-    """トランザクション内でいいね数をアトミックに更新します。"""
-    snapshot = post_ref.get(transaction=transaction)
-    new_count = snapshot.get('like_count') + increment
-    transaction.update(post_ref, {'like_count': new_count})
-
+@metrics.instrument
 def check_like(user_id, post_id):
     """ユーザーが既に投稿にいいねしているか確認します。"""
-    # ドキュメントIDを複合キーのように扱うことで高速にチェック
-    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
-    return like_ref.get().exists
+    return _backend.check_like(user_id, post_id)
+
+@metrics.instrument
+def get_liked_post_ids(user_id, post_ids):
+    """指定した投稿のうち、ユーザーがいいね済みの投稿IDの集合を返します。"""
+    return _backend.get_liked_post_ids(user_id, post_ids)
 
+@metrics.instrument
 def add_like(user_id, post_id):
     """投稿にいいねを追加し、投稿のいいね数をインクリメントします。"""
-    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
-    # 既にいいね済みかチェック
-    if like_ref.get().exists:
-        return
-
-    like_ref.set({
-        'user_id': user_id,
-        'post_id': post_id,
-        'created_at': firestore.SERVER_TIMESTAMP
-    })
-    
-    # 投稿のlike_countをインクリメント
-    post_ref = db.collection('posts').document(post_id)
-    transaction = db.transaction()
-    _update_like_count(transaction, post_ref, 1)
+    added = _backend.add_like(user_id, post_id)
+    if added:
+        _query_cache.invalidate_tag(f"post:{post_id}", 'award', 'shops')
+    return added
 
+@metrics.instrument
 def remove_like(user_id, post_id):
     """投稿のいいねを解除し、投稿のいいね数をデクリメントします。"""
-    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
-    # いいねが存在するかチェック
-    if not like_ref.get().exists:
-        return
-        
-    like_ref.delete()
-    
-    # 投稿のlike_countをデクリメント
-    post_ref = db.collection('posts').document(post_id)
-    transaction = db.transaction()
-    _update_like_count(transaction, post_ref, -1)
-
+    removed = _backend.remove_like(user_id, post_id)
+    if removed:
+        _query_cache.invalidate_tag(f"post:{post_id}", 'award', 'shops')
+    return removed
 
 # --- Award Function ---
+@metrics.instrument
+def get_leaderboard(date_str=None, limit=LEADERBOARD_SIZE):
+    """指定日(省略時は今日)のいいねランキングを取得します。"""
+    date_str = date_str or jst_date_str()
+    # 日付をキーに含めることで、日付が変わると自動的に別エントリになる
+    entries = _query_cache.get_or_set(
+        ('leaderboard', date_str), lambda: _backend.get_leaderboard(date_str),
+        tags=lambda posts: {'award'} | _post_tags(posts)
+    )
+    return entries[:limit]
+
+@metrics.instrument
+def get_period_leaderboard(days=7, limit=3, end_date=None):
+    """直近 days 日間(週間・月間など)のいいねランキングを取得します。"""
+    return _backend.get_period_leaderboard(days=days, limit=limit, end_date=end_date)
+
+@metrics.instrument
 def get_lunch_award():
     """今日の投稿でいいね数が最も多い投稿を取得します。"""
-    jst = pytz.timezone('Asia/Tokyo')
-    today = datetime.datetime.now(jst).date()
-    start_of_day = jst.localize(datetime.datetime.combine(today, datetime.time.min))
-    end_of_day = jst.localize(datetime.datetime.combine(today, datetime.time.max))
-
-    query = db.collection('posts') \
-        .where('created_at', '>=', start_of_day) \
-        .where('created_at', '<=', end_of_day) \
-        .order_by('like_count', direction=firestore.Query.DESCENDING) \
-        .limit(1)
-        
-    docs = query.stream()
-    award_post_doc = next(docs, None)
-    return _doc_to_dict(award_post_doc)
+    leaderboard = get_leaderboard(limit=1)
+    return leaderboard[0] if leaderboard else None
 
 # --- Admin Dashboard Functions ---
+@metrics.instrument
 def get_dashboard_stats():
-    """ダッシュボード用の統計情報を取得します。"""
-    # .count()はFirestoreの比較的新しい機能で、ドキュメント全体を読み込むより効率的
-    # ただし無料枠の読み取り回数にはカウントされる
-    stats = {}
-    stats['user_count'] = db.collection('users').count().get()[0][0].value
-    stats['post_count'] = db.collection('posts').count().get()[0][0].value
-    stats['like_count'] = db.collection('likes').count().get()[0][0].value
-    
-    # 時系列データは全件取得してPython側で処理する
-    all_posts = get_all_posts()
-    post_timeline = {}
-    for post in all_posts:
-        if 'created_at' in post and isinstance(post['created_at'], datetime.datetime):
-            date_str = post['created_at'].strftime('%Y-%m-%d')
-            post_timeline[date_str] = post_timeline.get(date_str, 0) + 1
-    
-    # list of [date, count]
-    post_timeline_list = sorted(post_timeline.items())
-
-    # 人気投稿ランキング
-    popular_posts_docs = db.collection('posts').order_by('like_count', direction=firestore.Query.DESCENDING).limit(10).stream()
-    popular_posts = [
-        (p.get('comment'), p.get('nickname'), p.get('like_count')) 
-        for p in popular_posts_docs
-    ]
-    
-    return stats, post_timeline_list, popular_posts
-
-
-def get_all_users():
-    """管理者以外の全ユーザーを取得します。"""
-    docs = db.collection('users').where('nickname', '!=', 'admin').order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-    return [_doc_to_dict(doc) for doc in docs]
+    """ダッシュボード用の統計情報を取得します。
 
-# --- 自分の投稿履歴 & 編集・削除 ---
+    戻り値は (件数の辞書, 日別の (日付, 投稿数, いいね数, 新規ユーザー数, 投稿者数) のリスト,
+    人気投稿の (コメント, 投稿者, いいね数) のリスト) です。
+    """
+    return _backend.get_dashboard_stats()
 
+# --- 自分の投稿履歴 & 編集・削除 ---
+@metrics.instrument
 def get_posts_by_user(user_id):
     """特定のユーザーの投稿をすべて取得します。"""
-    docs = db.collection('posts').where('user_id', '==', user_id).order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-    return [_doc_to_dict(doc) for doc in docs]
+    return _query_cache.get_or_set(
+        ('user_posts', user_id), lambda: _backend.get_posts_by_user(user_id),
+        tags=lambda posts: {f"user_posts:{user_id}"} | _post_tags(posts)
+    )
 
+@metrics.instrument
 def update_post(post_id, comment, shop_name, price):
     """投稿の内容を更新します。"""
-    db.collection('posts').document(post_id).update({
-        'comment': comment,
-        'shop_name': shop_name,
-        'price': price
-    })
+    _backend.update_post(post_id, comment, shop_name, price)
+    _query_cache.invalidate_tag(f"post:{post_id}", 'search', 'shops')
+
+@metrics.instrument
+def update_post_image(post_id, status, image_variants=None):
+    """投稿の画像の状態(とリサイズ済み画像のパス)を更新します。投稿が削除済みの場合は False を返します。"""
+    updated = _backend.update_post_image(post_id, status, image_variants=image_variants)
+    _query_cache.invalidate_tag(f"post:{post_id}", 'award')
+    return updated
 
+@metrics.instrument
 def delete_post(post_id):
-    """投稿と関連データを削除します。"""
-    post_ref = db.collection('posts').document(post_id)
-    post_doc = post_ref.get()
-    if not post_doc.exists:
+    """投稿と関連データ(いいね・画像)を削除します。"""
+    post = _backend.delete_post(post_id)
+    if post is None:
         return False
-
-    # 1. 画像ファイルをCloud Storageから削除
-    image_path = post_doc.get('image_path')
-    if image_path:
-        blob = bucket.blob(image_path)
-        if blob.exists():
-            blob.delete()
-
-    # 2. 投稿に紐づく「いいね」を削除
-    likes_query = db.collection('likes').where('post_id', '==', post_id).stream()
-    batch = db.batch()
-    for like in likes_query:
-        batch.delete(like.reference)
-    batch.commit()
-
-    # 3. 投稿本体を削除
-    post_ref.delete()
+    _delete_images(post)
+    _query_cache.invalidate_tag('posts', 'award', 'search', 'shops', f"post:{post_id}")
     return True
 
 # --- ユーザー削除 ---
+@metrics.instrument
 def delete_user(user_id):
     """ユーザーアカウントと関連データをすべて削除します。"""
     try:
-        # 1. ユーザーの投稿を取得
-        user_posts = get_posts_by_user(user_id)
-        post_ids = [post['id'] for post in user_posts]
-
-        # 2. ユーザーの投稿と、それに付随するいいね、画像を削除
-        for post in user_posts:
-            delete_post(post['id']) # 既存の関数を再利用
-
-        # 3. ユーザー自身が付けた「いいね」を削除 & 関連投稿のいいね数も減らす
-        likes_by_user_query = db.collection('likes').where('user_id', '==', user_id).stream()
-        batch = db.batch()
-        for like in likes_by_user_query:
-            # いいねを削除
-            batch.delete(like.reference)
-            # 関連投稿のいいね数をデクリメント
-            post_id = like.get('post_id')
-            if post_id:
-                 post_ref = db.collection('posts').document(post_id)
-                 # トランザクションはバッチと併用できないため、直接更新
-                 # ここは厳密にはアトミックではないが、削除処理なので許容する
-                 batch.update(post_ref, {'like_count': firestore.Increment(-1)})
-        batch.commit()
-
-        # 4. ユーザー自身を削除
-        db.collection('users').document(user_id).delete()
-        
+        # 1. ユーザー・投稿・いいねを一括で削除し、いいねしていた投稿のいいね数を減らす
+        posts, liked_post_ids = _backend.delete_user_cascade(user_id)
+        post_ids = [post['id'] for post in posts] + liked_post_ids
+        _query_cache.invalidate_tag('posts', 'award', 'search', 'shops', f"user_posts:{user_id}",
+                                    *[f"post:{pid}" for pid in post_ids])
+        # 削除済みとしてキャッシュし、このプロセスでは発行済みのセッショントークンを直ちに無効にする
+        _user_cache.set(user_id, None)
+
+        # 2. 投稿の画像を並行して削除
+        _delete_images(*posts)
+
         return True
     except Exception as e:
         print(f"An error occurred during user deletion: {e}")
         return False
 
+@metrics.instrument
+def delete_users(job, user_ids):
+    """複数のユーザーを順に削除します。utils.jobs のジョブとして実行し、進捗を job に記録します。"""
+    for user_id in user_ids:
+        deleted = delete_user(user_id)
+        job.advance(error=None if deleted else f"ユーザー {user_id} の削除に失敗しました")
+
 # --- Admin User初期化 ---
+@metrics.instrument
+def initialize_storage():
+    """ストレージエンジンを初期化します (管理用のスクリプトから使う)。"""
+    _backend.initialize()
+
+_admin_nickname = None # init_db() で設定した管理者のニックネーム (ユーザー管理画面の一覧から除く)
+
+@metrics.instrument
 def init_db(admin_nickname, admin_password_hash):
-    """Firestoreの初期化と管理者ユーザーの存在確認・作成"""
-    initialize_firestore()
+    """ストレージエンジンの初期化と管理者ユーザーの存在確認・作成"""
+    global _admin_nickname
+    _admin_nickname = admin_nickname
+    initialize_storage()
     # 管理者ユーザーが存在するかチェック
     user = get_user(admin_nickname)
     if not user:
         print("Creating admin user...")
-        create_user(admin_nickname, admin_password_hash)
\ No newline at end of file
+        create_user(admin_nickname, admin_password_hash)
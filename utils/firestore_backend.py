@@ -0,0 +1,1440 @@
+# utils/firestore_backend.py
+# Firestore + Cloud Storage を使うストレージエンジン。
+# アプリからは utils/db.py 経由で使う (キャッシュや無効化は db.py 側で行う)。
+
+import firebase_admin
+from firebase_admin import credentials, firestore, storage
+from google.api_core import exceptions as gcp_exceptions
+from google.cloud.storage import retry as storage_retry
+import atexit
+import datetime
+import math
+import random
+import threading
+import time
+from collections import Counter
+import os
+import json
+from urllib.parse import quote
+from utils import metrics, search
+from utils.records import POST_LIST_FIELDS, post_record
+from utils.dates import jst_date_str, jst_day_range, recent_date_strs
+from utils.firestore_timeline import MaterializedTimeline
+
+# --- Firestore 初期化 ---
+# この関数は app.py から一度だけ呼び出される
+_db_initialized = False
+db = None
+bucket = None
+
+def initialize_firestore():
+    """Firestoreデータベースを初期化します。"""
+    global _db_initialized, db, bucket
+    if _db_initialized:
+        return
+
+    import base64 # base64をインポート
+
+    try:
+        # Streamlit CloudのSecretsを使用する場合
+        if 'FIREBASE_CREDENTIALS' in os.environ:
+            # creds_json = json.loads(os.environ['FIREBASE_CREDENTIALS'])
+            # cred = credentials.Certificate(creds_json)
+            b64_creds = os.environ['FIREBASE_CREDENTIALS']
+            decoded_creds = base64.b64decode(b64_creds)
+            creds_json = json.loads(decoded_creds)
+            cred = credentials.Certificate(creds_json)
+        # ローカルのJSONファイルを使用する場合
+        else:
+            cred = credentials.Certificate("firebase-credentials.json")
+
+        # ▼▼▼▼▼ ここから修正 ▼▼▼▼▼
+        # プロジェクトIDを取得
+        project_id = cred.project_id
+
+        # !!!! 実際のバケット名に合わせてドメインを修正 !!!!
+        # ".appspot.com" ではなく、コンソールで確認した ".firebasestorage.app" を使用
+        bucket_name = f'{project_id}.firebasestorage.app'
+
+        # アプリの初期化
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': bucket_name
+        })
+
+        db = firestore.client()
+        # バケット名を明示的に指定して取得する
+        bucket = storage.bucket(name=bucket_name)
+        _db_initialized = True
+        print(f"Firebase initialized. Using bucket: {bucket_name}") # 確認用のログを更新
+        if TIMELINE_LISTENER == "True":
+            _start_timeline_listener()
+        # ▲▲▲▲▲ ここまで修正 ▲▲▲▲▲
+
+    except Exception as e:
+        print(f"!!!!!!!!!! FIREBASE INITIALIZATION FAILED !!!!!!!!!!")
+        print(f"Error: {e}")
+        # エラー時にもアプリが停止しないように、ダミーの値を設定するなどしても良いが、
+        # ここではエラーを明確にするためにraiseする
+        raise e
+
+initialize = initialize_firestore
+
+# --- タイムラインのスナップショットリスナー ---
+# 最新 TIMELINE_WINDOW 件の投稿をリスナーでメモリに保持し、get_all_posts / get_posts_page を
+# そこから返す。リスナーが不調な間やウィンドウ外のページは通常のクエリで取得する。
+# (リスナーのクエリはフィールドを絞れないため、受け取った投稿を一覧用のレコードに変換して保持する)
+# メモリ上の投稿は db.py のクエリキャッシュより新しいため、db.py は get_live_posts / get_live_posts_page を
+# キャッシュより先に読む。書き込んだ処理は TIMELINE_WRITE_WAIT 秒までその書き込みがリスナーに届くのを待つ。
+TIMELINE_LISTENER = os.environ.get('LUNCH_SNS_TIMELINE_LISTENER', "True")
+TIMELINE_WINDOW = 500
+TIMELINE_WRITE_WAIT = 0.3 # 秒 (届かない場合は次のスナップショットまで通常のクエリで読む)
+_timeline = None
+
+def _start_timeline_listener():
+    global _timeline
+    _timeline = MaterializedTimeline(
+        lambda: db.collection('posts').order_by('created_at', direction=firestore.Query.DESCENDING).limit(TIMELINE_WINDOW),
+        _doc_to_record,
+        TIMELINE_WINDOW,
+        wait_timeout=TIMELINE_WRITE_WAIT
+    )
+    try:
+        _timeline.start()
+    except Exception as e:
+        # リスナーが使えなくても通常のクエリで動作する
+        print(f"Error starting timeline listener: {e}")
+        _timeline = None
+
+def _notify_timeline(write_results=None, post_ids=(), created=False):
+    """書き込んだ処理から呼び、その書き込みがリスナーに届くまで待ちます。
+
+    write_results はコミットの結果、post_ids は変更した投稿のIDで、created は新しい投稿を作成した場合に True にします。
+    ウィンドウ外の投稿の変更はスナップショットに現れないため待ちません。
+    他のセッションの書き込みではフォールバックしないため、いいねが続いてもリスナーから返し続けられます。
+    """
+    if _timeline is None:
+        return
+    if not created and not any(_timeline.contains(post_id) for post_id in post_ids):
+        return
+    write_times = [result.update_time for result in write_results or () if getattr(result, 'update_time', None)]
+    _timeline.wait_for(max(write_times) if write_times else None)
+
+# --- Blob Storage ---
+UPLOAD_CHUNK_SIZE = 1024 * 1024 # 再開可能アップロードの1回の送信量 (256KBの倍数)
+
+def upload_blob(path, data, content_type, cache_control=None):
+    """バイト列をCloud Storageにアップロードします。
+
+    チャンク単位の再開可能アップロードを使い、通信エラーの場合は送信済みのチャンクの続きから再試行します。
+    cache_control を指定すると、配信時の Cache-Control ヘッダーとして保存します。
+    """
+    blob = bucket.blob(path, chunk_size=UPLOAD_CHUNK_SIZE)
+    if cache_control:
+        blob.cache_control = cache_control
+    blob.upload_from_string(data, content_type=content_type, retry=storage_retry.DEFAULT_RETRY)
+
+def delete_blob(path):
+    """Cloud Storageのファイルを削除します。存在しない場合は何もしません。"""
+    # 存在確認をせずに削除し、往復を1回で済ませる
+    try:
+        bucket.blob(path).delete()
+    except gcp_exceptions.NotFound:
+        pass
+
+def download_blob(path):
+    """Cloud Storageのファイルをバイト列で取得します。"""
+    return bucket.blob(path).download_as_bytes()
+
+def get_blob_url(path, expiration):
+    """ファイルの署名付きURLを生成します。"""
+    return bucket.blob(path).generate_signed_url(expiration)
+
+# --- 画像の参照カウント (image_refs) ---
+# 画像は内容のハッシュをキーにして保存し、同じ画像を使う投稿が何件あるかを image_refs/{キー} で数える。
+# 参照は投稿の作成と同じバッチで増やし、投稿の削除後に release_image_refs() で減らす。
+# フィールド: count (参照している投稿数), image_path, image_variants (アップロードが終わるまで無い)
+def _image_ref(image_key):
+    return db.collection('image_refs').document(image_key)
+
+def get_image_ref(image_key):
+    """画像の参照カウントを取得します。無い場合は None です。"""
+    return _doc_to_dict(_image_ref(image_key).get())
+
+def complete_image_ref(image_key, image_variants):
+    """画像のアップロードが終わったことを記録します。参照が無くなっていた場合は False を返します。"""
+    try:
+        _image_ref(image_key).update({'image_variants': image_variants})
+    except gcp_exceptions.NotFound:
+        return False
+    metrics.add_writes()
+    return True
+
+@firestore.transactional
+def _release_image_ref_in_transaction(transaction, ref, count):
+    """参照カウントを減らし、参照が無くなった場合は削除すべき画像のパスを返します。"""
+    snapshot = ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return []
+    metrics.add_reads()
+    data = snapshot.to_dict()
+    metrics.add_writes()
+    if data.get('count', 0) > count:
+        transaction.update(ref, {'count': data['count'] - count})
+        return []
+    transaction.delete(ref)
+    return [data.get('image_path')] + list((data.get('image_variants') or {}).values())
+
+def release_image_refs(counts):
+    """画像の参照カウントを減らします。
+
+    counts は {画像キー: 減らす数} です。参照する投稿が無くなった画像を {画像キー: パスのリスト} で返します
+    (削除は呼び出し側で行う)。
+    """
+    released = {}
+    for image_key, count in counts.items():
+        image_paths = _release_image_ref_in_transaction(db.transaction(), _image_ref(image_key), count)
+        if image_paths:
+            released[image_key] = [path for path in image_paths if path]
+    return released
+
+# --- ユーザーごとの集計 ---
+# ユーザー管理画面の投稿数・いいね数は users/{id} の post_count (投稿数) と like_count (付けたいいね数) から読む。
+# 投稿の書き込み関数が同じバッチで増減させる (いいねの増減はまとめて書き込む。flush_like_counters() を参照)。
+# 導入前のデータは backfill_stats.py で作り直す。
+def _user_counters(**increments):
+    return {field: firestore.Increment(value) for field, value in increments.items()}
+
+# --- 日次集計 (stats_daily) ---
+# ダッシュボードの時系列は stats_daily/{YYYY-MM-DD} (日本時間の日付) から読む。
+# 各書き込み関数が同じバッチ内でカウンタを増減させることで、全投稿を走査せずに済む (いいねはまとめて書き込む)。
+# フィールド: posts, likes, new_users, active_poster_ids (その日に投稿したユーザーID)
+# 件数は、いいね・投稿・ユーザーが作成された日の集計に数える (削除したときもその日の集計から減らす)。
+# 投稿の削除でユーザーのその日の投稿が無くなった場合は、その日の active_poster_ids からユーザーを除く。
+#
+# 今日の集計には全てのいいね・投稿・登録が書き込むため、1つのドキュメントに書き込みが集中しないよう
+# stats_daily_shards/{YYYY-MM-DD}_{0..STATS_SHARDS-1} に分散して書き込み、読むときに合計する。
+# 過去の日への書き込み (削除による減算) は少ないため stats_daily/{YYYY-MM-DD} に直接書き込む。
+# 2日以上前の分散したドキュメントは rollup_daily_stats() (rollup_stats.py から定期実行) で日ごとのドキュメントにまとめる。
+STATS_SHARDS = 10
+
+def _stats_daily_ref(date_str=None):
+    return db.collection('stats_daily').document(date_str or jst_date_str())
+
+def _add_daily_stats(batch, date_str=None, poster_id=None, **increments):
+    """バッチ (または BulkWriter) に日次集計の更新を追加します。
+
+    date_str を省略した場合は今日の集計です。poster_id を指定するとその日に投稿したユーザーに加えます。
+    """
+    data = {field: firestore.Increment(value) for field, value in increments.items() if value}
+    if poster_id:
+        data['active_poster_ids'] = firestore.ArrayUnion([poster_id])
+    if not data:
+        return
+    today = jst_date_str()
+    date_str = date_str or today
+    if date_str == today:
+        data['date'] = date_str
+        ref = db.collection('stats_daily_shards').document(f"{date_str}_{random.randrange(STATS_SHARDS)}")
+    else:
+        ref = _stats_daily_ref(date_str)
+    batch.set(ref, data, merge=True)
+
+def _add_daily_counts(batch, field, counts):
+    """日付ごとの件数 (Counter) を日次集計から減らします。書き込んだドキュメント数を返します。"""
+    for date_str, count in counts.items():
+        _add_daily_stats(batch, date_str, **{field: -count})
+    return len(counts)
+
+def _remove_daily_poster(batch, date_str, poster_id):
+    """バッチ (または BulkWriter) に、その日に投稿したユーザーから poster_id を除く更新を追加します。
+
+    まだ日ごとのドキュメントにまとめていない分散したドキュメントにも含まれるため、その日の分散したドキュメントからも除きます。
+    書き込むドキュメント数を返します。
+    """
+    remove = firestore.ArrayRemove([poster_id])
+    batch.set(_stats_daily_ref(date_str), {'active_poster_ids': remove}, merge=True)
+    shards = list(db.collection('stats_daily_shards').where('date', '==', date_str).select([]).stream())
+    metrics.add_reads(max(len(shards), 1))
+    for shard in shards:
+        # まとめる処理で同時に削除されてもバッチが失敗しないよう、update ではなく set(merge=True) で書き込む
+        batch.set(shard.reference, {'date': date_str, 'active_poster_ids': remove}, merge=True)
+    return 1 + len(shards)
+
+def _has_other_post_on(user_id, date_str, post_id):
+    """ユーザーが date_str の日に post_id 以外の投稿をしているかを返します。"""
+    start_of_day, end_of_day = jst_day_range(date_str)
+    docs = db.collection('posts').where('user_id', '==', user_id) \
+        .where('created_at', '>=', start_of_day).where('created_at', '<=', end_of_day) \
+        .order_by('created_at', direction=firestore.Query.DESCENDING).select([]).limit(2).stream()
+    doc_ids = [doc.id for doc in docs]
+    metrics.add_reads(max(len(doc_ids), 1))
+    return any(doc_id != post_id for doc_id in doc_ids)
+
+def _read_daily_stats():
+    """日ごとの集計を、分散したドキュメントと合計して {日付: 集計} で返します。"""
+    daily = {}
+    def merge(date_str, data):
+        day = daily.setdefault(date_str, {'posts': 0, 'likes': 0, 'new_users': 0, 'active_poster_ids': set()})
+        for field in ('posts', 'likes', 'new_users'):
+            day[field] += data.get(field, 0)
+        day['active_poster_ids'].update(data.get('active_poster_ids', []))
+    reads = 0
+    for doc in db.collection('stats_daily').stream():
+        merge(doc.id, doc.to_dict())
+        reads += 1
+    for doc in db.collection('stats_daily_shards').stream():
+        data = doc.to_dict()
+        merge(data.get('date') or doc.id.rsplit('_', 1)[0], data)
+        reads += 1
+    metrics.add_reads(reads)
+    return daily
+
+def rollup_daily_stats():
+    """2日以上前の分散したドキュメントを日ごとのドキュメントにまとめます。まとめた日数を返します。
+
+    まとめる日にはもう書き込まれない (今日の集計だけが分散して書き込まれる) ため、トランザクションは使いません。
+    """
+    yesterday = recent_date_strs(2)[-1]
+    shards = {}
+    for doc in db.collection('stats_daily_shards').where('date', '<', yesterday).stream():
+        shards.setdefault(doc.get('date'), []).append(doc)
+    for date_str, docs in shards.items():
+        # 日ごとのドキュメントへの加算と分散したドキュメントの削除を同じバッチで行う
+        batch = db.batch()
+        data = {'posts': 0, 'likes': 0, 'new_users': 0}
+        poster_ids = set()
+        for doc in docs:
+            for field in data:
+                data[field] += doc.get(field) or 0
+            poster_ids.update(doc.get('active_poster_ids') or [])
+            batch.delete(doc.reference)
+        update = {field: firestore.Increment(value) for field, value in data.items()}
+        if poster_ids:
+            update['active_poster_ids'] = firestore.ArrayUnion(sorted(poster_ids))
+        batch.set(_stats_daily_ref(date_str), update, merge=True)
+        batch.commit()
+    return len(shards)
+
+def backfill_daily_stats():
+    """既存の users / posts / likes から stats_daily を作り直します。
+
+    日次集計を導入する前のデータを取り込むための一度きりの処理です (backfill_stats.py から実行)。
+    """
+    daily = {}
+    def bucket_for(dt):
+        date_str = jst_date_str(dt)
+        return daily.setdefault(date_str, {'posts': 0, 'likes': 0, 'new_users': 0, 'active_poster_ids': set()})
+
+    for doc in db.collection('users').select(['created_at']).stream():
+        created_at = doc.get('created_at')
+        if isinstance(created_at, datetime.datetime):
+            bucket_for(created_at)['new_users'] += 1
+    for doc in db.collection('posts').select(['created_at', 'user_id']).stream():
+        created_at = doc.get('created_at')
+        if isinstance(created_at, datetime.datetime):
+            day = bucket_for(created_at)
+            day['posts'] += 1
+            day['active_poster_ids'].add(doc.get('user_id'))
+    for doc in db.collection('likes').select(['created_at']).stream():
+        created_at = doc.get('created_at')
+        if isinstance(created_at, datetime.datetime):
+            bucket_for(created_at)['likes'] += 1
+
+    # 分散したドキュメントの内容も作り直す集計に含まれるため削除する
+    bulk = _bulk_writer()
+    for doc in db.collection('stats_daily_shards').select([]).stream():
+        bulk.delete(doc.reference)
+    bulk.close()
+
+    # バッチは最大500件までなので分割して書き込む
+    items = sorted(daily.items())
+    for i in range(0, len(items), 500):
+        batch = db.batch()
+        for date_str, day in items[i:i + 500]:
+            day['active_poster_ids'] = sorted(day['active_poster_ids'])
+            batch.set(_stats_daily_ref(date_str), day)
+        batch.commit()
+    return len(items)
+
+# --- Helper Functions ---
+# 読み書きしたドキュメント数は utils.metrics に報告し、管理者ダッシュボードで確認できるようにする
+def _commit(batch):
+    """バッチを書き込み、書き込んだドキュメント数を計測に加えます。"""
+    writes = len(batch)
+    results = batch.commit()
+    metrics.add_writes(writes)
+    return results
+
+def _count(query):
+    """count() 集計を実行します。読み取りは1000件ごとに1回として計測に加えます。"""
+    value = query.count().get()[0][0].value
+    metrics.add_reads(max(1, math.ceil(value / 1000)))
+    return value
+
+# 削除の連鎖のように、アトミックである必要のない大量の書き込みは BulkWriter で行う。
+# BulkWriter は書き込みを自動で分割して並行して送信するため、バッチの500件の上限に縛られない。
+_BULK_RETRY_CODES = {4, 8, 10, 14} # DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, ABORTED, UNAVAILABLE
+_BULK_MAX_ATTEMPTS = 5
+
+def _bulk_writer():
+    """一時的なエラーのみ再試行する BulkWriter を返します。"""
+    bulk = db.bulk_writer()
+    def on_write_error(failure, _):
+        if failure.code in _BULK_RETRY_CODES and failure.attempts < _BULK_MAX_ATTEMPTS:
+            return True
+        # 削除済みの投稿への update など、再試行しても成功しない書き込みは諦める
+        print(f"Bulk write failed: {failure.operation.reference.path}: {failure.message}")
+        return False
+    bulk.on_write_error(on_write_error)
+    return bulk
+
+def _doc_to_dict(doc):
+    """Firestoreのドキュメントを辞書に変換し、IDを追加します。"""
+    # docがNoneの場合、またはドキュメントが存在しない場合に対応
+    if not doc or not doc.exists:
+        return None
+    metrics.add_reads()
+    data = doc.to_dict()
+    data['id'] = doc.id
+    return data
+
+def _doc_to_record(doc):
+    """投稿のドキュメントを、一覧用の共有レコード (utils.records.PostRecord) に変換します。"""
+    if not doc or not doc.exists:
+        return None
+    metrics.add_reads()
+    return post_record(doc.id, doc.to_dict())
+
+# --- User Functions ---
+# ニックネームの索引 nicknames/{ニックネーム} -> {'user_id': ...} をユーザーと同じバッチで create() する。
+# 同じニックネームの登録が同時に行われても create() の前提条件で片方だけが成功し、
+# ログインはクエリを使わず索引とユーザーのドキュメントを直接読むだけで済む。
+# 索引の導入前に作られたユーザーは migrate_nicknames.py で索引を作成する。
+def _nickname_ref(nickname):
+    # ドキュメントIDに使えない '/' や '.'、'__...__' の形にならないようエスケープする
+    doc_id = quote(nickname, safe='').replace('.', '%2E')
+    if doc_id.startswith('__') and doc_id.endswith('__'):
+        doc_id = '%5F' + doc_id[1:]
+    return db.collection('nicknames').document(doc_id)
+
+def create_user(nickname, password_hash):
+    """新規ユーザーを作成します。"""
+    user_ref = db.collection('users').document()
+    batch = db.batch()
+    # ニックネームが既に使われている場合は create() が失敗し、バッチ全体が適用されない
+    batch.create(_nickname_ref(nickname), {'user_id': user_ref.id})
+    batch.set(user_ref, {
+        'nickname': nickname,
+        'password_hash': password_hash,
+        'post_count': 0, # 非正規化: ユーザーの投稿数
+        'like_count': 0, # 非正規化: ユーザーが付けたいいね数
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    _add_daily_stats(batch, new_users=1)
+    try:
+        _commit(batch)
+    except gcp_exceptions.AlreadyExists:
+        return False # ニックネームが既に存在
+    return True
+
+def get_user(nickname):
+    """ニックネームでユーザーを取得します。"""
+    index_doc = _nickname_ref(nickname).get()
+    metrics.add_reads()
+    if not index_doc.exists:
+        return None
+    return get_user_by_id(index_doc.get('user_id'))
+
+def get_user_by_id(user_id):
+    """IDでユーザーを取得します。"""
+    doc_ref = db.collection('users').document(user_id)
+    return _doc_to_dict(doc_ref.get())
+
+# --- Post Functions ---
+def create_post(user_id, nickname, comment, image_path, shop_name, price, image_variants=None, status='ready',
+                image_key=None):
+    """新規投稿を作成し、投稿IDを返します。
+
+    image_key (画像の内容のハッシュ) を指定すると、同じバッチで画像の参照カウントを増やします。
+    """
+    post_ref = db.collection('posts').document()
+    batch = db.batch()
+    batch.set(post_ref, {
+        'user_id': user_id,
+        'nickname': nickname, # 非正規化: ユーザーのニックネームを投稿に含める
+        'comment': comment,
+        'image_path': image_path, # Firebase Storageのパス or URL
+        'image_variants': image_variants or {}, # リサイズ済み画像のパス {'thumb': ..., 'display': ...}
+        'shop_name': shop_name,
+        'shop_key': search.shop_key(shop_name) or None, # 店舗ごとの集計のキー
+        'price': price,
+        'like_count': 0, # 非正規化: いいね数を投稿に含める
+        'status': status, # 画像の状態 ('processing': アップロード中, 'ready', 'failed')
+        'image_key': image_key, # 画像の参照カウントのキー (内容のハッシュで保存する前の投稿は None)
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'updated_at': firestore.SERVER_TIMESTAMP # 差分エクスポート用の最終更新日時 (投稿を書き換えるたびに更新する)
+    })
+    if image_key:
+        batch.set(_image_ref(image_key), {'count': firestore.Increment(1), 'image_path': image_path}, merge=True)
+    # 同じコミットのサーバー時刻は投稿の created_at と一致する
+    batch.set(_search_index_ref(post_ref.id), {
+        'terms': search.index_terms(comment, shop_name), 'created_at': firestore.SERVER_TIMESTAMP
+    })
+    shop_key = search.shop_key(shop_name)
+    _add_shop_posts(batch, shop_key, added=[{'price': price}], name=shop_name, visited=True)
+    batch.update(db.collection('users').document(user_id), _user_counters(post_count=1))
+    _add_daily_stats(batch, posts=1, poster_id=user_id)
+    _notify_timeline(_commit(batch), created=True)
+    if price:
+        _refresh_shop(shop_key)
+    return post_ref.id
+
+# 投稿の一覧は表示するフィールド (POST_LIST_FIELDS) だけを読み込み、一覧用のレコードで返す
+def get_live_posts():
+    """全ての投稿がリスナーのメモリ上にある場合はそれを返します。無い場合は None です。"""
+    if _timeline is not None and _timeline.is_complete():
+        return _timeline.posts()
+    return None
+
+def get_live_posts_page(page_size=20, start_after=None):
+    """get_posts_page と同じ形式の1ページ分を、リスナーのメモリ上から返します。メモリ上で返せない場合は None です。"""
+    if _timeline is None:
+        return None
+    return _timeline.page(page_size, start_after=start_after)
+
+def get_all_posts():
+    """全ての投稿を取得します。"""
+    posts = get_live_posts()
+    if posts is not None:
+        return posts
+    docs = db.collection('posts').order_by('created_at', direction=firestore.Query.DESCENDING) \
+        .select(POST_LIST_FIELDS).stream()
+    return [_doc_to_record(doc) for doc in docs]
+
+def get_posts_page(page_size=20, start_after=None):
+    """投稿を新しい順に1ページ分取得します。
+
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    page = get_live_posts_page(page_size, start_after=start_after)
+    if page is not None:
+        return page
+
+    query = db.collection('posts') \
+        .order_by('created_at', direction=firestore.Query.DESCENDING) \
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    if start_after:
+        created_at, post_id = start_after
+        query = query.start_after({'created_at': created_at, '__name__': post_id})
+
+    # 1件多く取得して次ページの有無を判定する
+    docs = list(query.select(POST_LIST_FIELDS).limit(page_size + 1).stream())
+    posts = [_doc_to_record(doc) for doc in docs[:page_size]]
+    next_cursor = None
+    if len(docs) > page_size and posts:
+        last = posts[-1]
+        next_cursor = (last['created_at'], last['id'])
+    return posts, next_cursor
+
+# --- 検索 ---
+# search_index/{投稿ID} -> {'terms': [...], 'created_at': 投稿日時} を、投稿の作成・更新・削除と同じバッチで書き込む。
+# terms は utils.search の語 (店舗名・コメントの n-gram と店舗キー)。検索は array_contains で1つの語を含む
+# 索引ドキュメントを新しい順に読み、残りの語は読み込んだ terms で確認する (読み取り件数はヒット数に比例する)。
+# 語の集合が一致した候補は投稿を読み、検索語が店舗名かコメントに続けて現れるかを確かめる。
+# 必要な複合インデックス: search_index (terms array-contains, created_at desc, __name__ desc)
+# 索引の導入前の投稿は migrate_search_index.py で索引を作成する。
+SEARCH_SCAN_SIZE = 200 # 索引ドキュメントを1回に読む件数の上限
+SEARCH_COUNTED_TERMS = 3 # 件数を数えて最も少ない語を選ぶ、検索語の数の上限 (1ページごとに count() を実行する)
+
+def _search_index_ref(post_id):
+    return db.collection('search_index').document(post_id)
+
+def search_posts(terms, page_size=20, start_after=None, phrases=()):
+    """terms の語をすべて含み、phrases の語がそれぞれ店舗名かコメントに続けて現れる投稿を新しい順に1ページ分取得します。
+
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    index = db.collection('search_index')
+    # 含む投稿の最も少ない語で索引を引く (count() の読み取りは1000件ごとに1回)。
+    # 数える語は、1文字の語より絞り込める2文字の語を優先する
+    counted = sorted(terms, key=len, reverse=True)[:SEARCH_COUNTED_TERMS]
+    counts = {term: _count(index.where('terms', 'array_contains', term)) for term in counted}
+    driver = min(counts, key=counts.get)
+    if counts[driver] == 0:
+        return [], None
+    others = set(terms) - {driver}
+
+    query = index.where('terms', 'array_contains', driver) \
+        .order_by('created_at', direction=firestore.Query.DESCENDING) \
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    if not others:
+        query = query.select(['created_at'])
+    # 1件多く見つかるまで読み進めて次ページの有無を判定する。
+    # 残りの語を含まない索引ドキュメントが多い場合に備え、1回に読む件数を倍々に増やす。
+    # 語の集合が一致した候補は、必要な件数ずつ投稿を読んで検索語が続けて現れるかを確かめる
+    posts = []
+    candidates = [] # 残りの語を確認済みで、投稿をまだ読んでいない (created_at, 投稿ID)
+    cursor = start_after
+    scan_size = page_size + 1
+    exhausted = False
+    while len(posts) <= page_size:
+        if candidates:
+            wanted = page_size + 1 - len(posts)
+            batch, candidates = candidates[:wanted], candidates[wanted:]
+            posts += [post for post in _get_post_records([post_id for _, post_id in batch])
+                      if search.matches_phrases(post, phrases)]
+            continue
+        if exhausted:
+            break
+        page_query = query
+        if cursor:
+            page_query = page_query.start_after({'created_at': cursor[0], '__name__': cursor[1]})
+        docs = list(page_query.limit(scan_size).stream())
+        metrics.add_reads(max(len(docs), 1))
+        for doc in docs:
+            cursor = (doc.get('created_at'), doc.id)
+            if others.issubset(doc.get('terms') if others else ()):
+                candidates.append(cursor)
+        exhausted = len(docs) < scan_size
+        scan_size = min(scan_size * 2, SEARCH_SCAN_SIZE)
+
+    page = posts[:page_size]
+    next_cursor = (page[-1]['created_at'], page[-1]['id']) if len(posts) > page_size else None
+    return page, next_cursor
+
+def _get_post_records(post_ids):
+    """投稿を一覧用のレコードで、post_ids の順に読み込みます (削除された投稿は除きます)。"""
+    post_refs = [db.collection('posts').document(post_id) for post_id in post_ids]
+    found = {}
+    for doc in db.get_all(post_refs, field_paths=POST_LIST_FIELDS):
+        post = _doc_to_record(doc)
+        if post is not None:
+            found[post['id']] = post
+    # get_all は順序を保証しないため、指定された順に並べ直す
+    return [found[post_id] for post_id in post_ids if post_id in found]
+
+def backfill_search_index():
+    """既存の投稿の検索の索引を作り直します (migrate_search_index.py から実行)。索引を作成した投稿の数を返します。"""
+    bulk = _bulk_writer()
+    indexed = 0
+    for doc in db.collection('posts').select(['comment', 'shop_name', 'created_at']).stream():
+        bulk.set(_search_index_ref(doc.id), {
+            'terms': search.index_terms(doc.get('comment'), doc.get('shop_name')), 'created_at': doc.get('created_at')
+        })
+        indexed += 1
+    bulk.close()
+    return indexed
+
+# --- 店舗ごとの集計 (shops) ---
+# shops/{店舗キー} に店舗ごとの集計を保持し、店舗名の候補とお店ランキングはここから読む (投稿は走査しない)。
+# 店舗キーは utils.search.shop_key() で正規化した店舗名で、投稿にも shop_key として保存する。
+# フィールド: key, name (最後に投稿・編集された表記), post_count, like_total, price_count (金額を入力した投稿数),
+#   price_sum, prices ({金額: 投稿数}), price_min, price_max, price_avg, last_visited_at (最新の投稿日時)
+# 件数・合計は投稿の書き込みと同じバッチで Increment する (like_total はいいねの増減をまとめて Increment する)。
+# 最小・最大・平均は金額の分布 prices から書き込みの後にトランザクションで計算し直す
+# (分布を持つので、投稿が削除されても投稿を読み直さずに求まる)。
+# 必要な複合インデックス: posts (shop_key, created_at desc)
+# 導入前のデータは backfill_stats.py で作り直す。
+SHOP_SUGGEST_SCAN = 50 # 候補を投稿数で並べ替えるために読む店舗の数
+SHOP_RANKING_SCAN = 50 # ランキングの条件に合う店舗を探すときに1回に読む店舗の数
+SHOP_RANKING_ORDERS = { # 並べ替えの種類 -> (フィールド, 向き)
+    'posts': ('post_count', firestore.Query.DESCENDING),
+    'likes': ('like_total', firestore.Query.DESCENDING),
+    'cheap': ('price_avg', firestore.Query.ASCENDING),
+    'expensive': ('price_avg', firestore.Query.DESCENDING),
+}
+
+def _shop_ref(key):
+    # ニックネームの索引と同じく、ドキュメントIDに使えない形にならないようエスケープする
+    doc_id = quote(key, safe='').replace('.', '%2E')
+    if doc_id.startswith('__') and doc_id.endswith('__'):
+        doc_id = '%5F' + doc_id[1:]
+    return db.collection('shops').document(doc_id)
+
+def _shop_totals(post):
+    """投稿1件が店舗の集計に占める値を返します。金額の分布は ('prices', 金額) をキーにします。"""
+    totals = {'post_count': 1, 'like_total': post.get('like_count') or 0}
+    price = int(post.get('price') or 0)
+    if price > 0:
+        totals.update({'price_count': 1, 'price_sum': price, ('prices', str(price)): 1})
+    return totals
+
+def _add_shop_posts(writer, key, added=(), removed=(), name=None, visited=False):
+    """バッチ(または BulkWriter)に、店舗の集計へ投稿を加える・除く書き込みを追加します。
+
+    visited=True の場合は最終訪問日時を書き込みの時刻にします (新しい投稿を加える場合)。
+    店舗キーが無い場合は何もせず、追加した書き込みの数を返します。
+    """
+    if not key:
+        return 0
+    counts = Counter()
+    for post in added:
+        counts.update(_shop_totals(post))
+    for post in removed:
+        counts.subtract(_shop_totals(post))
+    data = {'key': key}
+    for field, value in counts.items():
+        if not value:
+            continue
+        if isinstance(field, tuple):
+            data.setdefault('prices', {})[field[1]] = firestore.Increment(value)
+        else:
+            data[field] = firestore.Increment(value)
+    if name:
+        data['name'] = name
+    if visited:
+        data['last_visited_at'] = firestore.SERVER_TIMESTAMP
+    writer.set(_shop_ref(key), data, merge=True)
+    return 1
+
+@firestore.transactional
+def _refresh_shop_in_transaction(transaction, ref, visited_at, recount_visited, latest_visited_at):
+    """金額の分布から最小・最大・平均を計算し直し、最終訪問日時を更新します。"""
+    snapshot = ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return
+    metrics.add_reads()
+    shop = snapshot.to_dict()
+    prices = {price: count for price, count in (shop.get('prices') or {}).items() if count > 0}
+    price_count = shop.get('price_count') or 0
+    last_visited_at = latest_visited_at if recount_visited else shop.get('last_visited_at')
+    if visited_at is not None and (last_visited_at is None or visited_at > last_visited_at):
+        last_visited_at = visited_at
+    transaction.update(ref, {
+        'prices': prices,
+        'price_min': min(map(int, prices)) if prices else None,
+        'price_max': max(map(int, prices)) if prices else None,
+        'price_avg': (shop.get('price_sum') or 0) / price_count if price_count > 0 else None,
+        'last_visited_at': last_visited_at,
+    })
+    metrics.add_writes()
+
+def _refresh_shop(key, visited_at=None, removed_at=None):
+    """投稿を加えた・除いた後に、店舗の金額の最小・最大・平均と最終訪問日時を計算し直します。
+
+    visited_at には加えた投稿の日時を、removed_at には除いた投稿のうち最も新しい日時を渡します。
+    除いた投稿が最新の訪問だった場合のみ、店舗の最新の投稿を1件読みます。
+    """
+    if not key:
+        return
+    latest_visited_at = None
+    recount_visited = False
+    if isinstance(removed_at, datetime.datetime):
+        shop_doc = _shop_ref(key).get(['last_visited_at'])
+        metrics.add_reads()
+        last_visited_at = shop_doc.get('last_visited_at') if shop_doc.exists else None
+        if last_visited_at is None or removed_at >= last_visited_at:
+            recount_visited = True
+            docs = list(db.collection('posts').where('shop_key', '==', key)
+                        .order_by('created_at', direction=firestore.Query.DESCENDING)
+                        .limit(1).select(['created_at']).stream())
+            metrics.add_reads(max(len(docs), 1))
+            latest_visited_at = docs[0].get('created_at') if docs else None
+    _refresh_shop_in_transaction(db.transaction(), _shop_ref(key), visited_at, recount_visited, latest_visited_at)
+
+def suggest_shops(prefix, limit=10):
+    """店舗キーが prefix (正規化済み) で始まる店舗を、投稿数の多い順に返します。"""
+    docs = db.collection('shops') \
+        .where('key', '>=', prefix).where('key', '<', prefix + '\uf8ff') \
+        .order_by('key').limit(SHOP_SUGGEST_SCAN).stream()
+    shops = [_doc_to_dict(doc) for doc in docs]
+    shops = [shop for shop in shops if shop.get('post_count', 0) > 0]
+    shops.sort(key=lambda shop: shop['post_count'], reverse=True)
+    return shops[:limit]
+
+def get_shop_ranking(sort='posts', limit=20, min_posts=1):
+    """店舗の集計をランキングの順に返します。
+
+    sort は 'posts' (投稿数順), 'likes' (いいね数順), 'cheap' / 'expensive' (平均価格の安い順 / 高い順) です。
+    投稿数が min_posts 未満の店舗と、平均価格で並べる場合は金額の入力が無い店舗を除きます。
+    """
+    field, direction = SHOP_RANKING_ORDERS[sort]
+    query = db.collection('shops')
+    if sort == 'posts':
+        query = query.where('post_count', '>=', max(min_posts, 1))
+    elif field == 'price_avg':
+        query = query.where('price_avg', '>', 0)
+    query = query.order_by(field, direction=direction).order_by('__name__', direction=direction)
+
+    shops = []
+    cursor = None
+    while len(shops) < limit:
+        page_query = query
+        if cursor:
+            page_query = page_query.start_after({field: cursor[0], '__name__': cursor[1]})
+        docs = list(page_query.limit(SHOP_RANKING_SCAN).stream())
+        for doc in docs:
+            shop = _doc_to_dict(doc)
+            cursor = (shop.get(field), doc.id)
+            if (shop.get('post_count') or 0) >= max(min_posts, 1):
+                shops.append(shop)
+        if len(docs) < SHOP_RANKING_SCAN:
+            break
+    return shops[:limit]
+
+def backfill_shops():
+    """既存の投稿から、投稿の店舗キーと店舗ごとの集計を作り直します (backfill_stats.py から実行)。
+
+    集計した店舗の数を返します。
+    """
+    totals = {} # 店舗キー -> 集計の値
+    latest = {} # 店舗キー -> (店舗名, 最新の投稿日時)
+    bulk = _bulk_writer()
+    fields = ['shop_name', 'price', 'like_count', 'created_at']
+    # 古い順に読み、最後に投稿された表記を店舗名にする
+    for doc in db.collection('posts').select(fields).order_by('created_at').stream():
+        post = doc.to_dict()
+        key = search.shop_key(post.get('shop_name'))
+        bulk.update(doc.reference, {'shop_key': key or None})
+        if key:
+            totals.setdefault(key, Counter()).update(_shop_totals(post))
+            latest[key] = (post.get('shop_name'), post.get('created_at'))
+    for key, shop in totals.items():
+        prices = {field[1]: count for field, count in shop.items() if isinstance(field, tuple)}
+        name, last_visited_at = latest[key]
+        bulk.set(_shop_ref(key), {
+            'key': key,
+            'name': name,
+            'post_count': shop['post_count'],
+            'like_total': shop['like_total'],
+            'price_count': shop['price_count'],
+            'price_sum': shop['price_sum'],
+            'prices': prices,
+            'price_min': min(map(int, prices)) if prices else None,
+            'price_max': max(map(int, prices)) if prices else None,
+            'price_avg': shop['price_sum'] / shop['price_count'] if shop['price_count'] else None,
+            'last_visited_at': last_visited_at,
+        })
+    bulk.close()
+    return len(totals)
+
+# --- Like Functions ---
+# いいねドキュメントの作成/削除と投稿の like_count の増減は1つのバッチでアトミックに書き込む。
+# like_count はサーバー側の Increment で更新するため、読み取りもトランザクションのリトライも発生しない。
+# 重複チェックは create() / exists=True の前提条件で行う。事前に読むのは店舗ごとの集計に使う投稿の店舗名と
+# ランキングの更新に使う投稿日時だけで、どちらも同じ1回の読み取りで取得する。
+#
+# いいね1件あたりの読み書き:
+#   書き込み (リクエスト中)  2件: いいね、投稿の like_count。ランキングが変わる場合は leaderboards のトランザクションが加わる
+#   読み取り (リクエスト中)  投稿1件 (解除ではいいねも1件)、ランキングの事前確認1件
+#   書き込み (まとめて)      ユーザーの like_count・店舗の like_total・日次集計。プロセス内でいいね数を合計し、
+#                            LIKE_COUNTER_FLUSH_INTERVAL 秒ごとに各ドキュメントへ1回ずつ書き込む (いいねの数によらない)
+# 投稿のドキュメントにはいいね1件ごとに1回書き込むため、1つの投稿へのいいねの速さの上限は、Firestoreの
+# 1ドキュメントあたりの書き込みの上限 (持続的には毎秒1回程度、Increment は短時間の集中には耐える) で決まる。
+# いいね数は一覧で投稿と一緒に読むため分散はせず (分散すると一覧の読み取りが投稿ごとに分散数だけ増える)、
+# 同じいいねで書き込んでいたユーザー・店舗・日次集計をまとめて、投稿以外に書き込みが集中しないようにしている。
+# まとめた増減はプロセスの終了時にも書き込む。異常終了で失われた場合は backfill_stats.py で作り直す。
+LIKE_COUNTER_FLUSH_INTERVAL = float(os.environ.get('LUNCH_SNS_LIKE_COUNTER_FLUSH_INTERVAL', '1')) # 秒
+_like_counters = {'users': Counter(), 'shops': Counter(), 'days': Counter()} # まだ書き込んでいない増減
+_like_counters_lock = threading.Lock()
+_like_counter_flusher = None
+
+def check_like(user_id, post_id):
+    """ユーザーが既に投稿にいいねしているか確認します。"""
+    # ドキュメントIDを複合キーのように扱うことで高速にチェック
+    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
+    metrics.add_reads()
+    return like_ref.get().exists
+
+def get_liked_post_ids(user_id, post_ids):
+    """指定した投稿のうち、ユーザーがいいね済みの投稿IDの集合を返します。"""
+    # いいねドキュメントをまとめて取得し、1往復で全カードのいいね状態を解決する
+    if not post_ids:
+        return set()
+    like_refs = [db.collection('likes').document(f"{user_id}_{post_id}") for post_id in post_ids]
+    liked = set()
+    metrics.add_reads(len(like_refs))
+    for snapshot in db.get_all(like_refs):
+        if snapshot.exists:
+            liked.add(snapshot.get('post_id'))
+    return liked
+
+def add_like(user_id, post_id):
+    """投稿にいいねを追加し、投稿のいいね数をインクリメントします。"""
+    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
+    post_ref = db.collection('posts').document(post_id)
+    # 店舗ごとの集計にもいいね数を加えるため、投稿の店舗名を読む (投稿日時はランキングの更新に使う)
+    post_doc = post_ref.get(['shop_name', 'created_at'])
+    metrics.add_reads()
+    if not post_doc.exists:
+        return False
+    batch = db.batch()
+    # 既にいいね済みの場合は create() が失敗し、バッチ全体が適用されない
+    batch.create(like_ref, {
+        'user_id': user_id,
+        'post_id': post_id,
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    # 投稿のlike_countをインクリメント
+    batch.update(post_ref, {'like_count': firestore.Increment(1), 'updated_at': firestore.SERVER_TIMESTAMP})
+    try:
+        results = _commit(batch)
+    except (gcp_exceptions.AlreadyExists, gcp_exceptions.NotFound):
+        # いいね済み、または投稿が削除済み
+        return False
+    _add_like_counters(user_id, post_doc, 1)
+    _notify_timeline(results, [post_id])
+    _update_leaderboard(post_id, created_at=post_doc.get('created_at'))
+    return True
+
+def _add_like_counters(user_id, post_doc, count, date_str=None):
+    """ユーザー・投稿の店舗・日次集計 (date_str の日、省略時は今日) のいいね数の増減を、まとめて書き込むために加えます。"""
+    global _like_counter_flusher
+    shop_key = search.shop_key(post_doc.get('shop_name'))
+    with _like_counters_lock:
+        _like_counters['users'][user_id] += count
+        if shop_key:
+            _like_counters['shops'][shop_key] += count
+        _like_counters['days'][date_str or jst_date_str()] += count
+        if _like_counter_flusher is None:
+            _like_counter_flusher = threading.Thread(target=_flush_like_counters_periodically,
+                                                     name="like-counters", daemon=True)
+            _like_counter_flusher.start()
+            atexit.register(flush_like_counters)
+
+def _flush_like_counters_periodically():
+    while True:
+        time.sleep(LIKE_COUNTER_FLUSH_INTERVAL)
+        try:
+            flush_like_counters()
+        except Exception as e:
+            print(f"Error flushing like counters: {e}")
+
+def flush_like_counters():
+    """まとめているいいね数の増減を書き込みます。書き込んだドキュメント数を返します。"""
+    with _like_counters_lock:
+        users, shops, days = ({key: count for key, count in counter.items() if count}
+                              for counter in (_like_counters['users'], _like_counters['shops'], _like_counters['days']))
+        for counter in _like_counters.values():
+            counter.clear()
+    if not (users or shops or days):
+        return 0
+    # 削除済みのユーザーへの update は失敗するが、BulkWriter は他の書き込みを続ける
+    bulk = _bulk_writer()
+    for user_id, count in users.items():
+        bulk.update(db.collection('users').document(user_id), _user_counters(like_count=count))
+    for shop_key, count in shops.items():
+        bulk.set(_shop_ref(shop_key), {'like_total': firestore.Increment(count)}, merge=True)
+    for date_str, count in days.items():
+        _add_daily_stats(bulk, date_str, likes=count)
+    bulk.close()
+    writes = len(users) + len(shops) + len(days)
+    metrics.add_writes(writes)
+    return writes
+
+def remove_like(user_id, post_id):
+    """投稿のいいねを解除し、投稿のいいね数をデクリメントします。"""
+    like_ref = db.collection('likes').document(f"{user_id}_{post_id}")
+    post_ref = db.collection('posts').document(post_id)
+    # いいねの日時 (日次集計を減らす日) と投稿の店舗名・投稿日時を1回の往復で読む
+    docs = {doc.reference.path: doc for doc in db.get_all([post_ref, like_ref], field_paths=['shop_name', 'created_at'])}
+    metrics.add_reads(2)
+    post_doc, like_doc = docs.get(post_ref.path), docs.get(like_ref.path)
+    if post_doc is None or not post_doc.exists or like_doc is None or not like_doc.exists:
+        return False
+    liked_at = like_doc.get('created_at')
+    batch = db.batch()
+    # 読んだ後にいいねが削除された場合は削除の前提条件が満たされず、バッチ全体が適用されない
+    batch.delete(like_ref, option=db.write_option(exists=True))
+    # 投稿のlike_countをデクリメント
+    batch.update(post_ref, {'like_count': firestore.Increment(-1), 'updated_at': firestore.SERVER_TIMESTAMP})
+    try:
+        results = _commit(batch)
+    except gcp_exceptions.NotFound:
+        return False
+    _add_like_counters(user_id, post_doc, -1, jst_date_str(liked_at) if isinstance(liked_at, datetime.datetime) else None)
+    _notify_timeline(results, [post_id])
+    _update_leaderboard(post_id, created_at=post_doc.get('created_at'), decreased=True)
+    return True
+
+# --- Award Function ---
+# 日別のいいねランキングを leaderboards/{YYYY-MM-DD} (投稿日の日本時間) に保持する。
+# entries には いいね数が1件以上の投稿が多い順に最大 LEADERBOARD_SIZE 件入り、
+# 表示に必要な項目も含むため、アワードの表示はドキュメント1件の読み取りで済む。
+# add_like / remove_like / update_post / delete_post が更新する。
+LEADERBOARD_SIZE = 10
+LEADERBOARD_FIELDS = list(POST_LIST_FIELDS) # エントリにはタイムラインの一覧と同じフィールドを保存する
+
+def _leaderboard_ref(date_str):
+    return db.collection('leaderboards').document(date_str)
+
+def _leaderboard_entry(post_id, post_data):
+    entry = {field: post_data.get(field) for field in LEADERBOARD_FIELDS}
+    entry['post_id'] = post_id
+    return entry
+
+@firestore.transactional
+def _update_leaderboard_in_transaction(transaction, board_ref, post_id, post_ref, decreased, only_if_present):
+    """ランキングの該当エントリを更新します。ランキングの再構築が必要な場合 True を返します。"""
+    board_snapshot = board_ref.get(transaction=transaction)
+    metrics.add_reads()
+    entry = None
+    if post_ref is not None:
+        post_snapshot = post_ref.get(field_paths=LEADERBOARD_FIELDS, transaction=transaction)
+        metrics.add_reads()
+        if post_snapshot.exists:
+            entry = _leaderboard_entry(post_id, post_snapshot.to_dict())
+
+    old_entries = board_snapshot.get('entries') if board_snapshot.exists else []
+    was_present = any(e['post_id'] == post_id for e in old_entries)
+    if only_if_present and not was_present:
+        return False
+    was_full = len(old_entries) >= LEADERBOARD_SIZE
+
+    entries = [e for e in old_entries if e['post_id'] != post_id]
+    if entry and (entry['like_count'] or 0) > 0:
+        entries.append(entry)
+    entries.sort(key=lambda e: e['like_count'], reverse=True)
+    entries = entries[:LEADERBOARD_SIZE]
+    # 圏外のままの投稿など、ランキングが変わらない場合は書き込まない
+    if entries == old_entries:
+        return False
+    transaction.set(board_ref, {'entries': entries, 'updated_at': firestore.SERVER_TIMESTAMP})
+    metrics.add_writes()
+
+    # 満杯のランキングで順位が下がった(外れた)場合、圏外の投稿が繰り上がる可能性がある
+    if decreased and was_full and was_present:
+        return len(entries) < LEADERBOARD_SIZE or entries[-1]['post_id'] == post_id
+    return False
+
+def _rebuild_leaderboard(date_str):
+    """指定日の投稿からランキングを作り直します。"""
+    start_of_day, end_of_day = jst_day_range(date_str)
+    docs = db.collection('posts') \
+        .where('created_at', '>=', start_of_day) \
+        .where('created_at', '<=', end_of_day) \
+        .order_by('like_count', direction=firestore.Query.DESCENDING) \
+        .limit(LEADERBOARD_SIZE) \
+        .select(LEADERBOARD_FIELDS) \
+        .stream()
+    entries = [_leaderboard_entry(doc.id, doc.to_dict()) for doc in docs]
+    metrics.add_reads(len(entries))
+    entries = [e for e in entries if (e['like_count'] or 0) > 0]
+    _leaderboard_ref(date_str).set({'entries': entries, 'updated_at': firestore.SERVER_TIMESTAMP})
+    metrics.add_writes()
+
+def _may_change_leaderboard(board_ref, post_ref, post_id, absent_is_unchanged):
+    """投稿の変更がランキングを変える可能性があるかを、トランザクションを使わずに確かめます。
+
+    absent_is_unchanged=True (いいね数の減少・削除・内容の更新) の場合、圏外の投稿はランキングを変えません。
+    """
+    docs = {doc.reference.path: doc for doc in db.get_all([board_ref, post_ref], field_paths=['entries', 'like_count'])}
+    metrics.add_reads(2)
+    board_doc, post_doc = docs.get(board_ref.path), docs.get(post_ref.path)
+    entries = board_doc.get('entries') if board_doc is not None and board_doc.exists else []
+    if any(e['post_id'] == post_id for e in entries):
+        return True
+    if absent_is_unchanged:
+        return False
+    like_count = (post_doc.get('like_count') or 0) if post_doc is not None and post_doc.exists else 0
+    # 満杯のランキングに入るには、最下位より多くのいいねが必要 (同数の場合は先に入った投稿が残る)
+    return like_count > 0 and (len(entries) < LEADERBOARD_SIZE or like_count > (entries[-1]['like_count'] or 0))
+
+def _update_leaderboard(post_id, created_at=None, decreased=False, deleted=False, only_if_present=False):
+    """投稿の変更をランキングに反映します。
+
+    ランキングに入らない投稿のいいねで、その日の全てのいいねが同じドキュメントをトランザクションで
+    読み書きしないよう、先にロックを取らずに読んで変わる可能性がある場合だけトランザクションを実行します。
+    """
+    post_ref = db.collection('posts').document(post_id)
+    if created_at is None:
+        post_doc = post_ref.get(['created_at'])
+        metrics.add_reads()
+        created_at = post_doc.get('created_at') if post_doc.exists else None
+    if not isinstance(created_at, datetime.datetime):
+        return
+    date_str = jst_date_str(created_at)
+    board_ref = _leaderboard_ref(date_str)
+    if not _may_change_leaderboard(board_ref, post_ref, post_id, decreased or deleted or only_if_present):
+        return
+    needs_rebuild = _update_leaderboard_in_transaction(
+        db.transaction(), board_ref, post_id, None if deleted else post_ref, decreased, only_if_present
+    )
+    if needs_rebuild:
+        _rebuild_leaderboard(date_str)
+
+def _entry_to_post(entry):
+    return post_record(entry['post_id'], entry)
+
+def get_leaderboard(date_str):
+    """指定日のいいねランキングを、いいね数の多い順の投稿リストで返します。"""
+    board_doc = _leaderboard_ref(date_str).get()
+    metrics.add_reads()
+    entries = board_doc.get('entries') if board_doc.exists else []
+    return [_entry_to_post(entry) for entry in entries]
+
+def get_period_leaderboard(days=7, limit=3, end_date=None):
+    """直近 days 日間(週間・月間など)のいいねランキングを取得します。
+
+    投稿はいずれか1日のランキングにのみ属するため、日別ランキングの上位を
+    まとめて並べ替えるだけで期間全体の上位が求まります (読み取りは日数分のみ)。
+    """
+    board_refs = [_leaderboard_ref(date_str) for date_str in recent_date_strs(days, end_date)]
+    entries = []
+    metrics.add_reads(len(board_refs))
+    for board_doc in db.get_all(board_refs):
+        if board_doc.exists:
+            entries.extend(_entry_to_post(entry) for entry in board_doc.get('entries'))
+    entries.sort(key=lambda e: e['like_count'], reverse=True)
+    return entries[:limit]
+
+# --- Admin Dashboard Functions ---
+def get_dashboard_stats():
+    """ダッシュボード用の統計情報を取得します。"""
+    # .count()はFirestoreの比較的新しい機能で、ドキュメント全体を読み込むより効率的
+    # ただし無料枠の読み取り回数にはカウントされる
+    stats = {}
+    stats['user_count'] = _count(db.collection('users'))
+    stats['post_count'] = _count(db.collection('posts'))
+    stats['like_count'] = _count(db.collection('likes'))
+
+    # 時系列データは日次集計ドキュメントから読む (読み取り件数は日数 + 分散したドキュメントの数のみ)
+    post_timeline_list = [
+        (date_str, day['posts'], day['likes'], day['new_users'], len(day['active_poster_ids']))
+        for date_str, day in sorted(_read_daily_stats().items())
+    ]
+
+    # 人気投稿ランキング
+    popular_posts_docs = db.collection('posts').order_by('like_count', direction=firestore.Query.DESCENDING) \
+        .limit(10).select(['comment', 'nickname', 'like_count']).stream()
+    popular_posts = [
+        (p.get('comment'), p.get('nickname'), p.get('like_count'))
+        for p in popular_posts_docs
+    ]
+    metrics.add_reads(len(popular_posts))
+
+    return stats, post_timeline_list, popular_posts
+
+
+def export_rows(collection, fields, changed_field, since=None):
+    """エクスポート用に、changed_field が since 以降のドキュメントを id と fields のフィールドだけで返します。
+
+    since を省略した場合は全件を返します。changed_field を持たない(導入前の)ドキュメントは全件の場合のみ含まれます。
+    """
+    query = db.collection(collection)
+    if since is not None:
+        query = query.where(changed_field, '>=', since)
+    rows = []
+    for doc in query.select(fields).stream():
+        row = doc.to_dict()
+        row['id'] = doc.id
+        rows.append(row)
+    metrics.add_reads(len(rows))
+    return rows
+
+USER_PAGE_FIELDS = ['nickname', 'created_at', 'post_count', 'like_count'] # ユーザー一覧で読むフィールド
+
+def get_users_page(page_size=50, start_after=None, nickname_prefix='', exclude_nickname=None):
+    """ユーザーを1ページ分取得します。exclude_nickname を指定した場合はそのユーザー (管理者) を除きます。
+
+    nickname_prefix を指定した場合はニックネームの前方一致で絞り込み、ニックネーム順に返します。
+    指定しない場合は登録日時の新しい順です。start_after には前ページの末尾カーソルを渡します。
+    戻り値は (ユーザーのリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    パスワードのハッシュなど一覧に使わないフィールドは読み込みません。
+    """
+    users_ref = db.collection('users')
+    if nickname_prefix:
+        sort_field = 'nickname'
+        query = users_ref.where('nickname', '>=', nickname_prefix) \
+            .where('nickname', '<', nickname_prefix + '\uf8ff') \
+            .order_by('nickname').order_by('__name__')
+    else:
+        sort_field = 'created_at'
+        query = users_ref.order_by('created_at', direction=firestore.Query.DESCENDING) \
+            .order_by('__name__', direction=firestore.Query.DESCENDING)
+    if start_after:
+        value, user_id = start_after
+        query = query.start_after({sort_field: value, '__name__': user_id})
+
+    # 1件多く取得して次ページの有無を判定する
+    docs = list(query.select(USER_PAGE_FIELDS).limit(page_size + 1).stream())
+    users = [_doc_to_dict(doc) for doc in docs[:page_size]]
+    next_cursor = None
+    if len(docs) > page_size and users:
+        last = users[-1]
+        next_cursor = (last[sort_field], last['id'])
+    # 管理者はカーソルの位置を保つため、取得した後で除く
+    if exclude_nickname:
+        users = [user for user in users if user.get('nickname') != exclude_nickname]
+    for user in users:
+        user.setdefault('post_count', 0)
+        user.setdefault('like_count', 0)
+    return users, next_cursor
+
+def increment_session_version(user_id):
+    """ユーザーのセッションのバージョンを1つ上げます。"""
+    db.collection('users').document(user_id).update({'session_version': firestore.Increment(1)})
+    metrics.add_writes()
+
+# 削除するユーザーの投稿から読むフィールド (日次集計・店舗ごとの集計の減算と画像の削除に使う)
+CASCADE_POST_FIELDS = ['created_at', 'shop_name', 'price', 'like_count', 'image_path', 'image_variants', 'image_key']
+
+def delete_user_cascade(user_id):
+    """ユーザーと、その投稿・投稿へのいいね・ユーザーが付けたいいねを一括で削除します。
+
+    ユーザーがいいねしていた他人の投稿は like_count を減らし、影響する日のランキングを作り直します。
+    戻り値は (削除した投稿のリスト, like_count を減らした投稿IDのリスト) です (画像の削除は呼び出し側で行う)。
+    """
+    user_ref = db.collection('users').document(user_id)
+    user = _doc_to_dict(user_ref.get())
+    posts = [_doc_to_dict(doc) for doc in
+             db.collection('posts').where('user_id', '==', user_id).select(CASCADE_POST_FIELDS).stream()]
+    post_ids = {post['id'] for post in posts}
+    bulk = _bulk_writer()
+    writes = 0
+
+    # 1. ユーザーの投稿に付いたいいね (in は最大30件まで)。いいねした他のユーザーのいいね数を減らす
+    post_id_list = sorted(post_ids)
+    likers = Counter()
+    like_dates = Counter() # 削除したいいねの日付ごとの件数 (日次集計から減らす)
+    def count_like_date(like):
+        if isinstance(like.get('created_at'), datetime.datetime):
+            like_dates[jst_date_str(like.get('created_at'))] += 1
+    for i in range(0, len(post_id_list), 30):
+        likes = db.collection('likes').where('post_id', 'in', post_id_list[i:i + 30]) \
+            .select(['user_id', 'created_at']).stream()
+        for like in likes:
+            bulk.delete(like.reference)
+            metrics.add_reads()
+            writes += 1
+            count_like_date(like)
+            if like.get('user_id') != user_id:
+                likers[like.get('user_id')] += 1
+    for liker_id, count in likers.items():
+        if liker_id:
+            bulk.update(db.collection('users').document(liker_id), _user_counters(like_count=-count))
+            writes += 1
+
+    # 2. ユーザーが付けたいいね。削除しない投稿の like_count を減らす
+    liked_post_ids = []
+    for like in db.collection('likes').where('user_id', '==', user_id).select(['post_id', 'created_at']).stream():
+        metrics.add_reads()
+        post_id = like.get('post_id')
+        if post_id in post_ids:
+            continue # 1. で削除済み
+        bulk.delete(like.reference)
+        writes += 1
+        count_like_date(like)
+        if post_id:
+            bulk.update(db.collection('posts').document(post_id),
+                        {'like_count': firestore.Increment(-1), 'updated_at': firestore.SERVER_TIMESTAMP})
+            writes += 1
+            liked_post_ids.append(post_id)
+
+    # 3. 投稿本体と検索の索引、日次集計と店舗ごとの集計
+    post_dates = Counter()
+    shop_posts = {}
+    for post in posts:
+        bulk.delete(db.collection('posts').document(post['id']))
+        bulk.delete(_search_index_ref(post['id']))
+        writes += 2
+        if isinstance(post.get('created_at'), datetime.datetime):
+            post_dates[jst_date_str(post['created_at'])] += 1
+        shop_posts.setdefault(search.shop_key(post.get('shop_name')), []).append(post)
+    writes += _add_daily_counts(bulk, 'posts', post_dates)
+    writes += _add_daily_counts(bulk, 'likes', like_dates)
+    for date_str in post_dates:
+        writes += _remove_daily_poster(bulk, date_str, user_id)
+    if user is not None and isinstance(user.get('created_at'), datetime.datetime):
+        _add_daily_stats(bulk, jst_date_str(user['created_at']), new_users=-1)
+        writes += 1
+    for key, removed in shop_posts.items():
+        writes += _add_shop_posts(bulk, key, removed=removed)
+
+    # 4. ユーザー本体とニックネームの索引 (索引が別のユーザーを指している場合は残す)
+    if user is not None:
+        index_ref = _nickname_ref(user['nickname'])
+        index_doc = index_ref.get()
+        metrics.add_reads()
+        if index_doc.exists and index_doc.get('user_id') == user_id:
+            bulk.delete(index_ref)
+            writes += 1
+        bulk.delete(user_ref)
+        writes += 1
+    bulk.close()
+    metrics.add_writes(writes)
+    _notify_timeline(post_ids=post_ids | set(liked_post_ids))
+
+    # 5. 削除した投稿・いいね数の減った投稿の日のランキングと、店舗ごとの集計を作り直す
+    board_dates = set(post_dates)
+    liked_shops = Counter()
+    if liked_post_ids:
+        liked_refs = [db.collection('posts').document(post_id) for post_id in liked_post_ids]
+        metrics.add_reads(len(liked_refs))
+        for doc in db.get_all(liked_refs, field_paths=['created_at', 'shop_name']):
+            if not doc.exists:
+                continue
+            created_at = doc.get('created_at')
+            if isinstance(created_at, datetime.datetime):
+                board_dates.add(jst_date_str(created_at))
+            liked_shops[search.shop_key(doc.get('shop_name'))] += 1
+    for date_str in sorted(board_dates):
+        _rebuild_leaderboard(date_str)
+    liked_shops.pop('', None)
+    if liked_shops:
+        bulk = _bulk_writer()
+        for key, count in liked_shops.items():
+            bulk.set(_shop_ref(key), {'like_total': firestore.Increment(-count)}, merge=True)
+        bulk.close()
+        metrics.add_writes(len(liked_shops))
+    for key, removed in shop_posts.items():
+        _refresh_shop(key, removed_at=max((post['created_at'] for post in removed
+                                           if isinstance(post.get('created_at'), datetime.datetime)), default=None))
+    return posts, liked_post_ids
+
+def backfill_user_counters():
+    """既存の posts / likes から、ユーザーごとの投稿数・いいね数を作り直します (backfill_stats.py から実行)。
+
+    更新したユーザーの数を返します。
+    """
+    post_counts = Counter(doc.get('user_id') for doc in db.collection('posts').select(['user_id']).stream())
+    like_counts = Counter(doc.get('user_id') for doc in db.collection('likes').select(['user_id']).stream())
+    bulk = _bulk_writer()
+    updated = 0
+    for doc in db.collection('users').select([]).stream():
+        bulk.update(doc.reference, {'post_count': post_counts[doc.id], 'like_count': like_counts[doc.id]})
+        updated += 1
+    bulk.close()
+    return updated
+
+def backfill_nickname_index():
+    """既存ユーザーのニックネームの索引を作成します (migrate_nicknames.py から実行)。
+
+    作成した件数と、同じニックネームを持つ別ユーザーのIDのリストを返します。
+    重複している場合は最も古いユーザーに索引を割り当てます。
+    """
+    users = []
+    for doc in db.collection('users').select(['nickname', 'created_at']).stream():
+        created_at = doc.get('created_at')
+        users.append((doc.get('nickname'), created_at if isinstance(created_at, datetime.datetime) else None, doc.id))
+    # 登録日時の古い順 (日時の無いものは最後)
+    users.sort(key=lambda u: (u[1] is None, u[1] or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)))
+
+    assigned = {}
+    duplicates = []
+    for nickname, _, user_id in users:
+        if nickname in assigned:
+            duplicates.append(user_id)
+        else:
+            assigned[nickname] = user_id
+
+    # 既に索引があるニックネームはそのまま残す
+    items = list(assigned.items())
+    created = 0
+    for i in range(0, len(items), 500):
+        chunk = items[i:i + 500]
+        refs = [_nickname_ref(nickname) for nickname, _ in chunk]
+        existing = {snapshot.reference.id for snapshot in db.get_all(refs) if snapshot.exists}
+        batch = db.batch()
+        for ref, (_, user_id) in zip(refs, chunk):
+            if ref.id not in existing:
+                batch.set(ref, {'user_id': user_id})
+        if len(batch):
+            created += len(batch)
+            batch.commit()
+    return created, duplicates
+
+# --- 自分の投稿履歴 & 編集・削除 ---
+
+def get_posts_by_user(user_id):
+    """特定のユーザーの投稿をすべて取得します。"""
+    docs = db.collection('posts').where('user_id', '==', user_id) \
+        .order_by('created_at', direction=firestore.Query.DESCENDING).select(POST_LIST_FIELDS).stream()
+    return [_doc_to_record(doc) for doc in docs]
+
+def update_post(post_id, comment, shop_name, price):
+    """投稿の内容を更新します。"""
+    post_ref = db.collection('posts').document(post_id)
+    # 検索の索引と店舗ごとの集計を合わせるため、変更前の店舗名・金額などを読む
+    post = _doc_to_dict(post_ref.get(field_paths=['shop_name', 'price', 'like_count', 'created_at']))
+    if post is None:
+        return
+    batch = db.batch()
+    old_key, new_key = search.shop_key(post.get('shop_name')), search.shop_key(shop_name)
+    batch.update(post_ref, {
+        'comment': comment,
+        'shop_name': shop_name,
+        'shop_key': new_key or None,
+        'price': price,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
+    batch.set(_search_index_ref(post_id), {
+        'terms': search.index_terms(comment, shop_name), 'created_at': post.get('created_at')
+    })
+    updated = dict(post, price=price)
+    if old_key != new_key:
+        _add_shop_posts(batch, old_key, removed=[post])
+        _add_shop_posts(batch, new_key, added=[updated], name=shop_name)
+    elif post.get('shop_name') != shop_name or post.get('price') != price:
+        _add_shop_posts(batch, new_key, added=[updated], removed=[post], name=shop_name)
+    _notify_timeline(_commit(batch), [post_id])
+    if old_key != new_key:
+        _refresh_shop(old_key, removed_at=post.get('created_at'))
+        _refresh_shop(new_key, visited_at=post.get('created_at'))
+    elif post.get('price') != price:
+        _refresh_shop(new_key)
+    # ランキングに載っている場合は表示内容を合わせる
+    _update_leaderboard(post_id, only_if_present=True)
+
+def update_post_image(post_id, status, image_variants=None):
+    """投稿の画像の状態を更新します。投稿が削除済みの場合は False を返します。"""
+    data = {'status': status, 'updated_at': firestore.SERVER_TIMESTAMP}
+    if image_variants is not None:
+        data['image_variants'] = image_variants
+    try:
+        result = db.collection('posts').document(post_id).update(data)
+    except gcp_exceptions.NotFound:
+        return False
+    metrics.add_writes()
+    _notify_timeline([result], [post_id])
+    _update_leaderboard(post_id, only_if_present=True)
+    return True
+
+def delete_post(post_id):
+    """投稿と、投稿に紐づくいいねを削除します。
+
+    削除した投稿の内容を返します (画像の削除は呼び出し側で行う)。投稿が無い場合は None です。
+    """
+    post_ref = db.collection('posts').document(post_id)
+    post = _doc_to_dict(post_ref.get())
+    if post is None:
+        return None
+
+    # 1. 投稿に紐づく「いいね」を削除し、いいねしたユーザーと投稿者の集計を減らす
+    # (件数が多くてもよいよう BulkWriter で書き込む。ユーザーが削除済みの場合の失敗は無視する)
+    likes_query = db.collection('likes').where('post_id', '==', post_id).select(['user_id', 'created_at']).stream()
+    bulk = _bulk_writer()
+    like_count = 0
+    like_dates = Counter()
+    for like in likes_query:
+        bulk.delete(like.reference)
+        like_count += 1
+        if like.get('user_id'):
+            bulk.update(db.collection('users').document(like.get('user_id')), _user_counters(like_count=-1))
+        if isinstance(like.get('created_at'), datetime.datetime):
+            like_dates[jst_date_str(like.get('created_at'))] += 1
+    if post.get('user_id'):
+        bulk.update(db.collection('users').document(post['user_id']), _user_counters(post_count=-1))
+    writes = _add_daily_counts(bulk, 'likes', like_dates)
+    bulk.close()
+    metrics.add_reads(like_count)
+    metrics.add_writes(like_count * 2 + 1 + writes)
+
+    # 2. 投稿本体を削除し、投稿日の日次集計を減らす
+    batch = db.batch()
+    batch.delete(post_ref)
+    batch.delete(_search_index_ref(post_id))
+    shop_key = search.shop_key(post.get('shop_name'))
+    _add_shop_posts(batch, shop_key, removed=[post])
+    created_at = post.get('created_at')
+    if isinstance(created_at, datetime.datetime):
+        date_str = jst_date_str(created_at)
+        _add_daily_stats(batch, date_str, posts=-1)
+        if post.get('user_id') and not _has_other_post_on(post['user_id'], date_str, post_id):
+            _remove_daily_poster(batch, date_str, post['user_id'])
+    _notify_timeline(_commit(batch), [post_id])
+    _update_leaderboard(post_id, created_at=created_at, decreased=True, deleted=True)
+    _refresh_shop(shop_key, removed_at=created_at)
+    return post
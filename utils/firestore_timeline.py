@@ -0,0 +1,175 @@
+# utils/firestore_timeline.py
+# Firestoreのスナップショットリスナーで、最新の投稿をプロセス内のメモリに保持する。
+# タイムラインの読み取りはメモリから返し、Firestoreの読み取りは投稿が変化したときだけ発生する。
+
+import datetime
+import threading
+import time
+
+
+class MaterializedTimeline:
+    """posts の最新 window 件をメモリ上に保持するスナップショットリスナー。
+
+    query_factory は order_by('created_at').limit(window) 済みのクエリを返す関数です。
+    リスナーが切断された場合は監視スレッドが再接続し、それまでの間は
+    posts() / page() が None を返すので、呼び出し側は通常のクエリにフォールバックします。
+    書き込んだ処理は wait_for() で、その書き込みを含むスナップショットが届くまで(最大 wait_timeout 秒)待ち、
+    書き込んだセッションが直後の再実行で自分の変更を読めるようにします。リスナーが不調で届かない場合に限り、
+    次のスナップショットが届くまで(最大 pending_timeout 秒)全ての読み取りを通常のクエリにフォールバックします。
+    """
+
+    def __init__(self, query_factory, to_dict, window, check_interval=10, max_backoff=300, pending_timeout=5,
+                 wait_timeout=0.3):
+        self.window = window
+        self._query_factory = query_factory
+        self._to_dict = to_dict
+        self._check_interval = check_interval
+        self._max_backoff = max_backoff
+        self._pending_timeout = pending_timeout
+        self._wait_timeout = wait_timeout
+        self._pending_until = 0 # この時刻までは、スナップショットが届くまでメモリから返さない
+        self._posts = None # 新しい順の投稿リスト (初回のスナップショットを受け取るまでは None)
+        self._post_ids = frozenset()
+        self._read_time = None # 最後に受け取ったスナップショットの時刻
+        self._watch = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._snapshot_arrived = threading.Condition(self._lock)
+        self.snapshot_count = 0
+        self.reconnect_count = 0
+
+    def start(self):
+        """リスナーを登録し、切断を監視するスレッドを起動します。"""
+        self._subscribe()
+        threading.Thread(target=self._supervise, name="timeline-listener", daemon=True).start()
+
+    def stop(self):
+        """リスナーを解除します。"""
+        self._stopped.set()
+        with self._lock:
+            watch, self._watch = self._watch, None
+            self._posts = None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def contains(self, post_id):
+        """投稿がメモリ上のウィンドウにあるかを返します (ウィンドウ外の投稿の変更はスナップショットに現れない)。"""
+        with self._lock:
+            return post_id in self._post_ids
+
+    def wait_for(self, write_time=None):
+        """書き込み (write_time はコミットの時刻、不明な場合は None) を含むスナップショットが届くまで待ちます。
+
+        届いた場合は True を返します。リスナーが不調、または wait_timeout 秒以内に届かない場合は
+        フォールバックを開始して False を返します。
+        """
+        write_time = _to_datetime(write_time)
+        deadline = time.monotonic() + self._wait_timeout
+        with self._lock:
+            start_count = self.snapshot_count
+            def arrived():
+                if write_time is not None and self._read_time is not None:
+                    return self._read_time >= write_time
+                return self.snapshot_count > start_count
+            while self._is_healthy_locked() and not arrived():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._snapshot_arrived.wait(remaining)
+            if self._is_healthy_locked() and arrived():
+                return True
+            self._pending_until = time.monotonic() + self._pending_timeout
+            return False
+
+    def is_healthy(self):
+        """リスナーが接続中で、最新の内容を保持しているかを返します。"""
+        with self._lock:
+            return self._is_healthy_locked()
+
+    def _is_healthy_locked(self):
+        watch = self._watch
+        return (self._posts is not None and self._pending_until <= time.monotonic()
+                and watch is not None and getattr(watch, 'is_active', True))
+
+    def posts(self):
+        """保持している投稿を新しい順に返します。リスナーが不調な場合は None を返します。"""
+        if not self.is_healthy():
+            return None
+        with self._lock:
+            return list(self._posts)
+
+    def is_complete(self):
+        """全ての投稿がメモリ上にある(投稿数が window 未満)かを返します。"""
+        posts = self.posts()
+        return posts is not None and len(posts) < self.window
+
+    def page(self, page_size, start_after=None):
+        """get_posts_page と同じ形式で1ページ分を返します。メモリ上で返せない場合は None です。"""
+        posts = self.posts()
+        if posts is None:
+            return None
+        start = 0
+        if start_after:
+            start = next((i for i, post in enumerate(posts) if _sort_key(post) < start_after), len(posts))
+        rows = posts[start:start + page_size + 1]
+        # ページの途中でウィンドウの末尾に達した場合、続きはメモリに無い
+        if len(rows) <= page_size and len(posts) >= self.window:
+            return None
+        page_posts = rows[:page_size]
+        next_cursor = _sort_key(page_posts[-1]) if len(rows) > page_size else None
+        return page_posts, next_cursor
+
+    # --- 内部処理 ---
+    def _subscribe(self):
+        watch = self._query_factory().on_snapshot(self._on_snapshot)
+        with self._lock:
+            old_watch, self._watch = self._watch, watch
+        if old_watch is not None:
+            try:
+                old_watch.unsubscribe()
+            except Exception as e:
+                print(f"Error unsubscribing timeline listener: {e}")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        posts = [self._to_dict(doc) for doc in docs]
+        posts.sort(key=_sort_key, reverse=True)
+        with self._lock:
+            self._posts = posts
+            self._post_ids = frozenset(post['id'] for post in posts)
+            self._read_time = _to_datetime(read_time)
+            self._pending_until = 0
+            self.snapshot_count += 1
+            self._snapshot_arrived.notify_all()
+
+    def _supervise(self):
+        backoff = self._check_interval
+        while not self._stopped.wait(backoff):
+            with self._lock:
+                watch = self._watch
+            if watch is not None and getattr(watch, 'is_active', True):
+                backoff = self._check_interval
+                continue
+            # 切断されている間は古い内容を返さないようにする
+            with self._lock:
+                self._posts = None
+                self._post_ids = frozenset()
+            try:
+                print("Timeline listener is inactive. Reconnecting...")
+                self._subscribe()
+                self.reconnect_count += 1
+                backoff = self._check_interval
+            except Exception as e:
+                print(f"Error reconnecting timeline listener: {e}")
+                backoff = min(backoff * 2, self._max_backoff)
+
+
+def _sort_key(post):
+    return (post['created_at'], post['id'])
+
+def _to_datetime(timestamp):
+    """コミットやスナップショットの時刻 (datetime または protobuf の Timestamp) を datetime (UTC) に変換します。"""
+    if timestamp is None or isinstance(timestamp, datetime.datetime):
+        return timestamp
+    if hasattr(timestamp, 'ToDatetime'):
+        return timestamp.ToDatetime(tzinfo=datetime.timezone.utc)
+    return None
@@ -0,0 +1,50 @@
+# utils/image.py
+
+import io
+from PIL import Image, ImageOps, features
+
+# --- 画像バリアント設定 ---
+# 名前 -> 長辺の最大ピクセル数
+IMAGE_VARIANTS = {
+    'thumb': 320,    # タイムラインのカード用
+    'display': 1080, # アワードなど大きく表示する用
+}
+
+# WebPが使えない環境ではプログレッシブJPEGで保存する
+if features.check('webp'):
+    VARIANT_FORMAT, VARIANT_EXT, VARIANT_CONTENT_TYPE = 'WEBP', '.webp', 'image/webp'
+else:
+    VARIANT_FORMAT, VARIANT_EXT, VARIANT_CONTENT_TYPE = 'JPEG', '.jpg', 'image/jpeg'
+
+
+def _encode(img):
+    """画像をバリアント用の形式でエンコードします。EXIFなどのメタデータは含めません。"""
+    buf = io.BytesIO()
+    if VARIANT_FORMAT == 'WEBP':
+        img.save(buf, format='WEBP', quality=80, method=4)
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(buf, format='JPEG', quality=80, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def create_variants(data):
+    """元画像のバイト列から、リサイズ済みの各バリアントを生成します。
+
+    戻り値は {バリアント名: エンコード済みバイト列} の辞書です。
+    元画像より大きくなるような拡大は行いません。
+    """
+    with Image.open(io.BytesIO(data)) as src:
+        # EXIFの回転情報を画素に反映してから、メタデータを持たない新しい画像にする
+        img = ImageOps.exif_transpose(src)
+        img.info.clear()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+        variants = {}
+        for name, max_size in IMAGE_VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail((max_size, max_size), Image.LANCZOS)
+            variants[name] = _encode(resized)
+        return variants
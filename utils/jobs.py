@@ -0,0 +1,75 @@
+# utils/jobs.py
+# 時間のかかる管理操作(ユーザーの一括削除など)をバックグラウンドのスレッドで実行し、進捗を保持する。
+# ジョブはプロセス内に保持するため、Streamlitの再実行やページの移動をまたいで進捗を確認できる。
+
+import datetime
+import threading
+import uuid
+from collections import deque
+from utils import metrics
+
+JOB_HISTORY = 20 # 保持するジョブの件数
+
+_lock = threading.Lock()
+_jobs = deque(maxlen=JOB_HISTORY)
+
+
+class Job:
+    """バックグラウンドジョブの状態。"""
+
+    def __init__(self, title, total):
+        self.id = uuid.uuid4().hex[:8]
+        self.title = title
+        self.total = total
+        self.done = 0
+        self.status = 'running' # 'running' / 'done' / 'failed'
+        self.errors = [] # 個々の処理の失敗メッセージ
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.finished_at = None
+
+    @property
+    def progress(self):
+        """進捗を 0.0〜1.0 で返します。"""
+        return self.done / self.total if self.total else 1.0
+
+    def advance(self, count=1, error=None):
+        """処理済みの件数を進めます。error には失敗した場合のメッセージを渡します。"""
+        with _lock:
+            self.done += count
+            if error:
+                self.errors.append(error)
+
+
+def start(title, total, func, *args):
+    """func(job, *args) をバックグラウンドで実行するジョブを開始し、Job を返します。"""
+    job = Job(title, total)
+    with _lock:
+        _jobs.appendleft(job)
+    # 計測が開始した画面の再実行に割り当てられるよう、コンテキストを引き継ぐ
+    context = metrics.current_context()
+    threading.Thread(
+        target=context.run, args=(_run, job, func, args), name=f"job-{job.id}", daemon=True
+    ).start()
+    return job
+
+def _run(job, func, args):
+    try:
+        func(job, *args)
+        status = 'done'
+    except Exception as e:
+        print(f"Job {job.title} failed: {e}")
+        job.errors.append(str(e))
+        status = 'failed'
+    with _lock:
+        job.status = status
+        job.finished_at = datetime.datetime.now(datetime.timezone.utc)
+
+def list_jobs():
+    """ジョブを新しい順に返します。"""
+    with _lock:
+        return list(_jobs)
+
+def has_running():
+    """実行中のジョブがあるかを返します。"""
+    with _lock:
+        return any(job.status == 'running' for job in _jobs)
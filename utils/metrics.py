@@ -0,0 +1,208 @@
+# utils/metrics.py
+# データアクセスの計測。utils/db.py の各関数の呼び出し回数・読み書きしたドキュメント数・処理時間を、
+# 表示中のページと再実行(rerun)ごとに集計し、管理者ダッシュボードに表示する。
+#
+# 使い方:
+#   - app.py は再実行の最初に start_rerun(ページ名) を、最後に end_rerun() を呼ぶ
+#   - プロセスごとに1回だけ行う初期化の所要時間は record_startup() で記録する
+#   - utils/db.py の公開関数は @instrument で包む
+#   - ストレージエンジンは実際に読み書きした件数を add_reads() / add_writes() で報告する
+
+import contextvars
+import datetime
+import functools
+import threading
+import time
+from collections import deque
+
+SAMPLE_SIZE = 1000 # 関数ごとに保持する処理時間のサンプル数 (パーセンタイルの計算に使う)
+RERUN_HISTORY = 200 # 保持する再実行の履歴数
+
+_lock = threading.Lock()
+_function_stats = {} # (ページ, 関数名) -> _FunctionStats
+_reruns = deque(maxlen=RERUN_HISTORY)
+_startup = {} # 初期化の手順名 -> 所要時間(ms)
+
+# 現在の再実行と、実行中の計測対象の呼び出し
+_current_rerun = contextvars.ContextVar('lunch_sns_rerun', default=None)
+_current_call = contextvars.ContextVar('lunch_sns_call', default=None)
+
+
+class _FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.reads = 0
+        self.writes = 0
+        self.total_ms = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+
+class _Rerun:
+    def __init__(self, page, started):
+        self.page = page
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = started
+        self.script_ms = None # スクリプト全体の所要時間 (st.rerun() などで中断された場合は None)
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.db_ms = 0.0
+
+
+class _Call:
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+
+def start_rerun(page, started=None):
+    """再実行の開始を記録し、以降の計測をこのページに割り当てます。
+
+    started にはスクリプトの実行開始時刻 (time.perf_counter() の値) を渡せます。
+    """
+    rerun = _Rerun(page, time.perf_counter() if started is None else started)
+    _current_rerun.set(rerun)
+    with _lock:
+        _reruns.append(rerun)
+
+def end_rerun():
+    """再実行の終了を記録します。"""
+    rerun = _current_rerun.get()
+    if rerun is not None:
+        rerun.script_ms = (time.perf_counter() - rerun.started) * 1000
+
+def record_startup(step, elapsed_ms):
+    """プロセスの初期化の各手順にかかった時間を記録します。"""
+    with _lock:
+        _startup[step] = elapsed_ms
+
+def get_startup_timings():
+    """初期化の各手順にかかった時間(ms)を返します。"""
+    with _lock:
+        return dict(_startup)
+
+def current_context():
+    """スレッドプールなど別スレッドで計測を引き継ぐためのコンテキストを返します。"""
+    return contextvars.copy_context()
+
+def add_reads(count=1):
+    """実行中の関数が読み取ったドキュメント数を加算します。"""
+    call = _current_call.get()
+    if call is not None:
+        call.reads += count
+
+def add_writes(count=1):
+    """実行中の関数が書き込んだドキュメント数を加算します。"""
+    call = _current_call.get()
+    if call is not None:
+        call.writes += count
+
+def instrument(func):
+    """関数の呼び出しを計測するデコレータ。
+
+    入れ子の呼び出し(delete_user の中の delete_post など)も関数ごとに記録しますが、
+    読み書きの件数は二重に数えないよう、最も外側の呼び出しにのみ計上します。
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = _current_call.get()
+        call = outer or _Call()
+        token = _current_call.set(call) if outer is None else None
+        start = time.perf_counter()
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if token is not None:
+                _current_call.reset(token)
+            _record(name, elapsed_ms, failed, call if outer is None else None)
+    return wrapper
+
+def _record(name, elapsed_ms, failed, call):
+    rerun = _current_rerun.get()
+    page = rerun.page if rerun else None
+    reads = call.reads if call else 0
+    writes = call.writes if call else 0
+    with _lock:
+        stats = _function_stats.get((page, name))
+        if stats is None:
+            stats = _function_stats[(page, name)] = _FunctionStats()
+        stats.calls += 1
+        stats.errors += int(failed)
+        stats.reads += reads
+        stats.writes += writes
+        stats.total_ms += elapsed_ms
+        stats.samples.append(elapsed_ms)
+        if rerun is not None:
+            rerun.calls += 1
+            rerun.reads += reads
+            rerun.writes += writes
+            if call is not None:
+                rerun.db_ms += elapsed_ms
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def get_function_stats():
+    """(ページ, 関数) ごとの集計を、読み取り件数の多い順に返します。"""
+    with _lock:
+        items = [(key, stats, sorted(stats.samples)) for key, stats in _function_stats.items()]
+    rows = []
+    for (page, name), stats, samples in items:
+        rows.append({
+            'page': page or '(ページ外)',
+            'function': name,
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'reads': stats.reads,
+            'writes': stats.writes,
+            'reads_per_call': stats.reads / stats.calls if stats.calls else 0.0,
+            'avg_ms': stats.total_ms / stats.calls if stats.calls else 0.0,
+            'p50_ms': _percentile(samples, 0.50),
+            'p95_ms': _percentile(samples, 0.95),
+            'p99_ms': _percentile(samples, 0.99),
+        })
+    rows.sort(key=lambda row: (row['reads'], row['calls']), reverse=True)
+    return rows
+
+def get_recent_reruns():
+    """直近の再実行ごとの集計を新しい順に返します。"""
+    with _lock:
+        reruns = list(_reruns)
+    return [
+        {
+            'started_at': rerun.started_at.isoformat(),
+            'page': rerun.page,
+            'calls': rerun.calls,
+            'reads': rerun.reads,
+            'writes': rerun.writes,
+            'db_ms': rerun.db_ms,
+            'script_ms': rerun.script_ms,
+        }
+        for rerun in reversed(reruns)
+    ]
+
+def snapshot():
+    """計測結果をJSONに変換できる辞書で返します。"""
+    return {
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'startup': get_startup_timings(),
+        'functions': get_function_stats(),
+        'reruns': get_recent_reruns(),
+    }
+
+def reset():
+    """計測結果をすべて消去します (初期化の所要時間は残します)。"""
+    with _lock:
+        _function_stats.clear()
+        _reruns.clear()
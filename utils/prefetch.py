@@ -0,0 +1,91 @@
+# utils/prefetch.py
+# 画面の描画前に、必要なデータ(アワード・投稿・いいね状態・画像URL)を並行して取得する。
+# それぞれの取得は互いに独立した往復なので、順番に待つと画面の表示時間はその合計になる。
+# プロセス全体で共有するスレッドプールで同時に発行し、表示時間を最も遅い取得に近づける。
+#
+# 環境変数:
+#   LUNCH_SNS_FETCH_CONCURRENCY   同時に実行する取得の上限 (既定: 8、全セッションの合計)
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils import db, metrics, uploads
+
+FETCH_CONCURRENCY = int(os.environ.get('LUNCH_SNS_FETCH_CONCURRENCY', '8'))
+_executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='prefetch')
+
+
+class TimelineData:
+    """タイムラインの描画に必要なデータ。"""
+
+    def __init__(self, award_post, award_image_url, posts, next_cursor, liked_post_ids, image_urls):
+        self.award_post = award_post # 今日のランチアワードの投稿 (無い場合は None)
+        self.award_image_url = award_image_url
+        self.posts = posts # 新しい順の投稿
+        self.next_cursor = next_cursor # 続きのページのカーソル (無い場合は None)
+        self.liked_post_ids = liked_post_ids # ログインユーザーがいいね済みの投稿ID
+        self.image_urls = image_urls # 投稿ID -> サムネイルのURL、画像プロキシ有効時はバイト列 (取得に失敗した投稿は含まない)
+
+
+def _submit(func, *args):
+    # 計測が呼び出し元の再実行・ページに割り当てられるよう、コンテキストを引き継ぐ
+    return _executor.submit(metrics.current_context().run, func, *args)
+
+def _image_url(post, variant):
+    """投稿の画像URL (画像プロキシ有効時はバイト列) を返します。
+
+    画像がまだ無い(処理中・失敗)場合や取得に失敗した場合は None です。
+    """
+    if uploads.image_status(post) != 'ready':
+        return None
+    variants = post.get('image_variants') or {}
+    try:
+        return db.get_image_source(variants.get(variant) or post['image_path'])
+    except Exception as e:
+        print(f"Error loading image: {e}")
+        return None
+
+def _award():
+    award_post = db.get_lunch_award()
+    if award_post is None:
+        return None, None
+    return award_post, _image_url(award_post, 'display')
+
+def load_timeline(user_id, page_count, page_size, query='', exact_shop=False):
+    """タイムラインの先頭 page_count ページ分のデータを並行して取得します。
+
+    user_id にはログインユーザーのIDを渡します (未ログインの場合は None)。
+    query を指定した場合は、投稿の代わりに検索結果を取得します (引数は db.search_posts() と同じ)。
+    """
+    award_future = _submit(_award)
+
+    # ページはカーソルで順に辿る必要があるため、アワードの取得と並行してこのスレッドで取得する
+    posts = []
+    cursor = None
+    for _ in range(page_count):
+        if query:
+            page_posts, cursor = db.search_posts(query, page_size, start_after=cursor, exact_shop=exact_shop)
+        else:
+            page_posts, cursor = db.get_posts_page(page_size, start_after=cursor)
+        posts.extend(page_posts)
+        if cursor is None:
+            break
+
+    liked_future = None
+    if user_id is not None and posts:
+        liked_future = _submit(db.get_liked_post_ids, user_id, [post['id'] for post in posts])
+    url_futures = {post['id']: _submit(_image_url, post, 'thumb') for post in posts}
+
+    award_post, award_image_url = award_future.result()
+    image_urls = {}
+    for post_id, future in url_futures.items():
+        url = future.result()
+        if url is not None:
+            image_urls[post_id] = url
+    return TimelineData(
+        award_post=award_post,
+        award_image_url=award_image_url,
+        posts=posts,
+        next_cursor=cursor,
+        liked_post_ids=liked_future.result() if liked_future else set(),
+        image_urls=image_urls,
+    )
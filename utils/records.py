@@ -0,0 +1,82 @@
+# utils/records.py
+# 投稿の一覧 (タイムライン・検索結果・自分の投稿) で返す、コンパクトな投稿のレコード。
+#
+# Firestoreのドキュメントや SQLite の行をそのまま辞書にすると、一覧で使わないフィールドも含めて
+# 投稿ごとに大きな辞書ができ、同じ投稿でもクエリの結果ごとに別の辞書になる。
+# ここでは一覧で表示するフィールドだけを __slots__ に持つ読み取り専用のレコードにし、
+# 同じ内容のレコードは投稿IDごとに1つだけ作って、キャッシュした各クエリの結果・各セッションで共有する。
+
+import sys
+import threading
+import weakref
+
+# 一覧で表示するフィールド (各ストレージエンジンはこのフィールドだけを読み込む)
+POST_LIST_FIELDS = (
+    'user_id', 'nickname', 'comment', 'image_path', 'image_variants',
+    'shop_name', 'price', 'like_count', 'status', 'created_at',
+)
+_INTERNED_FIELDS = ('user_id', 'nickname', 'shop_name') # 多くの投稿で同じ値になる文字列
+_FIELDS = frozenset(('id',) + POST_LIST_FIELDS)
+
+
+class PostRecord:
+    """一覧用の投稿。辞書と同じく post['comment'] や post.get('shop_name') で読み取れます。
+
+    全セッションで共有するため変更できません。image_variants の辞書も変更しないでください。
+    """
+
+    __slots__ = ('id',) + POST_LIST_FIELDS + ('__weakref__',)
+
+    def __init__(self, post_id, data):
+        set_field = object.__setattr__
+        set_field(self, 'id', post_id)
+        for field in POST_LIST_FIELDS:
+            value = data.get(field)
+            if field in _INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            set_field(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PostRecord is read-only")
+
+    def __getitem__(self, field):
+        if field not in _FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __contains__(self, field):
+        return field in _FIELDS
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in _FIELDS else default
+
+    def to_dict(self):
+        """辞書に変換します (変更したい場合に使います)。"""
+        return {field: getattr(self, field) for field in self.__slots__[:-1]}
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in POST_LIST_FIELDS)
+
+    def __repr__(self):
+        return f"PostRecord(id={self.id!r}, created_at={self.created_at!r})"
+
+
+_records = weakref.WeakValueDictionary() # 投稿ID -> 最新のレコード (どこからも参照されなくなると消える)
+_lock = threading.Lock()
+
+def post_record(post_id, data):
+    """投稿のレコードを返します。同じ内容のレコードが既にあればそれを返します。
+
+    data は投稿のフィールドの辞書で、POST_LIST_FIELDS 以外のフィールドは無視します。
+    """
+    record = PostRecord(post_id, data)
+    with _lock:
+        current = _records.get(post_id)
+        if current is not None and current._values() == record._values():
+            return current
+        _records[post_id] = record
+    return record
+
+def record_count():
+    """共有しているレコードの数を返します (計測用)。"""
+    return len(_records)
@@ -0,0 +1,67 @@
+# utils/search.py
+# 投稿の検索に使う語(索引の語)を作る。両方のストレージエンジンで共通に使う。
+#
+# 日本語は単語の区切りが無いため、店舗名とコメントを文字の n-gram (1文字と2文字) に分けて索引にする。
+# 検索語も同じように2文字ずつに分け、すべての語を含む投稿を候補とする。語の集合だけでは、検索語が
+# 離れた位置の2文字ずつ(「さくさく…くらげ」が「さくら」に一致する)や店舗名とコメントにまたがって現れる投稿も
+# 候補になるため、候補は検索語の各語が店舗名かコメントに続けて現れるか (matches_phrases) で絞り込む。
+# 表記の揺れを吸収するため、NFKC正規化(全角英数・半角カナの統一)、大文字小文字の統一、カタカナのひらがな化を行う。
+# 店舗名は候補の表示と完全一致の検索用に、空白を除いた正規化済みの名前(店舗キー)も索引に加える。
+
+import re
+import unicodedata
+
+MAX_INDEXED_CHARS = 400 # コメントのうち索引にする文字数 (長文で索引が肥大化しないように)
+SHOP_TERM_PREFIX = 'shop:' # 店舗キーの語の接頭辞 (n-gram の語と区別する)
+
+_SEGMENT = re.compile(r'\w+') # 記号や空白で区切った語の単位 (漢字・かな・英数字の並び)
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize(text):
+    """表記の揺れを吸収するため、文字列を正規化します。"""
+    return unicodedata.normalize('NFKC', text or '').casefold().translate(_KATAKANA_TO_HIRAGANA)
+
+def shop_key(shop_name):
+    """店舗名を、集計・候補表示のキー(正規化して空白を除いた名前)に変換します。店舗名が無い場合は '' です。"""
+    return ''.join(normalize(shop_name).split())
+
+def shop_term(shop_name):
+    """店舗名が完全に一致する投稿を探すための語を返します。店舗名が無い場合は None です。"""
+    key = shop_key(shop_name)
+    return SHOP_TERM_PREFIX + key if key else None
+
+def _segments(text):
+    return _SEGMENT.findall(normalize(text))
+
+def index_terms(comment, shop_name):
+    """投稿の索引に登録する語を、重複を除いて並べ替えたリストで返します。"""
+    terms = set()
+    for text in (shop_name, (comment or '')[:MAX_INDEXED_CHARS]):
+        for segment in _segments(text):
+            terms.update(segment) # 1文字の検索用
+            terms.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    term = shop_term(shop_name)
+    if term:
+        terms.add(term)
+    return sorted(terms)
+
+def query_terms(query):
+    """検索語から、投稿が含むべき語のリストを返します。検索できる文字が無い場合は空のリストです。"""
+    terms = set()
+    for segment in _segments(query):
+        if len(segment) == 1:
+            terms.add(segment)
+        else:
+            terms.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return sorted(terms)
+
+def query_phrases(query):
+    """検索語を、店舗名かコメントに続けて現れるべき語 (記号や空白で区切った単位) のタプルで返します。"""
+    return tuple(_segments(query))
+
+def matches_phrases(post, phrases):
+    """投稿の店舗名またはコメントに、phrases の語がそれぞれ続けて現れるかを返します。"""
+    shop_name = normalize(post.get('shop_name'))
+    comment = normalize(post.get('comment'))
+    return all(phrase in shop_name or phrase in comment for phrase in phrases)
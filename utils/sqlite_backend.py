@@ -0,0 +1,762 @@
+# utils/sqlite_backend.py
+# SQLite + ローカルファイルシステムを使うストレージエンジン。
+# Firebaseの認証情報なしで動かせるため、1台構成での運用やローカルでの検証・計測に使う。
+# アプリからは utils/db.py 経由で使う (キャッシュや無効化は db.py 側で行う)。
+#
+# 環境変数:
+#   LUNCH_SNS_SQLITE_PATH   データベースファイルのパス (既定: lunch_sns.db)
+#   LUNCH_SNS_STORAGE_DIR   画像を保存するディレクトリ (既定: local_storage)
+
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from utils import metrics, search
+from utils.records import POST_LIST_FIELDS, post_record
+from utils.dates import jst_date_str, recent_date_strs
+
+SQLITE_PATH = os.environ.get('LUNCH_SNS_SQLITE_PATH', 'lunch_sns.db')
+STORAGE_DIR = Path(os.environ.get('LUNCH_SNS_STORAGE_DIR', 'local_storage'))
+
+LEADERBOARD_SIZE = 10
+SEARCH_SCAN_SIZE = 200 # 検索で索引を1回に読む件数の上限
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    nickname TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    session_version INTEGER NOT NULL DEFAULT 0,
+    post_count INTEGER NOT NULL DEFAULT 0,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    created_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+CREATE INDEX IF NOT EXISTS idx_users_created_date ON users (created_date);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    nickname TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    image_path TEXT,
+    image_variants TEXT NOT NULL DEFAULT '{}',
+    shop_name TEXT,
+    shop_key TEXT,
+    price INTEGER,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'ready',
+    image_key TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    created_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_user ON posts (user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_date_likes ON posts (created_date, like_count DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_likes ON posts (like_count DESC);
+
+CREATE TABLE IF NOT EXISTS likes (
+    user_id TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    created_date TEXT NOT NULL,
+    PRIMARY KEY (user_id, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_likes_post ON likes (post_id);
+CREATE INDEX IF NOT EXISTS idx_likes_created_date ON likes (created_date);
+
+CREATE TABLE IF NOT EXISTS image_refs (
+    image_key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    image_path TEXT NOT NULL,
+    image_variants TEXT
+);
+
+-- 検索の索引 (utils.search の語ごとに、語を含む投稿を新しい順に引けるようにする)
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    PRIMARY KEY (term, created_at, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_terms_post ON search_terms (post_id);
+
+-- 店舗ごとの集計 (店舗名の候補とお店ランキングに使う)。key は utils.search.shop_key() で正規化した店舗名
+CREATE TABLE IF NOT EXISTS shops (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    post_count INTEGER NOT NULL DEFAULT 0,
+    like_total INTEGER NOT NULL DEFAULT 0,
+    price_count INTEGER NOT NULL DEFAULT 0,
+    price_sum INTEGER NOT NULL DEFAULT 0,
+    price_min INTEGER,
+    price_max INTEGER,
+    last_visited_at TEXT
+);
+"""
+
+# スキーマに後から追加した列 (テーブル, 列, 定義)
+ADDED_COLUMNS = [
+    ('users', 'session_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'post_count', 'INTEGER NOT NULL DEFAULT 0'), # ユーザー管理画面の投稿数
+    ('users', 'like_count', 'INTEGER NOT NULL DEFAULT 0'), # ユーザー管理画面の付けたいいね数
+    ('posts', 'status', "TEXT NOT NULL DEFAULT 'ready'"),
+    ('posts', 'image_key', 'TEXT'),
+    ('posts', 'updated_at', 'TEXT'), # 差分エクスポート用の最終更新日時 (投稿を書き換えるたびに更新する)
+    ('posts', 'shop_key', 'TEXT'), # 店舗ごとの集計のキー
+    ('shops', 'like_total', 'INTEGER NOT NULL DEFAULT 0'),
+    ('shops', 'price_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('shops', 'price_sum', 'INTEGER NOT NULL DEFAULT 0'),
+    ('shops', 'price_min', 'INTEGER'),
+    ('shops', 'price_max', 'INTEGER'),
+    ('shops', 'last_visited_at', 'TEXT'),
+]
+
+# --- 初期化 ---
+# sqlite3の接続はスレッドをまたいで使えないため、スレッドごとに接続を持つ
+_local = threading.local()
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    return conn
+
+@contextlib.contextmanager
+def _transaction():
+    """書き込み用のトランザクション。変更した行数を計測に加えます。"""
+    conn = _connect()
+    before = conn.total_changes
+    with conn:
+        yield conn
+    metrics.add_writes(conn.total_changes - before)
+
+def initialize():
+    """データベースのテーブルと画像保存用ディレクトリを作成します。"""
+    STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = _connect()
+    has_search_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_terms'"
+    ).fetchone() is not None
+    conn.executescript(SCHEMA)
+    # 列を追加する前に作られたデータベースを移行する
+    added = set()
+    for table, column, definition in ADDED_COLUMNS:
+        columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            conn.commit()
+            added.add((table, column))
+    # 追加した列の索引は移行の後に作る
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_updated ON posts (updated_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_posts_shop ON posts (shop_key, created_at)')
+    conn.commit()
+    # 検索の索引・店舗ごとの集計を追加する前に作られたデータベースは、既存の投稿から作る
+    if not has_search_index or ('posts', 'shop_key') in added:
+        posts = conn.execute('SELECT id, comment, shop_name, created_at FROM posts').fetchall()
+        with _transaction() as conn:
+            for post in posts:
+                conn.execute('UPDATE posts SET shop_key = ? WHERE id = ?',
+                             (search.shop_key(post['shop_name']) or None, post['id']))
+                _index_post(conn, post['id'], post['comment'], post['shop_name'], post['created_at'])
+            _rebuild_shops(conn)
+    # ユーザーごとの投稿数・いいね数を追加する前に作られたデータベースは、既存の投稿といいねから数える
+    if ('users', 'like_count') in added:
+        with _transaction() as conn:
+            conn.execute(
+                'UPDATE users SET post_count = (SELECT COUNT(*) FROM posts WHERE posts.user_id = users.id),'
+                ' like_count = (SELECT COUNT(*) FROM likes WHERE likes.user_id = users.id)'
+            )
+    print(f"SQLite initialized. Using database: {SQLITE_PATH}, storage: {STORAGE_DIR}")
+
+# --- Helper Functions ---
+def _now():
+    """現在時刻(UTC)を返します。"""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _format_ts(dt):
+    # 文字列の大小と時刻の前後が一致するよう、常に同じ桁数で保存する
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+def _new_id():
+    return uuid.uuid4().hex
+
+def _row_to_dict(row):
+    """行を辞書に変換し、日時やJSONの列をFirestore版と同じ型に戻します。"""
+    if row is None:
+        return None
+    metrics.add_reads()
+    data = dict(row)
+    data.pop('created_date', None)
+    for field in ('created_at', 'updated_at', 'last_visited_at'):
+        if data.get(field):
+            data[field] = datetime.datetime.fromisoformat(data[field])
+    if 'image_variants' in data:
+        data['image_variants'] = json.loads(data['image_variants'] or '{}')
+    return data
+
+# 投稿の一覧は表示する列 (utils.records.POST_LIST_FIELDS) だけを読み込み、一覧用の共有レコードで返す
+_POST_LIST_COLUMNS = ', '.join(('id',) + POST_LIST_FIELDS)
+
+def _row_to_record(row):
+    """投稿の行 (_POST_LIST_COLUMNS) を一覧用のレコード (utils.records.PostRecord) に変換します。"""
+    metrics.add_reads()
+    data = dict(row)
+    data['created_at'] = datetime.datetime.fromisoformat(data['created_at'])
+    data['image_variants'] = json.loads(data['image_variants'] or '{}')
+    return post_record(data['id'], data)
+
+# --- Blob Storage ---
+def _blob_file(path):
+    return STORAGE_DIR / path
+
+def upload_blob(path, data, content_type, cache_control=None):
+    """バイト列をローカルのファイルとして保存します (content_type と cache_control は使わない)。"""
+    file_path = _blob_file(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(data)
+
+def delete_blob(path):
+    """ローカルのファイルを削除します。存在しない場合は何もしません。"""
+    _blob_file(path).unlink(missing_ok=True)
+
+def download_blob(path):
+    """ローカルのファイルをバイト列で取得します。"""
+    return _blob_file(path).read_bytes()
+
+def get_blob_url(path, expiration):
+    """ファイルのパスを返します (st.image はローカルのパスをそのまま表示できる)。"""
+    file_path = _blob_file(path)
+    if not file_path.exists():
+        raise FileNotFoundError(path)
+    return str(file_path)
+
+# --- 画像の参照カウント ---
+# 画像は内容のハッシュをキーにして保存し、同じ画像を使う投稿が何件あるかを image_refs で数える。
+def get_image_ref(image_key):
+    """画像の参照カウントを取得します。無い場合は None です。"""
+    row = _connect().execute('SELECT * FROM image_refs WHERE image_key = ?', (image_key,)).fetchone()
+    if row is None:
+        return None
+    metrics.add_reads()
+    data = dict(row)
+    # image_variants はアップロードが終わるまで None のままにする
+    if data['image_variants'] is not None:
+        data['image_variants'] = json.loads(data['image_variants'])
+    return data
+
+def complete_image_ref(image_key, image_variants):
+    """画像のアップロードが終わったことを記録します。参照が無くなっていた場合は False を返します。"""
+    with _transaction() as conn:
+        cur = conn.execute(
+            'UPDATE image_refs SET image_variants = ? WHERE image_key = ?', (json.dumps(image_variants), image_key)
+        )
+    return cur.rowcount > 0
+
+def release_image_refs(counts):
+    """画像の参照カウントを減らします。
+
+    counts は {画像キー: 減らす数} です。参照する投稿が無くなった画像を {画像キー: パスのリスト} で返します
+    (削除は呼び出し側で行う)。
+    """
+    released = {}
+    with _transaction() as conn:
+        for image_key, count in counts.items():
+            row = conn.execute('SELECT * FROM image_refs WHERE image_key = ?', (image_key,)).fetchone()
+            if row is None:
+                continue
+            metrics.add_reads()
+            if row['count'] > count:
+                conn.execute('UPDATE image_refs SET count = count - ? WHERE image_key = ?', (count, image_key))
+                continue
+            conn.execute('DELETE FROM image_refs WHERE image_key = ?', (image_key,))
+            image_paths = [row['image_path']] + list(json.loads(row['image_variants'] or '{}').values())
+            released[image_key] = [path for path in image_paths if path]
+    return released
+
+# --- User Functions ---
+def create_user(nickname, password_hash):
+    """新規ユーザーを作成します。ニックネームの重複はUNIQUE制約で防ぎます。"""
+    now = _now()
+    try:
+        with _transaction() as conn:
+            conn.execute(
+                'INSERT INTO users (id, nickname, password_hash, created_at, created_date) VALUES (?, ?, ?, ?, ?)',
+                (_new_id(), nickname, password_hash, _format_ts(now), jst_date_str(now))
+            )
+    except sqlite3.IntegrityError:
+        return False # ニックネームが既に存在
+    return True
+
+def get_user(nickname):
+    """ニックネームでユーザーを取得します。"""
+    row = _connect().execute('SELECT * FROM users WHERE nickname = ?', (nickname,)).fetchone()
+    return _row_to_dict(row)
+
+def get_user_by_id(user_id):
+    """IDでユーザーを取得します。"""
+    row = _connect().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return _row_to_dict(row)
+
+# --- Post Functions ---
+def create_post(user_id, nickname, comment, image_path, shop_name, price, image_variants=None, status='ready',
+                image_key=None):
+    """新規投稿を作成し、投稿IDを返します。
+
+    image_key (画像の内容のハッシュ) を指定すると、同じトランザクションで画像の参照カウントを増やします。
+    """
+    now = _now()
+    post_id = _new_id()
+    shop_key = search.shop_key(shop_name)
+    with _transaction() as conn:
+        conn.execute(
+            'INSERT INTO posts (id, user_id, nickname, comment, image_path, image_variants, shop_name, shop_key, price, like_count, status, image_key, created_at, updated_at, created_date)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?)',
+            (post_id, user_id, nickname, comment, image_path, json.dumps(image_variants or {}),
+             shop_name, shop_key or None, price, status, image_key, _format_ts(now), _format_ts(now), jst_date_str(now))
+        )
+        if image_key:
+            conn.execute(
+                'INSERT INTO image_refs (image_key, count, image_path) VALUES (?, 1, ?)'
+                ' ON CONFLICT (image_key) DO UPDATE SET count = count + 1', (image_key, image_path)
+            )
+        _index_post(conn, post_id, comment, shop_name, _format_ts(now))
+        _refresh_shop(conn, shop_key, name=shop_name)
+        conn.execute('UPDATE users SET post_count = post_count + 1 WHERE id = ?', (user_id,))
+    return post_id
+
+def get_live_posts():
+    """スナップショットリスナーが無いため、常に None を返します (db.py はクエリで読む)。"""
+    return None
+
+def get_live_posts_page(page_size=20, start_after=None):
+    """スナップショットリスナーが無いため、常に None を返します (db.py はクエリで読む)。"""
+    return None
+
+def get_all_posts():
+    """全ての投稿を取得します。"""
+    rows = _connect().execute(f'SELECT {_POST_LIST_COLUMNS} FROM posts ORDER BY created_at DESC, id DESC').fetchall()
+    return [_row_to_record(row) for row in rows]
+
+def get_posts_page(page_size=20, start_after=None):
+    """投稿を新しい順に1ページ分取得します。
+
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    conn = _connect()
+    # 1件多く取得して次ページの有無を判定する
+    if start_after:
+        created_at, post_id = start_after
+        rows = conn.execute(
+            f'SELECT {_POST_LIST_COLUMNS} FROM posts WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?',
+            (_format_ts(created_at), post_id, page_size + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f'SELECT {_POST_LIST_COLUMNS} FROM posts ORDER BY created_at DESC, id DESC LIMIT ?', (page_size + 1,)
+        ).fetchall()
+    posts = [_row_to_record(row) for row in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size and posts:
+        last = posts[-1]
+        next_cursor = (last['created_at'], last['id'])
+    return posts, next_cursor
+
+# --- 検索 ---
+# search_terms に投稿ごとの語 (utils.search.index_terms) を、投稿の作成・更新・削除と同じトランザクションで書き込む。
+def _index_post(conn, post_id, comment, shop_name, created_at):
+    """投稿の検索の索引を作り直します。created_at は保存形式の文字列で渡します。"""
+    conn.execute('DELETE FROM search_terms WHERE post_id = ?', (post_id,))
+    conn.executemany(
+        'INSERT INTO search_terms (term, created_at, post_id) VALUES (?, ?, ?)',
+        [(term, created_at, post_id) for term in search.index_terms(comment, shop_name)]
+    )
+
+
+def search_posts(terms, page_size=20, start_after=None, phrases=()):
+    """terms の語をすべて含み、phrases の語がそれぞれ店舗名かコメントに続けて現れる投稿を新しい順に1ページ分取得します。
+
+    start_after には前ページの末尾カーソル (created_at, 投稿ID) を渡します。
+    戻り値は (投稿のリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    """
+    conn = _connect()
+    # 含む投稿の最も少ない語で索引を引き、残りの語は主キーで存在を確かめる
+    counts = dict(conn.execute(
+        f'SELECT term, COUNT(*) FROM search_terms WHERE term IN ({", ".join("?" * len(terms))}) GROUP BY term',
+        terms
+    ).fetchall())
+    if len(counts) < len(set(terms)):
+        return [], None
+    driver = min(terms, key=counts.get)
+    columns = ', '.join(f'posts.{column}' for column in ('id',) + POST_LIST_FIELDS)
+    sql = f'SELECT {columns} FROM search_terms AS t JOIN posts ON posts.id = t.post_id WHERE t.term = ?'
+    params = [driver]
+    for term in terms:
+        if term != driver:
+            sql += ' AND EXISTS (SELECT 1 FROM search_terms WHERE term = ? AND created_at = t.created_at AND post_id = t.post_id)'
+            params.append(term)
+    # 1件多く見つかるまで読み進めて次ページの有無を判定する。
+    # 語の集合が一致しても検索語が続けて現れない投稿は除くため、足りない場合は続きを読む
+    posts = []
+    cursor = (_format_ts(start_after[0]), start_after[1]) if start_after else None
+    scan_size = page_size + 1
+    while len(posts) <= page_size:
+        page_sql, page_params = sql, list(params)
+        if cursor:
+            page_sql += ' AND (t.created_at, t.post_id) < (?, ?)'
+            page_params += cursor
+        page_sql += ' ORDER BY t.created_at DESC, t.post_id DESC LIMIT ?'
+        rows = conn.execute(page_sql, page_params + [scan_size]).fetchall()
+        for row in rows:
+            post = _row_to_record(row)
+            if search.matches_phrases(post, phrases):
+                posts.append(post)
+        if len(rows) < scan_size:
+            break
+        cursor = (rows[-1]['created_at'], rows[-1]['id'])
+        scan_size = min(scan_size * 2, SEARCH_SCAN_SIZE)
+    page = posts[:page_size]
+    next_cursor = (page[-1]['created_at'], page[-1]['id']) if len(posts) > page_size else None
+    return page, next_cursor
+
+# --- 店舗ごとの集計 ---
+# shops に店舗ごとの集計を保持し、店舗名の候補とお店ランキングはここから読む。
+# 投稿の作成・更新・削除では、同じトランザクションでその店舗の投稿だけを (shop_key の索引で) 集計し直す。
+# いいねは like_total だけを増減する。
+_SHOP_AGGREGATES = (
+    'COUNT(*), COALESCE(SUM(like_count), 0), COUNT(CASE WHEN price > 0 THEN 1 END),'
+    ' COALESCE(SUM(CASE WHEN price > 0 THEN price END), 0), MIN(CASE WHEN price > 0 THEN price END),'
+    ' MAX(CASE WHEN price > 0 THEN price END), MAX(created_at)'
+)
+_SHOP_COLUMNS = 'key, name, post_count, like_total, price_count, price_sum, price_min, price_max, last_visited_at'
+SHOP_RANKING_ORDERS = { # 並べ替えの種類 -> ORDER BY
+    'posts': 'post_count DESC',
+    'likes': 'like_total DESC',
+    'cheap': 'price_avg ASC',
+    'expensive': 'price_avg DESC',
+}
+
+def _refresh_shop(conn, key, name=None):
+    """店舗の集計を、その店舗の投稿から計算し直します。name を指定すると店舗名の表記を更新します。"""
+    if not key:
+        return
+    conn.execute(
+        f'INSERT INTO shops ({_SHOP_COLUMNS})'
+        f' SELECT ?, COALESCE(?, (SELECT name FROM shops WHERE key = ?), ?), {_SHOP_AGGREGATES} FROM posts WHERE shop_key = ?'
+        ' ON CONFLICT (key) DO UPDATE SET name = excluded.name, post_count = excluded.post_count,'
+        ' like_total = excluded.like_total, price_count = excluded.price_count, price_sum = excluded.price_sum,'
+        ' price_min = excluded.price_min, price_max = excluded.price_max, last_visited_at = excluded.last_visited_at',
+        (key, name or None, key, key, key)
+    )
+
+def _rebuild_shops(conn):
+    """すべての店舗の集計を投稿から作り直します。店舗名は最も新しい投稿の表記にします。"""
+    conn.execute('DELETE FROM shops')
+    conn.execute(
+        f'INSERT INTO shops ({_SHOP_COLUMNS})'
+        ' SELECT shop_key, (SELECT shop_name FROM posts AS latest WHERE latest.shop_key = posts.shop_key'
+        f' ORDER BY created_at DESC LIMIT 1), {_SHOP_AGGREGATES} FROM posts WHERE shop_key IS NOT NULL GROUP BY shop_key'
+    )
+
+def _add_shop_likes(conn, post_id, count):
+    conn.execute(
+        'UPDATE shops SET like_total = like_total + ? WHERE key = (SELECT shop_key FROM posts WHERE id = ?)',
+        (count, post_id)
+    )
+
+def suggest_shops(prefix, limit=10):
+    """店舗キーが prefix (正規化済み) で始まる店舗を、投稿数の多い順に返します。"""
+    rows = _connect().execute(
+        'SELECT * FROM shops WHERE key >= ? AND key < ? AND post_count > 0 ORDER BY post_count DESC, key LIMIT ?',
+        (prefix, prefix + '\uffff', limit)
+    ).fetchall()
+    return [_row_to_dict(row) for row in rows]
+
+def get_shop_ranking(sort='posts', limit=20, min_posts=1):
+    """店舗の集計をランキングの順に返します。
+
+    sort は 'posts' (投稿数順), 'likes' (いいね数順), 'cheap' / 'expensive' (平均価格の安い順 / 高い順) です。
+    投稿数が min_posts 未満の店舗と、平均価格で並べる場合は金額の入力が無い店舗を除きます。
+    """
+    where = 'post_count >= ?'
+    if sort in ('cheap', 'expensive'):
+        where += ' AND price_count > 0'
+    rows = _connect().execute(
+        'SELECT *, CAST(price_sum AS REAL) / NULLIF(price_count, 0) AS price_avg FROM shops'
+        f' WHERE {where} ORDER BY {SHOP_RANKING_ORDERS[sort]}, key LIMIT ?',
+        (max(min_posts, 1), limit)
+    ).fetchall()
+    return [_row_to_dict(row) for row in rows]
+
+def get_posts_by_user(user_id):
+    """特定のユーザーの投稿をすべて取得します。"""
+    rows = _connect().execute(
+        f'SELECT {_POST_LIST_COLUMNS} FROM posts WHERE user_id = ? ORDER BY created_at DESC', (user_id,)
+    ).fetchall()
+    return [_row_to_record(row) for row in rows]
+
+def update_post(post_id, comment, shop_name, price):
+    """投稿の内容を更新します。"""
+    with _transaction() as conn:
+        post = conn.execute('SELECT shop_name, created_at FROM posts WHERE id = ?', (post_id,)).fetchone()
+        if post is None:
+            return
+        metrics.add_reads()
+        old_key, new_key = search.shop_key(post['shop_name']), search.shop_key(shop_name)
+        conn.execute(
+            'UPDATE posts SET comment = ?, shop_name = ?, shop_key = ?, price = ?, updated_at = ? WHERE id = ?',
+            (comment, shop_name, new_key or None, price, _format_ts(_now()), post_id)
+        )
+        _index_post(conn, post_id, comment, shop_name, post['created_at'])
+        if old_key != new_key:
+            _refresh_shop(conn, old_key)
+        _refresh_shop(conn, new_key, name=shop_name)
+
+def update_post_image(post_id, status, image_variants=None):
+    """投稿の画像の状態を更新します。投稿が削除済みの場合は False を返します。"""
+    with _transaction() as conn:
+        if image_variants is None:
+            cur = conn.execute(
+                'UPDATE posts SET status = ?, updated_at = ? WHERE id = ?', (status, _format_ts(_now()), post_id)
+            )
+        else:
+            cur = conn.execute(
+                'UPDATE posts SET status = ?, image_variants = ?, updated_at = ? WHERE id = ?',
+                (status, json.dumps(image_variants), _format_ts(_now()), post_id)
+            )
+    return cur.rowcount > 0
+
+def delete_post(post_id):
+    """投稿と、投稿に紐づくいいねを削除します。
+
+    削除した投稿の内容を返します (画像の削除は呼び出し側で行う)。投稿が無い場合は None です。
+    """
+    with _transaction() as conn:
+        post = _row_to_dict(conn.execute('SELECT * FROM posts WHERE id = ?', (post_id,)).fetchone())
+        if post is None:
+            return None
+        conn.execute(
+            'UPDATE users SET like_count = like_count - 1 WHERE id IN (SELECT user_id FROM likes WHERE post_id = ?)',
+            (post_id,)
+        )
+        conn.execute('UPDATE users SET post_count = post_count - 1 WHERE id = ?', (post['user_id'],))
+        conn.execute('DELETE FROM likes WHERE post_id = ?', (post_id,))
+        conn.execute('DELETE FROM search_terms WHERE post_id = ?', (post_id,))
+        conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+        _refresh_shop(conn, search.shop_key(post['shop_name']))
+    return post
+
+# --- Like Functions ---
+# いいねの追加/削除と、投稿・ユーザーの like_count の増減は同じトランザクションで行う
+def check_like(user_id, post_id):
+    """ユーザーが既に投稿にいいねしているか確認します。"""
+    row = _connect().execute(
+        'SELECT 1 FROM likes WHERE user_id = ? AND post_id = ?', (user_id, post_id)
+    ).fetchone()
+    metrics.add_reads()
+    return row is not None
+
+def get_liked_post_ids(user_id, post_ids):
+    """指定した投稿のうち、ユーザーがいいね済みの投稿IDの集合を返します。"""
+    if not post_ids:
+        return set()
+    placeholders = ','.join('?' * len(post_ids))
+    rows = _connect().execute(
+        f'SELECT post_id FROM likes WHERE user_id = ? AND post_id IN ({placeholders})',
+        (user_id, *post_ids)
+    ).fetchall()
+    metrics.add_reads(len(rows))
+    return {row['post_id'] for row in rows}
+
+def add_like(user_id, post_id):
+    """投稿にいいねを追加し、投稿のいいね数をインクリメントします。"""
+    now = _now()
+    with _transaction() as conn:
+        # 投稿が存在し、まだいいねしていない場合のみ追加される
+        cur = conn.execute(
+            'INSERT OR IGNORE INTO likes (user_id, post_id, created_at, created_date)'
+            ' SELECT ?, id, ?, ? FROM posts WHERE id = ?',
+            (user_id, _format_ts(now), jst_date_str(now), post_id)
+        )
+        if cur.rowcount == 0:
+            return False
+        conn.execute('UPDATE posts SET like_count = like_count + 1, updated_at = ? WHERE id = ?', (_format_ts(now), post_id))
+        conn.execute('UPDATE users SET like_count = like_count + 1 WHERE id = ?', (user_id,))
+        _add_shop_likes(conn, post_id, 1)
+    return True
+
+def remove_like(user_id, post_id):
+    """投稿のいいねを解除し、投稿のいいね数をデクリメントします。"""
+    with _transaction() as conn:
+        cur = conn.execute('DELETE FROM likes WHERE user_id = ? AND post_id = ?', (user_id, post_id))
+        if cur.rowcount == 0:
+            return False
+        conn.execute(
+            'UPDATE posts SET like_count = like_count - 1, updated_at = ? WHERE id = ?', (_format_ts(_now()), post_id)
+        )
+        conn.execute('UPDATE users SET like_count = like_count - 1 WHERE id = ?', (user_id,))
+        _add_shop_likes(conn, post_id, -1)
+    return True
+
+# --- Award Function ---
+# (created_date, like_count) のインデックスがあるため、ランキングは都度のクエリで求める
+def get_leaderboard(date_str):
+    """指定日のいいねランキングを、いいね数の多い順の投稿リストで返します。"""
+    rows = _connect().execute(
+        f'SELECT {_POST_LIST_COLUMNS} FROM posts WHERE created_date = ? AND like_count > 0 ORDER BY like_count DESC LIMIT ?',
+        (date_str, LEADERBOARD_SIZE)
+    ).fetchall()
+    return [_row_to_record(row) for row in rows]
+
+def get_period_leaderboard(days=7, limit=3, end_date=None):
+    """直近 days 日間(週間・月間など)のいいねランキングを取得します。"""
+    date_strs = recent_date_strs(days, end_date)
+    rows = _connect().execute(
+        f'SELECT {_POST_LIST_COLUMNS} FROM posts WHERE created_date BETWEEN ? AND ? AND like_count > 0 ORDER BY like_count DESC LIMIT ?',
+        (date_strs[-1], date_strs[0], limit)
+    ).fetchall()
+    return [_row_to_record(row) for row in rows]
+
+# --- Admin Dashboard Functions ---
+def get_dashboard_stats():
+    """ダッシュボード用の統計情報を取得します。"""
+    conn = _connect()
+    stats = {}
+    stats['user_count'] = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    stats['post_count'] = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+    stats['like_count'] = conn.execute('SELECT COUNT(*) FROM likes').fetchone()[0]
+
+    # 日別の集計は created_date のインデックスを使ってSQL側で行う
+    daily = {}
+    def day(date_str):
+        return daily.setdefault(date_str, [0, 0, 0, 0])
+    for row in conn.execute('SELECT created_date, COUNT(*), COUNT(DISTINCT user_id) FROM posts GROUP BY created_date'):
+        day(row[0])[0] = row[1]
+        day(row[0])[3] = row[2]
+    for row in conn.execute('SELECT created_date, COUNT(*) FROM likes GROUP BY created_date'):
+        day(row[0])[1] = row[1]
+    for row in conn.execute('SELECT created_date, COUNT(*) FROM users GROUP BY created_date'):
+        day(row[0])[2] = row[1]
+    post_timeline_list = [(date_str, *counts) for date_str, counts in sorted(daily.items())]
+
+    # 人気投稿ランキング
+    rows = conn.execute('SELECT comment, nickname, like_count FROM posts ORDER BY like_count DESC LIMIT 10').fetchall()
+    popular_posts = [tuple(row) for row in rows]
+    metrics.add_reads(len(post_timeline_list) + len(popular_posts))
+
+    return stats, post_timeline_list, popular_posts
+
+# --- エクスポート ---
+# likes は (user_id, post_id) が主キーのため、Firestoreと同じ形のIDを組み立てる
+_EXPORT_ID_COLUMNS = {'posts': 'id', 'likes': "user_id || '_' || post_id", 'users': 'id'}
+
+def export_rows(collection, fields, changed_field, since=None):
+    """エクスポート用に、changed_field が since 以降の行を id と fields の列だけで返します。
+
+    since を省略した場合は全件を返します。日時の列は datetime に変換します。
+    """
+    columns = ', '.join([f"{_EXPORT_ID_COLUMNS[collection]} AS id", *fields])
+    if since is None:
+        rows = _connect().execute(f'SELECT {columns} FROM {collection}').fetchall()
+    else:
+        rows = _connect().execute(
+            f'SELECT {columns} FROM {collection} WHERE {changed_field} >= ?', (_format_ts(since),)
+        ).fetchall()
+    return [_row_to_dict(row) for row in rows]
+
+def get_users_page(page_size=50, start_after=None, nickname_prefix='', exclude_nickname=None):
+    """ユーザーを1ページ分取得します。exclude_nickname を指定した場合はそのユーザー (管理者) を除きます。
+
+    nickname_prefix を指定した場合はニックネームの前方一致で絞り込み、ニックネーム順に返します。
+    指定しない場合は登録日時の新しい順です。start_after には前ページの末尾カーソルを渡します。
+    戻り値は (ユーザーのリスト, 次ページのカーソル) で、次ページが無い場合カーソルは None です。
+    投稿数・いいね数は投稿・いいねの書き込みで増減させている列から読みます。
+    """
+    where = []
+    params = []
+    if exclude_nickname:
+        where.append('nickname != ?')
+        params.append(exclude_nickname)
+    if nickname_prefix:
+        sort_field = 'nickname'
+        order = 'nickname, id'
+        where.append('nickname >= ? AND nickname < ?')
+        params += [nickname_prefix, nickname_prefix + '\uffff']
+        if start_after:
+            where.append('(nickname, id) > (?, ?)')
+            params += list(start_after)
+    else:
+        sort_field = 'created_at'
+        order = 'created_at DESC, id DESC'
+        if start_after:
+            created_at, user_id = start_after
+            where.append('(created_at, id) < (?, ?)')
+            params += [_format_ts(created_at), user_id]
+
+    # 1件多く取得して次ページの有無を判定する
+    where_sql = f' WHERE {" AND ".join(where)}' if where else ''
+    rows = _connect().execute(
+        f'SELECT id, nickname, created_at, post_count, like_count FROM users{where_sql} ORDER BY {order} LIMIT ?',
+        params + [page_size + 1]
+    ).fetchall()
+    users = [_row_to_dict(row) for row in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size and users:
+        last = users[-1]
+        next_cursor = (last[sort_field], last['id'])
+    return users, next_cursor
+
+def increment_session_version(user_id):
+    """ユーザーのセッションのバージョンを1つ上げます。"""
+    with _transaction() as conn:
+        conn.execute('UPDATE users SET session_version = session_version + 1 WHERE id = ?', (user_id,))
+
+def delete_user_cascade(user_id):
+    """ユーザーと、その投稿・投稿へのいいね・ユーザーが付けたいいねを1つのトランザクションで削除します。
+
+    ユーザーがいいねしていた他人の投稿は like_count を減らします。
+    戻り値は (削除した投稿のリスト, like_count を減らした投稿IDのリスト) です (画像の削除は呼び出し側で行う)。
+    """
+    with _transaction() as conn:
+        posts = [_row_to_dict(row) for row in conn.execute('SELECT * FROM posts WHERE user_id = ?', (user_id,))]
+        rows = conn.execute(
+            'SELECT post_id FROM likes WHERE user_id = ?'
+            ' AND post_id NOT IN (SELECT id FROM posts WHERE user_id = ?)', (user_id, user_id)
+        ).fetchall()
+        metrics.add_reads(len(rows))
+        # いいね数が減る投稿の店舗も集計し直す
+        shop_keys = {row[0] for row in conn.execute(
+            'SELECT DISTINCT shop_key FROM posts WHERE id IN (SELECT post_id FROM likes WHERE user_id = ?)', (user_id,)
+        )}
+        conn.execute(
+            'UPDATE posts SET like_count = like_count - 1, updated_at = ?'
+            ' WHERE user_id != ? AND id IN (SELECT post_id FROM likes WHERE user_id = ?)',
+            (_format_ts(_now()), user_id, user_id)
+        )
+        # ユーザーの投稿にいいねしていた他のユーザーのいいね数を減らす
+        conn.execute(
+            'UPDATE users SET like_count = like_count - (SELECT COUNT(*) FROM likes JOIN posts ON posts.id = likes.post_id'
+            '  WHERE likes.user_id = users.id AND posts.user_id = ?)'
+            ' WHERE id != ? AND id IN (SELECT likes.user_id FROM likes JOIN posts ON posts.id = likes.post_id'
+            '  WHERE posts.user_id = ?)',
+            (user_id, user_id, user_id)
+        )
+        conn.execute('DELETE FROM likes WHERE post_id IN (SELECT id FROM posts WHERE user_id = ?)', (user_id,))
+        conn.execute('DELETE FROM likes WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM search_terms WHERE post_id IN (SELECT id FROM posts WHERE user_id = ?)', (user_id,))
+        conn.execute('DELETE FROM posts WHERE user_id = ?', (user_id,))
+        for key in shop_keys | {search.shop_key(post['shop_name']) for post in posts}:
+            _refresh_shop(conn, key)
+        conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    return posts, [row['post_id'] for row in rows]
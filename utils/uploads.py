@@ -0,0 +1,137 @@
+# utils/uploads.py
+# 投稿画像のアップロードをバックグラウンドのスレッドプールで行う。
+# 投稿はドキュメントの書き込みだけで先に作成して(状態は 'processing')すぐに投稿者へ返し、
+# 元画像とリサイズ済み画像のアップロードが終わったら 'ready' に切り替える。
+# 昼休みに投稿が集中してもプロセスのスレッドやメモリを使い切らないよう、
+# 同時に実行するアップロード数と、待ち行列に積める件数に上限を設ける。
+#
+# 画像は内容のハッシュをキーにして images/{キー}{拡張子} に保存する。同じ画像(セットメニューの共有写真など)は
+# 一度だけ保存し、参照する投稿の数を数えて、最後の投稿が削除されたときに画像を削除する。
+# 内容が変わらない限りパスも変わらないため、配信時はブラウザやCDNに無期限でキャッシュさせる。
+#
+# 環境変数:
+#   LUNCH_SNS_UPLOAD_CONCURRENCY   同時に実行するアップロードの上限 (既定: 4、全セッションの合計)
+#   LUNCH_SNS_UPLOAD_QUEUE_LIMIT   実行中と待機中を合わせたアップロードの上限 (既定: 32)
+
+import datetime
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import db, image, metrics
+
+UPLOAD_CONCURRENCY = int(os.environ.get('LUNCH_SNS_UPLOAD_CONCURRENCY', '4'))
+UPLOAD_QUEUE_LIMIT = int(os.environ.get('LUNCH_SNS_UPLOAD_QUEUE_LIMIT', '32'))
+UPLOAD_ATTEMPTS = 3 # 1つの画像のアップロードを試みる回数
+RETRY_BACKOFF = 1.0 # 再試行までの待ち時間(秒)。試行ごとに2倍にする
+STALE_AFTER = datetime.timedelta(minutes=10) # これより古い 'processing' の投稿は失敗とみなす
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable' # 内容で決まるパスの画像の Cache-Control
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix='upload')
+_slots = threading.BoundedSemaphore(UPLOAD_QUEUE_LIMIT)
+_lock = threading.Lock()
+_pending = {} # ユーザーID -> 処理中のアップロード数
+
+
+def image_key(data, ext):
+    """画像の内容と拡張子から、保存先のキーと正規化した拡張子を返します。"""
+    ext = ext.lower()
+    if ext == '.jpeg':
+        ext = '.jpg'
+    return hashlib.sha256(ext.encode() + data).hexdigest(), ext
+
+def submit_post(user_id, nickname, comment, shop_name, price, ext, data, content_type):
+    """投稿を 'processing' の状態で作成し、画像のアップロードをバックグラウンドで開始します。
+
+    作成した投稿のIDを返します。アップロードが上限まで積まれている場合は投稿を作成せずに None を返します。
+    """
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        key, ext = image_key(data, ext)
+        image_path = f"images/{key}{ext}"
+        post_id = db.create_post(user_id, nickname, comment, image_path, shop_name, price,
+                                 image_variants={}, status='processing', image_key=key)
+        with _lock:
+            _pending[user_id] = _pending.get(user_id, 0) + 1
+        # 計測が投稿した画面の再実行に割り当てられるよう、コンテキストを引き継ぐ
+        context = metrics.current_context()
+        _executor.submit(context.run, _process, post_id, user_id, key, image_path, data, content_type)
+    except Exception:
+        _slots.release()
+        raise
+    return post_id
+
+def _upload(path, data, content_type):
+    """画像をアップロードします。失敗した場合は待ち時間を延ばしながら再試行します。"""
+    for attempt in range(UPLOAD_ATTEMPTS):
+        try:
+            db.upload_image(path, data, content_type, cache_control=IMMUTABLE_CACHE_CONTROL)
+            return
+        except Exception as e:
+            if attempt == UPLOAD_ATTEMPTS - 1:
+                raise
+            print(f"Upload of {path} failed (attempt {attempt + 1}): {e}")
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+def _process(post_id, user_id, key, image_path, data, content_type):
+    uploaded = []
+    try:
+        ref = db.get_image_ref(key)
+        if ref is not None and ref.get('image_variants') is not None:
+            # 同じ画像がアップロード済みの場合は保存済みの画像を使う
+            image_variants = ref['image_variants']
+        else:
+            # 同じ画像を同時にアップロードしている場合があるが、内容が同じなので上書きしても問題ない
+            _upload(image_path, data, content_type)
+            uploaded.append(image_path)
+
+            # サムネイルなどのリサイズ済み画像を生成し、元画像の隣に保存する
+            image_variants = {}
+            try:
+                for name, variant_data in image.create_variants(data).items():
+                    variant_path = f"images/{key}_{name}{image.VARIANT_EXT}"
+                    _upload(variant_path, variant_data, image.VARIANT_CONTENT_TYPE)
+                    uploaded.append(variant_path)
+                    image_variants[name] = variant_path
+            except Exception as e:
+                # 生成に失敗しても元画像で表示できるので投稿は続行する
+                print(f"Error creating image variants: {e}")
+            db.complete_image_ref(key, image_variants)
+
+        if not db.update_post_image(post_id, 'ready', image_variants):
+            # アップロード中に投稿が削除され、画像を参照する投稿が無くなった場合は残った画像を片付ける
+            if uploaded and db.get_image_ref(key) is None:
+                db.delete_images(*uploaded)
+    except Exception as e:
+        print(f"Error uploading image for post {post_id}: {e}")
+        try:
+            db.update_post_image(post_id, 'failed')
+        except Exception as e:
+            print(f"Error marking post {post_id} as failed: {e}")
+    finally:
+        with _lock:
+            _pending[user_id] -= 1
+            if not _pending[user_id]:
+                del _pending[user_id]
+        _slots.release()
+
+def pending_count(user_id):
+    """ユーザーの処理中のアップロード数を返します。"""
+    with _lock:
+        return _pending.get(user_id, 0)
+
+def image_status(post):
+    """投稿の画像の状態 ('processing' / 'ready' / 'failed') を返します。
+
+    状態を持たない(機能を追加する前の)投稿は 'ready' とみなします。
+    プロセスの再起動などでアップロードが途切れ、長く 'processing' のままの投稿は 'failed' とみなします。
+    """
+    status = post.get('status') or 'ready'
+    if status == 'processing':
+        created_at = post.get('created_at')
+        if isinstance(created_at, datetime.datetime) and created_at.tzinfo is not None:
+            if datetime.datetime.now(datetime.timezone.utc) - created_at > STALE_AFTER:
+                return 'failed'
+    return status